@@ -0,0 +1,102 @@
+"""
+Benchmarks of the hot paths of the plugin, run headless:
+
+    pip install -e .[benchmark]
+    QT_QPA_PLATFORM=offscreen pytest benchmarks --benchmark-autosave
+
+and compared with a previous run with `--benchmark-compare`. Synthetic
+multichannel TIFFs of several sizes, dtypes and compressions are written
+once per session in a temporary directory.
+"""
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# side of the (square) planes
+SIZES = {'small': 512, 'large': 2048}
+DTYPES = ['uint8', 'uint16', 'float32']
+COMPRESSIONS = [None, 'zlib']
+N_CHANNELS = 4
+
+
+def synthetic_planes(shape, dtype, seed=0):
+    # the planes of `synthetic_image`, one at a time: smooth blobs over noise, so that compression behaves as on real images
+    rng = np.random.default_rng(seed)
+    y, x = np.ogrid[:shape[-2], :shape[-1]]
+    # float32 planes, a whole stack of float64 intermediates does not fit in memory for the large sizes
+    blobs = ((np.sin(y / 37.0) * np.cos(x / 23.0) + 1) * 0.4).astype(np.float32)
+    scale = 1 if np.dtype(dtype).kind == 'f' else np.iinfo(dtype).max
+    for _ in np.ndindex(*shape[:-2]):
+        plane = rng.random(shape[-2:], np.float32)
+        plane *= 0.2
+        plane += blobs
+        plane *= scale
+        yield plane.astype(dtype)
+
+
+def synthetic_image(shape, dtype, seed=0):
+    image = np.empty(shape, dtype)
+    planes = image.reshape((-1,) + tuple(shape[-2:]))
+    for idx, plane in enumerate(synthetic_planes(shape, dtype, seed)):
+        planes[idx] = plane
+    return image
+
+
+@pytest.fixture(scope='session')
+def tiff_factory(tmp_path_factory):
+    """`make(size, dtype, compression, n_planes, n_channels)` returns the path of a (Z)CYX TIFF, written once."""
+    from tifffile import imwrite
+
+    directory = tmp_path_factory.mktemp('tiffs')
+    paths = {}
+
+    def make(size='small', dtype='uint16', compression=None, n_planes=1, n_channels=N_CHANNELS):
+        key = (size, dtype, compression, n_planes, n_channels)
+        if key not in paths:
+            side = SIZES[size]
+            shape = (n_channels, side, side) if n_planes == 1 else (n_planes, n_channels, side, side)
+            path = directory / f"{size}_{dtype}_{compression or 'raw'}_{n_planes}x{n_channels}.tif"
+            # written as the planes are generated
+            imwrite(path, synthetic_planes(shape, dtype), shape=shape, dtype=dtype, photometric='minisblack',
+                    compression=compression, metadata={'axes': 'CYX' if n_planes == 1 else 'ZCYX'})
+            paths[key] = str(path)
+        return paths[key]
+
+    return make
+
+
+@pytest.fixture
+def peak_memory(benchmark):
+    """`peak_memory(function, *args)` runs `function` once with tracemalloc and records its peak, in MB.
+
+    The peak is stored in the `extra_info` of the benchmark (tracemalloc slows
+    the calls down, this call is not part of the timings).
+    """
+    def measure(function, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            result = function(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_memory_mb'] = round(peak / 2 ** 20, 2)
+        return result
+
+    return measure
+
+
+@pytest.fixture
+def figure_widget(qtbot, tmp_path, monkeypatch):
+    from napari.components import ViewerModel
+
+    from napari_figure.figure_widget import FigureWidget
+
+    monkeypatch.setenv("NAPARI_FIGURE_CACHE_DIR", str(tmp_path / "cache"))
+    widget = FigureWidget(ViewerModel())
+    qtbot.addWidget(widget)
+    return widget
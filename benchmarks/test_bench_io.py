@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+from qtpy.QtCore import Qt
+
+from conftest import COMPRESSIONS, DTYPES, SIZES
+
+from napari_figure.image_io import channel_views, load_image, probe_image
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("size", SIZES)
+def test_probe_image(benchmark, peak_memory, tiff_factory, size, compression):
+  path = tiff_factory(size, 'uint16', compression)
+  peak_memory(probe_image, path)
+  info = benchmark(probe_image, path)
+  assert info.n_channels == 4
+
+
+@pytest.mark.parametrize("lazy", [True, False], ids=["lazy", "eager"])
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("size", SIZES)
+def test_read_one_channel(benchmark, peak_memory, tiff_factory, size, dtype, compression, lazy):
+  # what a montage needs: open the file and read one channel
+  path = tiff_factory(size, dtype, compression)
+
+  def read():
+    return np.asarray(channel_views(load_image(path, lazy=lazy), 0)[1])
+
+  peak_memory(read)
+  assert benchmark(read).shape == (SIZES[size], SIZES[size])
+
+
+@pytest.mark.parametrize("lazy", [True, False], ids=["lazy", "eager"])
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("size", SIZES)
+def test_load_selected_file(benchmark, peak_memory, qtbot, figure_widget, tiff_factory, size, compression, lazy):
+  path = tiff_factory(size, 'uint16', compression, n_planes=8)
+  figure_widget.params.selected_directory, figure_widget.params.selected_file = os.path.split(path)
+  figure_widget.params.channel_axis_value = 1
+  figure_widget.params.lazy_loading = lazy
+
+  def load():
+    figure_widget.load_selected_file()
+    qtbot.waitUntil(lambda: figure_widget.load_worker is None, timeout=60000)
+
+  peak_memory(load)
+  benchmark.pedantic(load, rounds=5, iterations=1)
+  assert len(figure_widget.viewer.layers) == 4
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_update_selected_file(benchmark, qtbot, figure_widget, tiff_factory, size):
+  # selecting a file shows its shape, probed in a worker
+  path = tiff_factory(size, 'uint16', None)
+  selector = figure_widget.file_selector
+  figure_widget.params.selected_directory = os.path.dirname(path)
+  selector.update_file_list()
+  qtbot.waitUntil(lambda: selector.index_worker is None, timeout=60000)
+  row = [selector.file_list.item(idx).data(Qt.UserRole) for idx in range(selector.file_list.count())].index(os.path.basename(path))
+
+  def select():
+    selector.file_list.clearSelection()
+    selector.shape_value.setText('')
+    selector.file_list.item(row).setSelected(True)
+    qtbot.waitUntil(lambda: selector.shape_value.text() != '', timeout=60000)
+
+  benchmark.pedantic(select, rounds=10, iterations=1)
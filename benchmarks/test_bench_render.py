@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from conftest import DTYPES, SIZES, synthetic_image
+
+from napari_figure import colormaps
+from napari_figure.export import export_montage
+from napari_figure.montage import apply_lut, default_panels, lookup_table, render_montage
+
+BIOP = list(colormaps.BIOP_COLORS)
+
+
+@pytest.mark.parametrize("name", ["biop_amber", "magma"])
+def test_build_colormap(benchmark, name):
+  # napari colormaps (magma) go through ensure_colormap
+  def build():
+    colormaps._luts.pop(name, None)
+    return colormaps.get_lut(name)
+
+  assert benchmark(build).shape[1] == 4
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "uint16"])
+def test_lookup_table(benchmark, dtype):
+  lut = colormaps.get_lut("biop_azure")
+  table, _ = benchmark(lookup_table, lut, (0, 1000), dtype)
+  assert table.shape == (np.iinfo(dtype).max + 1, 3)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("size", SIZES)
+def test_apply_lut(benchmark, peak_memory, size, dtype):
+  image = synthetic_image((SIZES[size], SIZES[size]), dtype)
+  lut = colormaps.get_lut("biop_amber")
+  limits = (0, 1) if dtype == 'float32' else (0, np.iinfo(dtype).max)
+  peak_memory(apply_lut, image, lut, limits)
+  assert benchmark(apply_lut, image, lut, limits).dtype == np.uint8
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_render_montage(benchmark, peak_memory, size):
+  images = list(synthetic_image((4, SIZES[size], SIZES[size]), 'uint16'))
+  luts = [colormaps.get_lut(name) for name in BIOP[:4]]
+  arguments = (images, luts, [(0, 65535)] * 4, 2, 3)
+  peak_memory(render_montage, *arguments, spacing=3)
+  assert benchmark(render_montage, *arguments, spacing=3).ndim == 3
+
+
+@pytest.mark.parametrize("extension", ["png", "tif"])
+def test_export_montage(benchmark, peak_memory, tmp_path, tiff_factory, extension):
+  from napari_figure.image_io import channel_views, load_image
+
+  channels = channel_views(load_image(tiff_factory('large', 'uint16', None), lazy=True), 0)
+  luts = [colormaps.get_lut(name) for name in BIOP[:4]]
+  arguments = (tmp_path / f"montage.{extension}", channels, luts, [(0, 65535)] * 4, 2, 3)
+  peak_memory(export_montage, *arguments, spacing=3, panels=default_panels(4), max_size=2048)
+  benchmark.pedantic(export_montage, arguments, dict(spacing=3, panels=default_panels(4), max_size=2048),
+                     rounds=3, iterations=1)
+
+
+@pytest.mark.parametrize("engine", ["numpy", "microfilm"])
+@pytest.mark.parametrize("size", SIZES)
+def test_create_montage_image(benchmark, peak_memory, figure_widget, size, engine):
+  if engine == "microfilm" and size == "large":
+    # matplotlib needs several GB for 2048 x 2048 panels, more than the machines running the benchmarks have
+    pytest.skip("microfilm montages of large images")
+  viewer = figure_widget.viewer
+  for idx, channel in enumerate(synthetic_image((4, SIZES[size], SIZES[size]), 'uint16')):
+    viewer.add_image(channel, colormap=BIOP[idx], contrast_limits=[0, 65535])
+  figure_widget.params.montage_engine = engine
+  figure_widget.params.montage_rows, figure_widget.params.montage_columns = 2, 3
+
+  def create():
+    # from scratch, the cached channels and panels of the previous round are dropped
+    figure_widget.render_cache.clear()
+    figure_widget.create_montage_image(notify=False)
+
+  peak_memory(create)
+  benchmark.pedantic(create, rounds=3 if engine == "microfilm" else 10, iterations=1)
+  assert figure_widget.montage_image is not None
+
+
+def test_update_one_channel_of_the_montage(benchmark, figure_widget):
+  # incremental rendering: only the changed channel is colored again
+  viewer = figure_widget.viewer
+  for idx, channel in enumerate(synthetic_image((6, 2048, 2048), 'uint16')):
+    viewer.add_image(channel, colormap=BIOP[idx], contrast_limits=[0, 65535])
+  figure_widget.params.montage_rows, figure_widget.params.montage_columns = 2, 4
+  figure_widget.create_montage_image(notify=False)
+  limits = iter(range(1000, 65535))
+
+  def update():
+    viewer.layers[3].contrast_limits = [0, next(limits)]
+    figure_widget.create_montage_image(notify=False)
+
+  benchmark(update)
@@ -0,0 +1,81 @@
+"""
+Scaling of the decoding and of the coloring with the number of threads, on
+6-channel zlib compressed stacks. Compare the rounds of each group:
+
+    QT_QPA_PLATFORM=offscreen pytest benchmarks/test_bench_threads.py --benchmark-group-by=group
+
+Counts above the number of cores of the machine show the cost of oversubscription.
+"""
+import os
+
+import pytest
+
+from conftest import SIZES, synthetic_image
+
+from napari_figure import colormaps
+from napari_figure.export import export_montage
+from napari_figure.image_io import channel_views, iter_load_image, load_image
+from napari_figure.montage import default_panels, render_montage
+
+THREADS = [1, 2, 4, 8, 16]
+N_CHANNELS = 6
+BIOP = list(colormaps.BIOP_COLORS)
+
+
+def consume(generator):
+  while True:
+    try:
+      next(generator)
+    except StopIteration as stop:
+      return stop.value
+
+
+@pytest.fixture(autouse=True)
+def cores(benchmark):
+  benchmark.extra_info['cpu_count'] = os.cpu_count()
+
+
+@pytest.mark.parametrize("threads", THREADS)
+def test_decode_stack(benchmark, tiff_factory, threads):
+  # the eager loading of the widget: planes decoded in parallel
+  path = tiff_factory('large', 'uint16', 'zlib', n_planes=4, n_channels=N_CHANNELS)
+  benchmark.group = "decode 4 x 6 x 2048 x 2048 zlib"
+  benchmark.extra_info['threads'] = threads
+  image = benchmark.pedantic(lambda: consume(iter_load_image(path, lazy=False, workers=threads)), rounds=3, iterations=1)
+  assert image.shape == (4, N_CHANNELS, 2048, 2048)
+
+
+@pytest.mark.parametrize("threads", THREADS)
+def test_decode_tiles(benchmark, tmp_path_factory, threads):
+  # tiles of one large plane per channel, decoded by tifffile
+  from tifffile import imwrite
+
+  path = tmp_path_factory.getbasetemp() / "tiled_6x4096.tif"
+  if not path.exists():
+    imwrite(path, synthetic_image((N_CHANNELS, 4096, 4096), 'uint16'), photometric='minisblack',
+            compression='zlib', tile=(512, 512))
+  benchmark.group = "decode 6 x 4096 x 4096 zlib tiles"
+  benchmark.extra_info['threads'] = threads
+  image = benchmark.pedantic(load_image, (path,), dict(lazy=False, workers=threads), rounds=3, iterations=1)
+  assert image.shape == (N_CHANNELS, 4096, 4096)
+
+
+@pytest.mark.parametrize("threads", THREADS)
+def test_color_channels(benchmark, threads):
+  images = list(synthetic_image((N_CHANNELS, SIZES['large'], SIZES['large']), 'uint16'))
+  luts = [colormaps.get_lut(name) for name in BIOP]
+  benchmark.group = "color 6 x 2048 x 2048 channels"
+  benchmark.extra_info['threads'] = threads
+  montage = benchmark(render_montage, images, luts, [(0, 65535)] * N_CHANNELS, 2, 4, spacing=3, workers=threads)
+  assert montage.ndim == 3
+
+
+@pytest.mark.parametrize("threads", THREADS)
+def test_export_channels(benchmark, tmp_path, tiff_factory, threads):
+  channels = channel_views(load_image(tiff_factory('large', 'uint16', None, n_channels=N_CHANNELS), lazy=True), 0)
+  luts = [colormaps.get_lut(name) for name in BIOP]
+  benchmark.group = "export 6 x 2048 x 2048, downsampled"
+  benchmark.extra_info['threads'] = threads
+  arguments = (tmp_path / "montage.tif", channels, luts, [(0, 65535)] * N_CHANNELS, 2, 4)
+  benchmark.pedantic(export_montage, arguments, dict(spacing=3, panels=default_panels(N_CHANNELS), max_size=2048,
+                                                     workers=threads), rounds=3, iterations=1)
@@ -1,7 +1,12 @@
-
 try:
     from ._version import version as __version__
 except ImportError:
     __version__ = "unknown"
-    
-from .figure_widget import FigureWidget
\ No newline at end of file
+
+
+def __getattr__(name):
+    # the widget (and Qt) is only imported when asked for, so that the batch runner stays headless
+    if name == "FigureWidget":
+        from .figure_widget import FigureWidget
+        return FigureWidget
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
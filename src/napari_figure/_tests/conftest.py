@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path_factory, monkeypatch):
+  # the file indexes and the render store of the tests are not kept in the user cache directory
+  monkeypatch.setenv("NAPARI_FIGURE_CACHE_DIR", str(tmp_path_factory.mktemp("cache")))
@@ -0,0 +1,97 @@
+import numpy as np
+from tifffile import imwrite
+
+from napari_figure.batch import find_files, main
+
+
+def make_files(directory):
+  rng = np.random.default_rng(0)
+  for idx in range(3):
+    data = rng.integers(0, 4096, (3, 32, 32), dtype=np.uint16)
+    imwrite(directory / f"image_{idx}.tif", data, imagej=True, metadata={'axes': 'CYX'})
+  (directory / "notes.txt").write_text("not an image")
+
+
+def test_find_files(tmp_path):
+  make_files(tmp_path)
+  files = find_files(str(tmp_path))
+  assert [f.rsplit("/", 1)[-1] for f in files] == ["image_0.tif", "image_1.tif", "image_2.tif"]
+  assert find_files(str(tmp_path / "image_1*")) == files[1:2]
+
+
+def test_batch_is_deterministic(tmp_path, capsys):
+  make_files(tmp_path)
+  # without the render cache, the second run would copy the montages of the first one
+  arguments = [str(tmp_path), "--channels-LUTs", "biop_azure,biop_amber,gray", "--channels-maxs", "4095,4095,4095",
+               "--rows", "1", "--columns", "4", "--cache-size", "0"]
+
+  assert main(arguments + ["-o", str(tmp_path / "serial"), "-j", "1"]) == 0
+  assert main(arguments + ["-o", str(tmp_path / "parallel"), "-j", "2"]) == 0
+
+  summary = capsys.readouterr().out
+  assert "3 files (0 failed)" in summary and "from the render cache" not in summary
+  for idx in range(3):
+    serial = (tmp_path / "serial" / f"image_{idx}_montage.png").read_bytes()
+    parallel = (tmp_path / "parallel" / f"image_{idx}_montage.png").read_bytes()
+    assert serial == parallel
+
+
+def test_batch_projects_z_stacks(tmp_path):
+  data = np.zeros((4, 2, 16, 16), np.uint8)
+  data[1, :, 4:8, 4:8] = 255
+  imwrite(tmp_path / "zcyx.tif", data, imagej=True, metadata={'axes': 'ZCYX'})
+  output = tmp_path / "out"
+
+  assert main([str(tmp_path), "-o", str(output), "--format", "tif", "--projection", "max", "-j", "1",
+               "--rows", "1", "--columns", "3", "--spacing", "0"]) == 0
+  from tifffile import imread
+  assert imread(output / "zcyx_montage.tif").max() > 0
+
+
+def test_batch_timings_json(tmp_path):
+  import json
+
+  make_files(tmp_path)
+  log = tmp_path / "timings.json"
+  assert main([str(tmp_path), "-o", str(tmp_path / "out"), "-j", "1", "--timings-json", str(log)]) == 0
+
+  files = json.loads(log.read_text())["files"]
+  assert len(files) == 3
+  stages = {record["name"] for record in files[0]["stages"]}
+  assert {"load", "contrast", "read", "colormap", "encode"} <= stages
+  assert files[0]["total_seconds"] >= sum(record["seconds"] for record in files[0]["stages"])
+
+
+def test_batch_ome_zarr_reads_pyramid_level(tmp_path):
+  from tifffile import imread
+
+  from .test_image_io import write_ome_zarr
+
+  write_ome_zarr(tmp_path / "image.zarr", np.full((2, 256, 256), 100, np.uint16))
+  assert [f.rsplit("/", 1)[-1] for f in find_files(str(tmp_path))] == ["image.zarr"]
+
+  output = tmp_path / "out"
+  assert main([str(tmp_path), "-o", str(output), "--format", "tif", "-j", "1", "--rows", "1", "--columns", "3",
+               "--spacing", "0", "--max-size", "192"]) == 0
+  assert imread(output / "image_montage.tif").shape == (64, 192, 3)
+
+
+def test_batch_renders_changed_files_only(tmp_path, capsys):
+  make_files(tmp_path)
+  arguments = [str(tmp_path), "-o", str(tmp_path / "out"), "-j", "1", "--cache-dir", str(tmp_path / "cache")]
+
+  assert main(arguments) == 0
+  first = (tmp_path / "out" / "image_0_montage.png").read_bytes()
+  imwrite(tmp_path / "image_1.tif", np.zeros((3, 32, 32), np.uint16), imagej=True, metadata={'axes': 'CYX'})
+  capsys.readouterr()
+  assert main(arguments) == 0
+
+  summary = capsys.readouterr().out
+  assert "3 files (0 failed)" in summary and "2 from the render cache" in summary
+  assert (tmp_path / "out" / "image_0_montage.png").read_bytes() == first
+
+  # other settings, every file is rendered again
+  assert main(arguments + ["--rows", "1"]) == 0
+  assert "from the render cache" not in capsys.readouterr().out
+  assert main(arguments + ["--cache-size", "0"]) == 0
+  assert "from the render cache" not in capsys.readouterr().out
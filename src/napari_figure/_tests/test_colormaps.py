@@ -0,0 +1,30 @@
+import numpy as np
+from napari.utils.colormaps import AVAILABLE_COLORMAPS, ensure_colormap
+
+from napari_figure import colormaps
+
+
+def test_biop_lut_is_cached_and_shared():
+  lut = colormaps.get_lut('biop_amber')
+  assert lut.shape == (256, 4)
+  assert lut.dtype == np.float32
+  assert colormaps.get_lut('biop_amber') is lut
+  np.testing.assert_allclose(lut[-1], [1.0, 0.5, 0.0, 1.0])
+
+  np.testing.assert_allclose(colormaps.as_matplotlib('biop_amber')(255), lut[-1])
+  np.testing.assert_allclose(colormaps.as_vispy('biop_amber').colors.rgba[-1], lut[-1])
+  assert colormaps.get_lut_uint8('biop_amber')[-1].tolist() == [255, 128, 0, 255]
+
+
+def test_napari_colormaps_fallback():
+  np.testing.assert_allclose(colormaps.get_lut('cyan')[-1], [0, 1, 1, 1])
+
+
+def test_register_custom_colormap():
+  colormaps.register_napari_colormaps()
+  assert 'biop_azure' in AVAILABLE_COLORMAPS
+
+  colormaps.register_colormap('test_orange', (1.0, 0.6, 0.0))
+  assert colormaps.is_registered('test_orange')
+  assert 'test_orange' in AVAILABLE_COLORMAPS
+  np.testing.assert_allclose(ensure_colormap('test_orange').map([1.0])[0], [1.0, 0.6, 0.0, 1.0], atol=1e-6)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from tifffile import imwrite
+
+from napari_figure.comparison import comparison_inputs, load_rows, render_comparison
+from napari_figure.contrast import channel_histogram, merge_histograms
+from napari_figure.settings import Params
+
+
+def make_conditions(directory):
+  paths = []
+  for idx, brightness in enumerate([1000, 3000]):
+    data = np.zeros((2, 16, 16), np.uint16)
+    data[:, 4:12, 4:12] = brightness
+    path = directory / f"condition_{idx}.tif"
+    imwrite(path, data, imagej=True, metadata={'axes': 'CYX'})
+    paths.append(str(path))
+  return paths
+
+
+def test_comparison_grid_shares_contrast_limits(tmp_path):
+  params = Params(channel_axis_value=None, auto_contrast='minmax', montage_spacing=0)
+  params.channels_LUTs = "gray,gray"
+  rows = load_rows(make_conditions(tmp_path), params, workers=2)
+
+  images, luts, limits, panels, n_rows, n_cols = comparison_inputs(rows, params)
+  assert (n_rows, n_cols) == (2, 3)
+  assert panels == [[0], [1], [0, 1], [2], [3], [2, 3]]
+  assert limits[0] == limits[2] == [0, 3000]
+
+  figure = render_comparison(rows, params)
+  assert figure.shape == (32, 48, 3)
+  # the dim condition stays dim, the bright one is saturated
+  assert 0 < figure[8, 8, 0] < 255
+  assert figure[24, 8, 0] == 255
+
+
+def test_files_with_different_shapes_are_rejected(tmp_path):
+  imwrite(tmp_path / "a.tif", np.zeros((2, 16, 16), np.uint8))
+  imwrite(tmp_path / "b.tif", np.zeros((2, 8, 8), np.uint8))
+  with pytest.raises(ValueError):
+    load_rows([str(tmp_path / "a.tif"), str(tmp_path / "b.tif")], Params(channel_axis_value=0))
+
+
+def test_merge_histograms():
+  merged = merge_histograms([channel_histogram(np.array([[10, 20]], np.uint16)),
+                             channel_histogram(np.array([[15, 40]], np.uint16))])
+  assert merged.counts.sum() == 4
+  assert merged.percentile(0) == 10 and merged.percentile(100, upper=True) == 40
+
+  merged = merge_histograms([channel_histogram(np.array([[0.0, 1.0]])), channel_histogram(np.array([[2.0, 3.0]]))])
+  assert merged.percentile(0) == 0 and merged.percentile(100, upper=True) == pytest.approx(3)
+
+
+def test_rows_are_stored(tmp_path, monkeypatch):
+  from napari_figure import comparison
+  from napari_figure.render_store import RenderStore
+
+  params = Params(channel_axis_value=None, auto_contrast='minmax', montage_spacing=0)
+  paths = make_conditions(tmp_path)
+  store = RenderStore(tmp_path / "store")
+  rows = load_rows(paths, params, workers=1, store=store)
+
+  read = []
+  original = comparison._read_row
+  monkeypatch.setattr(comparison, "_read_row", lambda path, *args: read.append(path) or original(path, *args))
+  imwrite(paths[1], np.full((2, 16, 16), 5, np.uint16), imagej=True, metadata={'axes': 'CYX'})
+  again = load_rows(paths, params, workers=1, store=store)
+
+  # only the modified file is read again
+  assert read == [paths[1]]
+  np.testing.assert_array_equal(again[0].planes[0], rows[0].planes[0])
+  assert again[0].histograms[0].percentile(100) == rows[0].histograms[0].percentile(100)
+  assert again[1].planes[0].max() == 5
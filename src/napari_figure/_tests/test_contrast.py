@@ -0,0 +1,43 @@
+import numpy as np
+
+from napari_figure import contrast
+
+
+def test_auto_contrast_limits_methods():
+  image = np.zeros((2, 100, 100), np.uint16)
+  image[0] = np.arange(10000).reshape(100, 100)
+  image[1, 0, 0] = 4000
+
+  assert contrast.auto_contrast_limits(image, 0, 'minmax') == [[0, 9999], [0, 4000]]
+  low, high = contrast.auto_contrast_limits(image, 0, 'percentile', (1, 99))[0]
+  assert 90 <= low <= 110
+  assert 9890 <= high <= 9910
+
+
+def test_subsample_skips_planes_first():
+  stack = np.zeros((100, 64, 64), np.uint8)
+  sample = contrast.subsample(stack, max_samples=10 * 64 * 64)
+  assert sample.shape == (10, 64, 64)
+  assert np.shares_memory(sample, stack)
+
+
+def test_float_histogram():
+  image = np.linspace(-1, 1, 10000, dtype=np.float32).reshape(100, 100)
+  low, high = contrast.auto_contrast_limits(image, None, 'minmax')[0]
+  assert low == -1
+  assert high == 1
+
+
+def test_histograms_are_cached_per_file(tmp_path, monkeypatch):
+  path = tmp_path / "image.tif"
+  path.write_bytes(b"0")
+  image = np.ones((2, 8, 8), np.uint8)
+
+  calls = []
+  compute = contrast.channel_histogram
+  monkeypatch.setattr(contrast, "channel_histogram", lambda data: calls.append(1) or compute(data))
+
+  first = contrast.auto_contrast_limits(image, 0, key=contrast.file_key(path))
+  again = contrast.auto_contrast_limits(image, 0, 'minmax', key=contrast.file_key(path))
+  assert len(calls) == 2
+  assert first == again
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from tifffile import imread
+
+from napari_figure.export import downsample, downsample_factor, export_montage, montage_level
+from napari_figure.montage import render_montage
+
+GRAY = np.stack([np.linspace(0, 1, 256)] * 3, axis=1)
+RED = np.zeros((256, 3))
+RED[:, 0] = np.linspace(0, 1, 256)
+
+
+def test_downsample_averages_areas():
+  image = np.arange(25, dtype=np.uint16).reshape(5, 5)
+  small = downsample(image, 2)
+  assert small.shape == (3, 3)
+  assert small[0, 0] == np.mean([0, 1, 5, 6])
+  # blocks cut by the edges
+  assert small[2, 2] == 24
+  assert small[0, 2] == np.mean([4, 9])
+
+
+def test_downsample_factor_fits_max_size():
+  assert downsample_factor((1000, 1000), 2, 4, 3, max_size=0) == 1
+  factor = downsample_factor((1000, 1000), 2, 4, 3, max_size=1000)
+  # 4 x 250 + 3 x 3 = 1009 pixels is still too wide
+  assert factor == 5
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("extension", ["png", "tif"])
+def test_streamed_export_matches_render_montage(tmp_path, extension, workers):
+  rng = np.random.default_rng(0)
+  images = [rng.integers(0, 4096, (50, 30), dtype=np.uint16) for _ in range(2)]
+  arguments = ([GRAY, RED], [(0, 4095), (100, 3000)], 2, 2)
+  path = tmp_path / f"montage.{extension}"
+
+  shape = export_montage(path, images, *arguments, spacing=3, max_size=0, strip_height=16, workers=workers)
+
+  expected = render_montage(images, *arguments, spacing=3)
+  assert shape == expected.shape
+  if extension == "png":
+    import matplotlib.pyplot as plt
+    written = (plt.imread(path)[..., :3] * 255).round().astype(np.uint8)
+  else:
+    written = imread(path)
+  np.testing.assert_array_equal(written, expected)
+
+
+def test_export_is_downsampled(tmp_path):
+  images = [np.full((400, 300), 200, np.uint8)]
+  shape = export_montage(tmp_path / "montage.tif", images, [GRAY], [(0, 255)], 1, 2, spacing=2, max_size=100)
+  assert max(shape[:2]) <= 100
+  written = imread(tmp_path / "montage.tif")
+  assert written.shape == shape
+  np.testing.assert_array_equal(written[0, 0], [200, 200, 200])
+
+
+def test_montage_level():
+  shapes = [(1024, 1024), (512, 512), (256, 256)]
+  assert montage_level(shapes, 1, 2, max_size=0) == 0
+  assert montage_level(shapes, 1, 2, max_size=1024) == 1
+  assert montage_level(shapes, 1, 2, max_size=512) == 2
+  # a downsampling by 5 is 4 (level 2) then 2: too small, the full resolution is downsampled instead
+  assert montage_level(shapes, 1, 2, max_size=410) == 0
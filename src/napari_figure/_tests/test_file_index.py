@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+from tifffile import imwrite
+
+from napari_figure.file_index import DirectoryIndex
+
+
+def test_index_is_incremental(tmp_path):
+  data = tmp_path / "data"
+  data.mkdir()
+  imwrite(data / "a.tif", np.random.randint(0, 255, (3, 200, 100), np.uint8), photometric="minisblack")
+  imwrite(data / "b.tiff", np.zeros((2, 32, 32), np.uint16))
+  (data / "notes.txt").write_text("not an image")
+  (data / "broken.tif").write_bytes(b"not a tiff")
+
+  index = DirectoryIndex(data, cache_dir=tmp_path)
+  assert index.entries() == []
+  scanned = [entry.name for _, _, entry in index.scan()]
+  assert scanned == ["a.tif", "b.tiff", "broken.tif"]
+
+  a, b, broken = DirectoryIndex(data, cache_dir=tmp_path).entries()
+  assert a.shape == (3, 200, 100) and a.dtype == "uint8" and a.n_channels == 3
+  assert a.thumbnail.shape == (50, 25, 3) and a.thumbnail.dtype == np.uint8
+  assert b.n_channels == 2
+  assert broken.error and broken.thumbnail is None
+
+  # nothing changed, nothing is read again
+  assert list(index.scan()) == []
+
+  imwrite(data / "b.tiff", np.zeros((4, 32, 32), np.uint16))
+  os.remove(data / "a.tif")
+  assert [entry.name for _, _, entry in index.scan()] == ["b.tiff"]
+  assert [entry.name for entry in index.entries()] == ["b.tiff", "broken.tif"]
+  assert index.entries()[0].n_channels == 4
+
+
+def test_file_list_shows_indexed_files(qtbot, tmp_path, monkeypatch):
+  from napari.components import ViewerModel
+  from qtpy.QtCore import Qt
+
+  from napari_figure.figure_widget import FigureWidget
+
+  monkeypatch.setenv("NAPARI_FIGURE_CACHE_DIR", str(tmp_path / "cache"))
+  data = tmp_path / "data"
+  data.mkdir()
+  imwrite(data / "a.tif", np.zeros((2, 16, 16), np.uint8))
+
+  widget = FigureWidget(ViewerModel())
+  qtbot.addWidget(widget)
+  selector = widget.file_selector
+  widget.params.selected_directory = str(data)
+  selector.update_file_list()
+  qtbot.waitUntil(lambda: selector.index_worker is None, timeout=5000)
+
+  item = selector.file_list.item(0)
+  assert item.data(Qt.UserRole) == "a.tif"
+  assert "(2, 16, 16) uint8" in item.text()
+  assert not item.icon().isNull()
+
+
+def test_index_ome_zarr(tmp_path):
+  from .test_image_io import write_ome_zarr
+
+  data = tmp_path / "data"
+  data.mkdir()
+  write_ome_zarr(data / "image.zarr", np.zeros((2, 512, 512), np.uint16))
+  (data / "other").mkdir()
+
+  entry, = DirectoryIndex(data, cache_dir=tmp_path).refresh()
+  assert entry.name == "image.zarr"
+  assert entry.shape == (2, 512, 512) and entry.n_channels == 2
+  # read from the 128 x 128 level
+  assert entry.thumbnail.shape == (64, 64, 3)
@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+from tifffile import imwrite
+
+from napari_figure.image_cache import ImageCache, prefetch
+
+
+def write(path, value, shape=(2, 16, 16)):
+  imwrite(path, np.full(shape, value, np.uint8), photometric='minisblack')
+  return str(path)
+
+
+def test_cache_is_bounded_and_lru(tmp_path):
+  paths = [write(tmp_path / f"{idx}.tif", idx) for idx in range(3)]
+  cache = ImageCache(max_bytes=2 * 512)
+
+  assert cache.image(paths[0]) is None
+  assert cache.load(paths[0])[0, 0, 0] == 0
+  cache.load(paths[1])
+  # 0 is used again, 1 is then the least recently used
+  assert cache.image(paths[0]) is not None
+  cache.load(paths[2])
+  assert paths[1] not in cache and paths[0] in cache and paths[2] in cache
+  assert cache.n_bytes == 2 * 512
+
+  cache.max_bytes = 512
+  assert len(cache) == 1 and paths[2] in cache
+  # larger than the whole budget, never kept
+  cache.put(write(tmp_path / "large.tif", 1, (4, 16, 16)), np.zeros((4, 16, 16), np.uint8))
+  assert len(cache) == 1
+
+
+def test_modified_files_are_read_again(tmp_path):
+  path = write(tmp_path / "a.tif", 1)
+  cache = ImageCache()
+  assert cache.probe(path).shape == (2, 16, 16)
+  cache.load(path)
+
+  write(path, 2, (3, 16, 16))
+  os.utime(path, ns=(0, 10 ** 9))
+  assert cache.probe(path).shape == (3, 16, 16)
+  assert path not in cache
+  assert cache.load(path)[0, 0, 0] == 2
+
+
+def test_prefetch_skips_large_and_unreadable_files(tmp_path):
+  small = write(tmp_path / "small.tif", 1)
+  large = write(tmp_path / "large.tif", 1, (8, 64, 64))
+  broken = tmp_path / "broken.tif"
+  broken.write_bytes(b"not a tiff")
+  cache = ImageCache(max_bytes=8 * 64 * 64)
+
+  assert list(prefetch(cache, [small, large, str(broken)])) == [small]
+  assert small in cache and large not in cache
+  # already cached
+  assert list(prefetch(cache, [small])) == []
@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+import zarr
+from tifffile import TiffWriter, imwrite
+
+from napari_figure.image_io import (guess_channel_axis, is_image_file, iter_load_image, load_image,
+                                    load_multiscale, probe_image, select_level)
+
+
+def write_ome_zarr(path, data, n_levels=3, zarr_format=2):
+  # a CYX pyramid, downsampled by 2 per level, with OMERO rendering settings
+  group = zarr.open_group(path, mode='w', zarr_format=zarr_format)
+  for level in range(n_levels):
+    plane = data[:, ::2 ** level, ::2 ** level]
+    group.create_array(str(level), shape=plane.shape, dtype=plane.dtype, chunks=(1, 32, 32))[:] = plane
+  attributes = {
+    'multiscales': [{'version': '0.4',
+                     'axes': [{'name': 'c', 'type': 'channel'}, {'name': 'y', 'type': 'space'}, {'name': 'x', 'type': 'space'}],
+                     'datasets': [{'path': str(level)} for level in range(n_levels)]}],
+    'omero': {'channels': [{'label': 'DAPI', 'color': '0000FF', 'window': {'start': 0, 'end': 100}},
+                           {'label': 'GFP', 'color': '00FF00', 'window': {'start': 10, 'end': 200}}]},
+  }
+  # NGFF 0.5 (zarr v3) nests the metadata under 'ome'
+  group.attrs.update(attributes if zarr_format == 2 else {'ome': attributes})
+  return path
+
+
+def test_probe_image_imagej_hyperstack(tmp_path):
+  path = tmp_path / "zcyx.tif"
+  imwrite(path, np.zeros((3, 4, 16, 16), np.uint16), imagej=True, metadata={'axes': 'ZCYX'})
+
+  info = probe_image(path)
+  assert info.shape == (3, 4, 16, 16)
+  assert info.dtype == 'uint16'
+  assert info.axes == 'ZCYX'
+  assert info.channel_axis == 1
+  assert info.n_channels == 4
+
+
+def test_probe_image_ome(tmp_path):
+  path = tmp_path / "cyx.ome.tif"
+  imwrite(path, np.zeros((6, 16, 16), np.uint8), ome=True, metadata={'axes': 'CYX'})
+
+  info = probe_image(path)
+  assert info.channel_axis == 0
+  assert info.n_channels == 6
+
+
+def test_guess_channel_axis_without_metadata():
+  # smallest non-spatial axis wins
+  assert guess_channel_axis((20, 3, 64, 64), 'QQYX') == 1
+  # a single plane has no channel axis
+  assert guess_channel_axis((64, 64), 'YX') is None
+
+
+def test_load_image_lazy(tmp_path):
+  data = np.arange(3 * 32 * 32, dtype=np.uint16).reshape(3, 32, 32)
+  raw_path = tmp_path / "raw.tif"
+  imwrite(raw_path, data, photometric='minisblack')
+  zlib_path = tmp_path / "zlib.tif"
+  imwrite(zlib_path, data, photometric='minisblack', compression='zlib')
+
+  raw = load_image(raw_path, lazy=True)
+  assert isinstance(raw, np.memmap)
+  np.testing.assert_array_equal(raw[1], data[1])
+
+  compressed = load_image(zlib_path, lazy=True)
+  assert compressed.chunksize == (1, 32, 32)
+  np.testing.assert_array_equal(np.asarray(compressed[2]), data[2])
+
+  np.testing.assert_array_equal(load_image(zlib_path, lazy=False), data)
+
+
+def test_iter_load_image_reports_progress(tmp_path):
+  data = np.arange(4 * 8 * 8, dtype=np.uint8).reshape(4, 8, 8)
+  path = tmp_path / "stack.tif"
+  imwrite(path, data, photometric='minisblack', compression='zlib')
+
+  reader = iter_load_image(path, lazy=False)
+  progress = []
+  try:
+    while True:
+      progress.append(next(reader))
+  except StopIteration as stop:
+    image = stop.value
+
+  assert progress == [(1, 4), (2, 4), (3, 4), (4, 4)]
+  np.testing.assert_array_equal(image, data)
+
+
+@pytest.mark.parametrize("zarr_format", [2, 3])
+def test_probe_and_load_ome_zarr(tmp_path, zarr_format):
+  data = np.arange(2 * 128 * 128, dtype=np.uint16).reshape(2, 128, 128)
+  path = write_ome_zarr(tmp_path / "image.zarr", data, zarr_format=zarr_format)
+  assert is_image_file(path)
+
+  info = probe_image(path)
+  assert info.shape == (2, 128, 128)
+  assert info.dtype == 'uint16'
+  assert info.axes == 'CYX'
+  assert info.channel_axis == 0
+  assert info.level_shapes == ((2, 128, 128), (2, 64, 64), (2, 32, 32))
+  assert [channel.name for channel in info.channels] == ['DAPI', 'GFP']
+  assert info.channels[0].color == (0.0, 0.0, 1.0)
+  assert info.channels[1].window == (10, 200)
+
+  levels = load_multiscale(path)
+  assert [level.shape for level in levels] == list(info.level_shapes)
+  np.testing.assert_array_equal(np.asarray(levels[1][1]), data[1, ::2, ::2])
+  np.testing.assert_array_equal(load_image(path, lazy=False, level=2), data[:, ::4, ::4])
+
+
+def test_probe_pyramidal_ome_tiff(tmp_path):
+  data = np.random.default_rng(0).integers(0, 1000, (2, 256, 256), dtype=np.uint16)
+  path = tmp_path / "pyramid.ome.tif"
+  with TiffWriter(path, ome=True) as tif:
+    tif.write(data, subifds=1, tile=(64, 64), metadata={'axes': 'CYX', 'Channel': {'Name': ['DAPI', 'GFP'], 'Color': [-16776961, 16711935]}})
+    tif.write(data[:, ::2, ::2], subfiletype=1, tile=(64, 64))
+
+  info = probe_image(path)
+  assert info.level_shapes == ((2, 256, 256), (2, 128, 128))
+  assert [channel.name for channel in info.channels] == ['DAPI', 'GFP']
+  # signed RGBA integers
+  assert info.channels[0].color == (1.0, 0.0, 0.0)
+  assert info.channels[1].color == (0.0, 1.0, 0.0)
+
+  np.testing.assert_array_equal(np.asarray(load_image(path, lazy=True, level=1)), data[:, ::2, ::2])
+
+
+def test_select_level():
+  shapes = [(2, 1024, 1024), (2, 512, 512), (2, 256, 256)]
+  assert select_level(shapes, 1) == (0, 1)
+  assert select_level(shapes, 3) == (1, 1)
+  assert select_level(shapes, 4) == (2, 1)
+  assert select_level(shapes, 10) == (2, 2)
+
+
+def test_iter_load_image_in_threads(tmp_path):
+  data = np.random.default_rng(0).integers(0, 4096, (6, 3, 32, 32), dtype=np.uint16)
+  path = tmp_path / "stack.tif"
+  imwrite(path, data, photometric='minisblack', compression='zlib')
+
+  reader = iter_load_image(path, lazy=False, workers=4)
+  progress = []
+  try:
+    while True:
+      progress.append(next(reader))
+  except StopIteration as stop:
+    image = stop.value
+
+  assert progress == [(idx, 6) for idx in range(1, 7)]
+  np.testing.assert_array_equal(image, data)
+  np.testing.assert_array_equal(load_image(path, lazy=False, workers=4), data)
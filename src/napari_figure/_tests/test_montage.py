@@ -0,0 +1,73 @@
+import numpy as np
+
+from napari_figure.montage import apply_lut, render_montage
+
+GRAY = np.stack([np.linspace(0, 1, 256)] * 3, axis=1)
+RED = np.zeros((256, 3))
+RED[:, 0] = np.linspace(0, 1, 256)
+GREEN = RED[:, [1, 0, 2]]
+
+
+def test_apply_lut_contrast_limits():
+  image = np.array([[0, 100, 200, 4095]], np.uint16)
+  rgb = apply_lut(image, GRAY, (100, 200))
+  assert rgb.dtype == np.uint8
+  np.testing.assert_array_equal(rgb[0, :, 0], [0, 0, 255, 255])
+
+  # float images are scaled the same way
+  np.testing.assert_array_equal(apply_lut(image.astype(np.float32), GRAY, (100, 200)), rgb)
+
+
+def test_render_montage_layout():
+  red = np.full((4, 5), 255, np.uint8)
+  green = np.full((4, 5), 255, np.uint8)
+  montage = render_montage([red, green], [RED, GREEN], [(0, 255), (0, 255)],
+                           rows=2, cols=2, spacing=1)
+
+  assert montage.shape == (9, 11, 3)
+  # merge, then each channel, then an empty panel
+  np.testing.assert_array_equal(montage[0, 0], [255, 255, 0])
+  np.testing.assert_array_equal(montage[0, 6], [255, 0, 0])
+  np.testing.assert_array_equal(montage[5, 0], [0, 255, 0])
+  np.testing.assert_array_equal(montage[5, 6], [0, 0, 0])
+  # gutters
+  np.testing.assert_array_equal(montage[4, :], 255)
+  np.testing.assert_array_equal(montage[:, 5], 255)
+
+
+def test_render_cache_only_colors_changed_channels(monkeypatch):
+  from napari_figure import montage
+
+  images = [np.full((4, 4), 255, np.uint8) for _ in range(3)]
+  luts = [RED, GREEN, GRAY]
+  limits = [(0, 255)] * 3
+  cache = montage.RenderCache()
+  arguments = dict(rows=2, cols=2, keys=["a", "b", "c"], cache=cache)
+  first = render_montage(images, luts, limits, **arguments)
+
+  colored = []
+  apply = montage.apply_lut
+  monkeypatch.setattr(montage, "apply_lut", lambda image, lut, clims: colored.append(lut) or apply(image, lut, clims))
+  np.testing.assert_array_equal(render_montage(images, luts, limits, **arguments), first)
+  assert colored == []
+
+  changed = render_montage(images, luts, [(0, 255), (0, 100), (0, 255)], **arguments)
+  assert len(colored) == 1 and colored[0] is GREEN
+  np.testing.assert_array_equal(changed, render_montage(images, luts, [(0, 255), (0, 100), (0, 255)], rows=2, cols=2))
+
+
+def test_render_cache_is_bounded():
+  from napari_figure.montage import RenderCache
+
+  cache = RenderCache(max_bytes=100)
+  cache.put("a", np.zeros(60, np.uint8))
+  cache.put("b", np.zeros(60, np.uint8))
+  assert cache.get("a") is None and cache.get("b") is not None
+  assert cache.n_bytes == 60
+
+
+def test_channels_colored_in_threads():
+  rng = np.random.default_rng(0)
+  images = [rng.integers(0, 4096, (40, 30), dtype=np.uint16) for _ in range(6)]
+  arguments = (images, [GRAY, RED, GREEN] * 2, [(0, 4095)] * 6, 3, 3)
+  np.testing.assert_array_equal(render_montage(*arguments, workers=4), render_montage(*arguments))
@@ -0,0 +1,73 @@
+import threading
+
+import numpy as np
+import pytest
+from tifffile import imread
+
+from napari_figure.movie import FRAMES_AHEAD, frame_plane, frame_projection_size, movie_frames, write_movie
+from napari_figure.projection import montage_plane
+
+
+def test_frame_plane_never_projects_the_movie_axis():
+  data = np.arange(4 * 3 * 5 * 6).reshape(4, 3, 5, 6)
+  # time series of z max projections
+  for index in range(4):
+    np.testing.assert_array_equal(frame_plane(data, 0, index, 'max'), data[index].max(axis=0))
+  # z-sweep of the timepoint at the position
+  np.testing.assert_array_equal(frame_plane(data, 1, 2, 'slice', position=(3, 0, 0, 0)), data[3, 2])
+  # the same plane as a montage, without the cache
+  np.testing.assert_array_equal(frame_plane(data, 1, 2, 'max', axes=[0]), montage_plane(data[:, 2], 'max', [0]))
+  assert frame_projection_size(data.shape, 0, method='sum') == 3
+  with pytest.raises(ValueError):
+    frame_plane(data, 2, 0)
+
+
+def test_movie_frames_in_order_and_bounded():
+  lock = threading.Lock()
+  rendered = []
+
+  def render(index):
+    with lock:
+      rendered.append(index)
+    return index
+
+  frames = movie_frames(render, 20, workers=2)
+  assert next(frames) == 0
+  # only a few frames are rendered ahead of the consumer
+  assert len(rendered) <= 1 + 2 * FRAMES_AHEAD
+  assert list(frames) == list(range(1, 20))
+
+
+@pytest.mark.parametrize("extension", ["tif", "gif"])
+def test_write_movie(tmp_path, extension):
+  frames = [np.full((9, 11, 3), 40 * index, np.uint8) for index in range(5)]
+  path = tmp_path / f"movie.{extension}"
+
+  assert write_movie(path, iter(frames), fps=5) == 5
+
+  if extension == "tif":
+    written = imread(path)
+    assert written.shape == (5, 9, 11, 3)
+    np.testing.assert_array_equal(written, np.stack(frames))
+  else:
+    from PIL import Image
+    with Image.open(path) as gif:
+      assert gif.n_frames == 5
+
+
+def test_write_movie_errors(tmp_path):
+  with pytest.raises(ValueError):
+    write_movie(tmp_path / "movie.tif", [])
+  with pytest.raises(ValueError):
+    write_movie(tmp_path / "movie.avi", [np.zeros((2, 2, 3), np.uint8)])
+
+
+def test_mp4_needs_imageio_ffmpeg(tmp_path):
+  try:
+    import imageio_ffmpeg  # noqa: F401
+  except ImportError:
+    pass
+  else:
+    pytest.skip("imageio-ffmpeg is installed")
+  with pytest.raises(ImportError, match="imageio-ffmpeg"):
+    write_movie(tmp_path / "movie.mp4", [np.zeros((2, 2, 3), np.uint8)])
@@ -0,0 +1,44 @@
+import time
+
+import numpy as np
+
+from napari_figure.profiling import Profiler, activate, active_profiler, stage
+
+
+def test_nested_stages_are_exclusive():
+  profiler = Profiler("test")
+  with activate(profiler):
+    with stage("outer"):
+      time.sleep(0.02)
+      with stage("inner"):
+        time.sleep(0.05)
+    for _ in range(3):
+      with stage("inner"):
+        pass
+  profiler.finish()
+
+  durations = profiler.durations()
+  assert 0.015 < durations["outer"] < 0.045
+  assert durations["inner"] >= 0.05
+  assert profiler.stages["inner"].calls == 4
+  assert sum(durations.values()) <= profiler.total
+  assert "outer" in profiler.summary()
+
+
+def test_stages_without_profiler_do_nothing():
+  assert active_profiler() is None
+  with stage("anything"):
+    pass
+  with activate(None):
+    with stage("anything"):
+      pass
+
+
+def test_memory_of_stages():
+  profiler = Profiler("memory", trace_memory=True)
+  with activate(profiler), stage("allocate"):
+    data = np.ones(2 ** 20)
+  profiler.finish()
+  assert profiler.stages["allocate"].peak_memory_mb >= 7.9
+  assert profiler.to_dict()["stages"][0]["name"] == "allocate"
+  del data
@@ -0,0 +1,57 @@
+import dask.array as da
+import numpy as np
+import pytest
+
+from napari_figure import projection
+
+
+@pytest.mark.parametrize("method", ["max", "mean", "sum"])
+def test_project_in_chunks_matches_numpy(method):
+  stack = np.random.randint(0, 4000, (3, 7, 16, 16), np.uint16)
+  expected = getattr(stack, method)(axis=(0, 1))
+  # one plane per block
+  result = projection.project(stack, None, method, chunk_bytes=16 * 16 * 2)
+  np.testing.assert_allclose(result, expected, rtol=1e-6)
+  assert projection.project(da.from_array(stack, chunks=(1, 1, 16, 16)), [1], method).shape == (3, 16, 16)
+
+
+def test_project_rejects_plane_axes():
+  with pytest.raises(ValueError):
+    projection.project(np.zeros((3, 8, 8)), [1], 'max')
+
+
+def test_montage_plane_slices_the_other_axes():
+  stack = np.arange(2 * 5 * 4 * 4).reshape(2, 5, 4, 4)
+  np.testing.assert_array_equal(projection.montage_plane(stack, 'slice', position=(1, 3, 0, 0)), stack[1, 3])
+  np.testing.assert_array_equal(projection.montage_plane(stack, 'slice'), stack[1, 2])
+  np.testing.assert_array_equal(projection.montage_plane(stack, 'max', [1], position=(0, 0, 0, 0)), stack[0].max(axis=0))
+
+
+def test_montage_plane_only_reads_the_projected_planes():
+  class Recorder:
+    # an array that records the indices it is read at
+    def __init__(self, array):
+      self.array, self.shape, self.dtype, self.ndim = array, array.shape, array.dtype, array.ndim
+      self.reads = []
+
+    def __getitem__(self, index):
+      self.reads.append(index)
+      return self.array[index]
+
+  projection.clear_projections()
+  tzyx = np.arange(3 * 4 * 8 * 8).reshape(3, 4, 8, 8)
+  data = Recorder(tzyx)
+  plane = projection.montage_plane(data, 'max', [1], position=(2, 0, 0, 0))
+  np.testing.assert_array_equal(plane, tzyx[2].max(axis=0))
+  assert data.reads == [(2, slice(None))]
+  assert projection.montage_plane(data, 'max', [1], position=(2, 0, 0, 0)) is plane
+  np.testing.assert_array_equal(projection.montage_plane(data, 'max', [1], position=(0, 0, 0, 0)), tzyx[0].max(axis=0))
+
+
+def test_projections_are_cached_per_array_and_axes():
+  projection.clear_projections()
+  stack = np.random.rand(4, 8, 8)
+  first = projection.cached_projection(stack, None, 'max')
+  assert projection.cached_projection(stack, None, 'max') is first
+  assert projection.cached_projection(stack, None, 'mean') is not first
+  assert projection.cached_projection(stack.copy(), None, 'max') is not first
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+
+from napari_figure.render_store import RenderStore, render_key
+
+
+def test_render_key_follows_the_values():
+  lut = np.linspace(0, 1, 12).reshape(4, 3)
+  key = render_key('montage', ('a.tif', 10, 5), {'rows': 2, 'cols': 3}, [lut])
+  assert key == render_key('montage', ['a.tif', 10, 5], {'cols': 3, 'rows': 2}, [lut.copy()])
+  assert key != render_key('montage', ('a.tif', 10, 6), {'rows': 2, 'cols': 3}, [lut])
+  changed = lut.copy()
+  changed[0, 0] = 0.5
+  assert key != render_key('montage', ('a.tif', 10, 5), {'rows': 2, 'cols': 3}, [changed])
+
+
+def test_store_renders_once(tmp_path):
+  store = RenderStore(tmp_path / "store")
+  calls = []
+
+  def write(path):
+    calls.append(path)
+    with open(path, 'w') as file:
+      file.write("montage")
+
+  assert not store.save("key", tmp_path / "out" / "a.png", write)
+  assert store.save("key", tmp_path / "out" / "b.png", write)
+  assert len(calls) == 1
+  assert (tmp_path / "out" / "b.png").read_text() == "montage"
+  assert "key" in store and len(store) == 1
+
+
+def test_failed_renders_are_not_stored(tmp_path):
+  store = RenderStore(tmp_path / "store")
+
+  def write(path):
+    raise ValueError("no layers")
+
+  with pytest.raises(ValueError):
+    store.render("key", 'png', write)
+  assert len(store) == 0
+  assert os.listdir(tmp_path / "store") == []
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+  store = RenderStore(tmp_path / "store", max_bytes=250)
+
+  def writer(size):
+    def write(path):
+      with open(path, 'wb') as file:
+        file.write(b"x" * size)
+    return write
+
+  for idx, key in enumerate("abc"):
+    path, _ = store.render(key, 'png', writer(100))
+    os.utime(path, ns=(idx * 10 ** 9, idx * 10 ** 9))
+  # 'a' was removed to make room for 'c'
+  assert "a" not in store and "b" in store and "c" in store
+  assert store.n_bytes == 200
+
+  # 'b' is used again, 'c' is then the least recently used
+  assert store.get("b", 'png') is not None
+  store.render("d", 'png', writer(100))
+  assert sorted(os.path.basename(path) for _, _, path in store._entries()) == ["b.png", "d.png"]
@@ -0,0 +1,102 @@
+import pytest
+
+from napari_figure.settings import ChannelSettings, Params
+
+
+def test_comma_separated_settings_are_parsed_once():
+  params = Params()
+  params.channels_LUTs = "biop_azure, biop_amber,gray,magenta"
+  params.channels_maxs = "4095,4095"
+
+  assert [channel.colormap for channel in params.channels] == ["biop_azure", "biop_amber", "gray", "magenta"]
+  assert params.channels[1].contrast_limits == [0, 4095]
+  assert params.channels[2].contrast_limits == [0, 255]
+  assert params.channels_maxs == "4095,4095,255,255"
+
+
+def test_contrast_limits_text_keeps_every_digit():
+  params = Params()
+  params.channels_maxs = "1234567,0.123456789,4095"
+  assert params.channels_maxs == "1234567,0.123456789,4095"
+  params.channels_maxs = params.channels_maxs
+  assert params.channels[0].contrast_max == 1234567
+  assert params.channels[1].contrast_max == 0.123456789
+
+
+def test_empty_entries_keep_their_position():
+  params = Params()
+  params.channels_names = "DAPI,,A555"
+  assert [channel.name for channel in params.channels] == ["DAPI", "null", "A555"]
+  params.channels_maxs = ",4095"
+  assert [channel.contrast_max for channel in params.channels] == [255, 4095, 255]
+
+
+def test_channels_for_pads_and_truncates():
+  params = Params()
+  assert [channel.name for channel in params.channels_for(2)] == ["DAPI", "A488"]
+  assert params.channels_for(5)[4] == ChannelSettings()
+
+
+def test_invalid_settings_are_rejected():
+  params = Params()
+  with pytest.raises(ValueError):
+    params.channels_mins = "0,abc"
+  with pytest.raises(ValueError):
+    params.channels_mins = "300"
+  assert params.channels_mins == "0,0,0"
+  with pytest.raises(ValueError):
+    Params(montage_engine="opengl")
+  with pytest.raises(ValueError, match="notacmap"):
+    params.channels_LUTs = "gray,notacmap"
+  assert params.channels_LUTs == "cyan,biop_amber,biop_brightpink"
+
+
+@pytest.mark.parametrize("extension", ["json", "yaml"])
+def test_profile_round_trip(tmp_path, extension):
+  params = Params()
+  params.channels_LUTs = "biop_azure,biop_amber"
+  params.channels_mins = "10,20"
+  params.montage_rows = 3
+  params.save_profile(tmp_path / f"profile.{extension}")
+
+  loaded = Params()
+  loaded.selected_file = "image.tif"
+  loaded.load_profile(tmp_path / f"profile.{extension}")
+  assert loaded.channels == params.channels
+  assert loaded.montage_rows == 3
+  # the selected file is not part of a profile
+  assert loaded.selected_file == "image.tif"
+
+
+def test_invalid_profile_leaves_settings_unchanged():
+  params = Params()
+  with pytest.raises(ValueError):
+    params.apply_profile({"montage_rows": 3, "montage_columns": 0})
+  assert params.montage_rows == 2
+  with pytest.raises(ValueError):
+    params.apply_profile({"unknown": 1})
+
+
+def test_profile_booleans():
+  params = Params()
+  params.apply_profile({"lazy_loading": "false", "reuse_layers": "True"})
+  assert params.lazy_loading is False and params.reuse_layers is True
+  with pytest.raises(ValueError):
+    params.apply_profile({"lazy_loading": "no", "montage_rows": 3})
+  assert params.lazy_loading is False and params.montage_rows == 2
+
+
+def test_profile_numbers_are_not_truncated():
+  params = Params()
+  params.apply_profile({"montage_rows": 3.0, "montage_columns": "4"})
+  assert (params.montage_rows, params.montage_columns) == (3, 4)
+  for value in (2.7, "2.7", True):
+    with pytest.raises(ValueError):
+      params.apply_profile({"montage_rows": value})
+  assert params.montage_rows == 3
+
+
+def test_malformed_yaml_profile(tmp_path):
+  (tmp_path / "profile.yaml").write_text("montage_rows: [3\n")
+  with pytest.raises(ValueError):
+    Params().load_profile(tmp_path / "profile.yaml")
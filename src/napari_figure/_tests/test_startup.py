@@ -0,0 +1,32 @@
+import json
+import subprocess
+import sys
+
+# what napari has already imported when it opens the widget
+NAPARI_IMPORTS = "import napari, napari.qt.threading, napari.layers.utils.stack_utils, napari.utils.notifications, qtpy.QtWidgets"
+# imported on first use only
+DEFERRED_MODULES = ["matplotlib", "microfilm", "tifffile", "zarr"]
+
+STARTUP_SCRIPT = f"""
+import json, sys, time
+{NAPARI_IMPORTS}
+start = time.perf_counter()
+import napari_figure.figure_widget
+duration = time.perf_counter() - start
+print(json.dumps({{"duration": duration, "modules": [m for m in {DEFERRED_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def test_figure_widget_import_is_fast():
+  output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], capture_output=True, text=True, check=True).stdout
+  result = json.loads(output.strip().splitlines()[-1])
+
+  assert result["modules"] == []
+  # generous bound, the import itself takes a few tens of ms
+  assert result["duration"] < 0.5
+
+
+def test_batch_runner_is_headless():
+  script = "import sys, napari_figure.batch; print([m for m in ('qtpy', 'napari_figure.figure_widget') if m in sys.modules])"
+  output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+  assert output.strip() == "[]"
@@ -1,4 +1,574 @@
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+from tifffile import imread, imwrite
+
 from napari_figure.figure_widget import FigureWidget
 
 def test_dummy():
-  assert 0 == 0
\ No newline at end of file
+  assert 0 == 0
+
+
+def test_load_selected_file_in_background(qtbot, tmp_path):
+  imwrite(tmp_path / "zcyx.tif", np.zeros((2, 3, 16, 16), np.uint8), imagej=True, metadata={'axes': 'ZCYX'})
+
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+
+  widget.params.selected_directory = str(tmp_path)
+  widget.params.selected_file = "zcyx.tif"
+  widget.params.channel_axis_value = 1
+  widget.params.channels_mins = "0,0,0"
+  widget.params.channels_maxs = "255,255,255"
+  widget.params.record_timings = True
+  widget.load_selected_file()
+  qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+
+  assert len(viewer.layers) == 3
+  assert viewer.layers[0].data.shape == (2, 16, 16)
+  stages = [record["name"] for record in widget.diagnostics.profiles[-1]["stages"]]
+  assert stages == ["read", "split channels", "add layers"]
+
+
+@pytest.mark.parametrize("engine", ["numpy", "microfilm"])
+def test_create_montage_image_in_memory(qtbot, tmp_path, engine):
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+  widget.params.selected_directory = str(tmp_path)
+
+  viewer.layers.clear()
+  for _ in range(3):
+    viewer.add_image(np.random.rand(32, 32))
+  widget.params.montage_rows = 1
+  widget.params.montage_columns = 4
+  widget.params.montage_engine = engine
+  widget.create_montage_image()
+
+  assert widget.montage_image.ndim == 3
+  assert widget.montage_image.shape[2] in (3, 4)
+  assert widget.montage_preview.pixmap() is not None
+  assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("engine", ["numpy", "microfilm"])
+def test_montage_without_layers(qtbot, tmp_path, monkeypatch, engine):
+  from napari_figure import figure_widget
+
+  messages = []
+  monkeypatch.setattr(figure_widget, "show_info", messages.append)
+  widget = FigureWidget(ViewerModel())
+  qtbot.addWidget(widget)
+  widget.params.montage_engine = engine
+
+  widget.create_montage_image()
+  assert widget.montage_image is None
+  assert messages == ["Can't create the montage: there are no image layers"]
+  if engine == "numpy":
+    widget.save_montage(tmp_path / "montage.png")
+    assert not (tmp_path / "montage.png").exists()
+    assert messages[-1] == "Can't save the montage: there are no image layers"
+
+
+def test_update_boxes_from_viewer(qtbot):
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+
+  viewer.add_image(np.zeros((8, 8), np.uint16), colormap='magenta', contrast_limits=[10, 4000])
+  widget.visual_settings_selector.update_boxes_from_viewer()
+
+  assert widget.params.channels[0].colormap == 'magenta'
+  assert widget.params.channels[0].contrast_limits == [10, 4000]
+  assert widget.visual_settings_selector.channels_maxs_edit.text().startswith("4000,")
+
+
+def test_montage_of_z_stacks(qtbot):
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+
+  stack = np.zeros((5, 8, 8), np.uint8)
+  stack[3] = 200
+  viewer.add_image(stack, contrast_limits=[0, 255])
+  widget.params.montage_rows = 1
+  widget.params.montage_columns = 2
+  widget.params.montage_spacing = 0
+
+  viewer.dims.set_current_step(0, 0)
+  widget.create_montage_image()
+  assert widget.montage_image.max() == 0
+
+  widget.montage_creator.montage_projection_value.setCurrentText('max')
+  widget.create_montage_image()
+  assert widget.montage_image.max() > 0
+
+
+def test_comparison_of_selected_files(qtbot, tmp_path, monkeypatch):
+  monkeypatch.setenv("NAPARI_FIGURE_CACHE_DIR", str(tmp_path / "cache"))
+  data = tmp_path / "data"
+  data.mkdir()
+  for idx in range(2):
+    imwrite(data / f"condition_{idx}.tif", np.full((3, 16, 16), 100 * idx, np.uint8), imagej=True, metadata={'axes': 'CYX'})
+
+  widget = FigureWidget(ViewerModel())
+  qtbot.addWidget(widget)
+  selector = widget.file_selector
+  widget.params.selected_directory = str(data)
+  selector.update_file_list()
+  qtbot.waitUntil(lambda: selector.index_worker is None, timeout=5000)
+  selector.file_list.selectAll()
+
+  widget.params.montage_spacing = 0
+  widget.create_comparison_image()
+  qtbot.waitUntil(lambda: widget.comparison_worker is None, timeout=5000)
+
+  assert widget.montage_image.shape == (32, 64, 3)
+  widget.save_montage(tmp_path / "comparison.png")
+  assert (tmp_path / "comparison.png").exists()
+
+
+def test_live_preview_follows_layer_changes(qtbot):
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  layer = viewer.add_image(np.full((8, 8), 100, np.uint8), contrast_limits=[0, 255])
+  widget.params.montage_rows = 1
+  widget.params.montage_columns = 2
+  widget.live_preview.setChecked(True)
+  qtbot.waitUntil(lambda: widget.montage_image is not None, timeout=5000)
+  assert widget.montage_image[0, 0, 0] == 100
+
+  layer.contrast_limits = [0, 100]
+  qtbot.waitUntil(lambda: widget.montage_image[0, 0, 0] == 255, timeout=5000)
+
+
+def test_diagnostics_record_montage_stages(qtbot, tmp_path):
+  import json
+
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  viewer.add_image(np.zeros((16, 16), np.uint8))
+
+  widget.create_montage_image()
+  assert widget.diagnostics.profiles == []
+
+  widget.diagnostics.record_timings.setChecked(True)
+  widget.create_montage_image()
+  widget.save_montage(tmp_path / "montage.png")
+
+  preview, export = widget.diagnostics.profiles
+  assert {"planes", "render", "preview"} <= {record["name"] for record in preview["stages"]}
+  assert "encode" in {record["name"] for record in export["stages"]}
+  assert "montage preview" in widget.diagnostics.log.toPlainText()
+  widget.diagnostics.save_profiles(tmp_path / "timings.json")
+  assert len(json.loads((tmp_path / "timings.json").read_text())) == 2
+
+
+def test_memory_tracing_stops_after_failures(qtbot, tmp_path, monkeypatch):
+  import tracemalloc
+
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  viewer.add_image(np.zeros((16, 16), np.uint8))
+  widget.diagnostics.record_timings.setChecked(True)
+  widget.diagnostics.trace_memory.setChecked(True)
+
+  def fail(*args, **kwargs):
+    raise ValueError("no montage")
+
+  monkeypatch.setattr(FigureWidget, "build_numpy_montage", fail)
+  widget.create_montage_image()
+  assert not tracemalloc.is_tracing()
+  # a movie needs a time or z axis
+  widget.save_movie(tmp_path / "movie.tif")
+  assert not tracemalloc.is_tracing()
+
+  imwrite(tmp_path / "a.tif", np.zeros((2, 16, 16), np.uint8), photometric='minisblack')
+  widget.params.selected_directory = str(tmp_path)
+  widget.params.selected_file = "a.tif"
+  widget.params.channel_axis_value = 0
+  widget.load_selected_file()
+  widget.cancel_loading()
+  assert not tracemalloc.is_tracing()
+  assert widget.diagnostics.profiles == []
+
+
+def test_ome_zarr_loaded_as_multiscale_layers(qtbot, tmp_path):
+  from tifffile import imread
+
+  from .test_image_io import write_ome_zarr
+
+  data = np.arange(2 * 256 * 256, dtype=np.uint16).reshape(2, 256, 256) % 251
+  write_ome_zarr(tmp_path / "image.zarr", data)
+
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  widget.params.selected_directory = str(tmp_path)
+  widget.params.selected_file = "image.zarr"
+  widget.params.channel_axis_value = 0
+  widget.params.auto_contrast = 'none'
+  widget.load_selected_file()
+  qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+
+  # names, colors and contrast limits of the OMERO settings
+  assert [layer.name for layer in viewer.layers] == ["image.zarr_DAPI", "image.zarr_GFP"]
+  assert viewer.layers[0].colormap.name == "color_0000ff"
+  assert list(viewer.layers[1].contrast_limits) == [10, 200]
+  assert all(layer.multiscale for layer in viewer.layers)
+  assert viewer.layers[0].data.shape == (256, 256)
+
+  # the montages read the pyramid level of their resolution
+  images, _, _, _ = widget.numpy_montage_inputs(notify=False, step=2)
+  assert images[0].shape == (128, 128)
+  widget.params.montage_rows = 1
+  widget.params.montage_columns = 3
+  widget.params.montage_spacing = 0
+  images, _, _, _ = widget.numpy_montage_inputs(notify=False, max_size=192)
+  assert images[0].shape == (64, 64)
+
+  widget.params.export_max_size = 192
+  widget.save_montage(tmp_path / "montage.tif")
+  assert imread(tmp_path / "montage.tif").shape == (64, 192, 3)
+
+
+def test_reload_reuses_matching_layers(qtbot, tmp_path):
+  for name, value in (("a.tif", 1), ("b.tif", 2)):
+    imwrite(tmp_path / name, np.full((3, 16, 16), value, np.uint8), photometric='minisblack')
+  imwrite(tmp_path / "c.tif", np.zeros((2, 16, 16), np.uint8), photometric='minisblack')
+
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  widget.params.selected_directory = str(tmp_path)
+  widget.params.channel_axis_value = 0
+
+  def load(name):
+    widget.params.selected_file = name
+    widget.load_selected_file()
+    qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+
+  load("a.tif")
+  layers = list(viewer.layers)
+  layers[0].colormap = 'red'
+  layers[0].contrast_limits = [0, 10]
+  # channels are matched by name, not by position
+  viewer.layers.move(0, 3)
+
+  load("b.tif")
+  assert [layer is old for layer, old in zip(viewer.layers, layers[1:] + layers[:1])] == [True] * 3
+  assert [layer.name for layer in layers] == ["b.tif_ch1", "b.tif_ch2", "b.tif_ch3"]
+  assert layers[0].data[0, 0] == 2
+  assert layers[0].colormap.name == 'red' and list(layers[0].contrast_limits) == [0, 10]
+
+  # other channels, the layers are created again
+  load("c.tif")
+  assert len(viewer.layers) == 2 and viewer.layers[0] is not layers[0]
+
+  widget.reuse_layers.setChecked(False)
+  old = viewer.layers[0]
+  load("c.tif")
+  assert viewer.layers[0] is not old
+
+
+def test_reload_applies_edited_settings(qtbot, tmp_path):
+  for name in ("a.tif", "b.tif"):
+    imwrite(tmp_path / name, np.full((3, 16, 16), 1, np.uint16), photometric='minisblack')
+
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  widget.params.selected_directory = str(tmp_path)
+  widget.params.channel_axis_value = 0
+
+  def load(name):
+    widget.params.selected_file = name
+    widget.load_selected_file()
+    qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+
+  load("a.tif")
+  layers = list(viewer.layers)
+  selector = widget.visual_settings_selector
+  selector.channels_LUTs_edit.setText("magenta,green,red")
+  selector.channels_maxs_edit.setText("4000,4000,4000")
+
+  load("b.tif")
+  assert list(viewer.layers) == layers
+  assert [layer.colormap.name for layer in layers] == ['magenta', 'green', 'red']
+  assert [list(layer.contrast_limits) for layer in layers] == [[0, 4000]] * 3
+
+
+def test_neighbour_files_are_prefetched(qtbot, tmp_path, monkeypatch):
+  from napari_figure import figure_widget
+
+  monkeypatch.setenv("NAPARI_FIGURE_CACHE_DIR", str(tmp_path / "cache"))
+  data = tmp_path / "data"
+  data.mkdir()
+  for idx in range(3):
+    imwrite(data / f"{idx}.tif", np.full((2, 16, 16), idx, np.uint8), photometric='minisblack')
+
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  selector = widget.file_selector
+  widget.params.selected_directory = str(data)
+  selector.update_file_list()
+  qtbot.waitUntil(lambda: selector.index_worker is None, timeout=5000)
+
+  selector.file_list.setCurrentRow(1)
+  qtbot.waitUntil(lambda: len(widget.image_cache) == 2, timeout=5000)
+  assert str(data / "0.tif") in widget.image_cache and str(data / "2.tif") in widget.image_cache
+
+  # the next file is not read again
+  def no_reading(*args, **kwargs):
+    raise AssertionError("the file was read")
+  monkeypatch.setattr(figure_widget, "iter_load_image", no_reading)
+  widget.params.channel_axis_value = 0
+  widget.params.selected_file = "2.tif"
+  widget.load_selected_file()
+  qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+  assert len(viewer.layers) == 2 and viewer.layers[0].data[0, 0] == 2
+
+
+def test_movie_of_z_stack(qtbot, tmp_path):
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+
+  stack = np.zeros((5, 8, 8), np.uint8)
+  stack[3] = 200
+  viewer.add_image(stack, contrast_limits=[0, 255])
+  viewer.add_image(stack, contrast_limits=[0, 255], colormap='magenta')
+  widget.params.montage_rows = 1
+  widget.params.montage_columns = 2
+  widget.params.montage_spacing = 0
+
+  path = tmp_path / "movie.tif"
+  widget.save_movie(path)
+
+  movie = imread(path)
+  assert movie.shape == (5, 8, 16, 3)
+  assert movie[3].max() > 0
+  assert movie[[0, 1, 2, 4]].max() == 0
+
+
+def test_saved_montages_come_from_the_render_store(qtbot, tmp_path, monkeypatch):
+  from napari_figure import figure_widget
+
+  data = tmp_path / "data"
+  data.mkdir()
+  imwrite(data / "a.tif", np.full((3, 16, 16), 100, np.uint8), photometric='minisblack')
+
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  widget.params.selected_directory = str(data)
+  widget.params.selected_file = "a.tif"
+  widget.params.channel_axis_value = 0
+  widget.montage_creator.output_directory_value.setText(str(tmp_path / "figures"))
+  widget.montage_creator.update_output_directory()
+  widget.load_selected_file()
+  qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+  assert widget.output_directory() == str(tmp_path / "figures")
+
+  rendered = []
+  original = figure_widget.write_montage
+  monkeypatch.setattr(figure_widget, "write_montage", lambda *args, **kwargs: rendered.append(args) or original(*args, **kwargs))
+
+  widget.save_montage(tmp_path / "figures" / "a.png")
+  widget.save_montage(tmp_path / "figures" / "b.png")
+  assert len(rendered) == 1
+  assert (tmp_path / "figures" / "a.png").read_bytes() == (tmp_path / "figures" / "b.png").read_bytes()
+
+  # other contrast limits are another montage
+  viewer.layers[0].contrast_limits = [0, 50]
+  widget.save_montage(tmp_path / "figures" / "c.png")
+  assert len(rendered) == 2
+
+  # layers not loaded from a file are always rendered
+  viewer.layers[0].data = np.zeros((16, 16), np.uint8)
+  widget.save_montage(tmp_path / "figures" / "d.png")
+  widget.save_montage(tmp_path / "figures" / "d.png")
+  assert len(rendered) == 4
+  assert list(data.iterdir()) == [data / "a.tif"]
+
+
+def test_file_list_items_are_updated_in_place(qtbot):
+  from napari_figure.file_index import IndexEntry
+
+  widget = FigureWidget(ViewerModel())
+  qtbot.addWidget(widget)
+  selector = widget.file_selector
+
+  for idx in range(3):
+    selector.update_file_item(IndexEntry(f"{idx}.tif", 1, 1, (2, 8, 8), 'uint8', 'CYX', 0))
+  selector.update_file_item(IndexEntry("1.tif", 2, 2, (3, 8, 8), 'uint8', 'CYX', 0))
+
+  assert selector.file_list.count() == 3
+  assert selector.file_items["1.tif"].text() == "1.tif\n(3, 8, 8) uint8, 3 ch"
+  selector.index_finished([IndexEntry("1.tif", 2, 2)])
+  assert selector.file_list.count() == 1 and list(selector.file_items) == ["1.tif"]
+
+
+def test_files_of_the_previous_directory_are_ignored(qtbot, tmp_path):
+  from napari_figure.file_index import IndexEntry
+
+  for directory in ("first", "second"):
+    (tmp_path / directory).mkdir()
+    imwrite(tmp_path / directory / f"{directory}.tif", np.zeros((2, 8, 8), np.uint8), photometric='minisblack')
+  widget = FigureWidget(ViewerModel())
+  qtbot.addWidget(widget)
+  selector = widget.file_selector
+
+  widget.params.selected_directory = str(tmp_path / "first")
+  selector.update_file_list()
+  previous = selector.index_worker
+  widget.params.selected_directory = str(tmp_path / "second")
+  selector.update_file_list()
+
+  # late signals of the first scan change nothing
+  previous.yielded.emit((1, 1, IndexEntry("first.tif", 1, 1, (2, 8, 8), 'uint8', 'CYX', 0)))
+  previous.returned.emit([])
+  assert selector.index_worker is not None
+  qtbot.waitUntil(lambda: selector.index_worker is None, timeout=5000)
+  assert list(selector.file_items) == ["second.tif"]
+
+
+def test_failure_to_add_layers_resets_loading(qtbot, tmp_path, monkeypatch):
+  imwrite(tmp_path / "a.tif", np.zeros((2, 16, 16), np.uint8), photometric='minisblack')
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  widget.params.selected_directory = str(tmp_path)
+  widget.params.selected_file = "a.tif"
+  widget.params.channel_axis_value = 0
+
+  def add_image(*args, **kwargs):
+    raise KeyError("notacmap")
+
+  monkeypatch.setattr(ViewerModel, "add_image", add_image)
+  messages = []
+  monkeypatch.setattr("napari_figure.figure_widget.show_info", messages.append)
+  widget.load_selected_file()
+  qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+
+  assert not widget.cancel_button.isEnabled()
+  assert messages and messages[-1].startswith("Loading failed")
+
+
+def test_aborted_read_can_be_closed_from_another_context(tmp_path):
+  import contextvars
+
+  from napari_figure.figure_widget import read_image_layers
+  from napari_figure.profiling import Profiler
+
+  imwrite(tmp_path / "a.tif", np.zeros((4, 16, 16), np.uint8), photometric='minisblack')
+  settings = lambda name, n_channels: dict(name=[f"{name}_{idx}" for idx in range(n_channels)])
+  profiler = Profiler("load")
+  reader = read_image_layers.__wrapped__(str(tmp_path / "a.tif"), False, 0, settings, profiler=profiler, workers=2)
+
+  assert contextvars.copy_context().run(next, reader) == (1, 4)
+  # e.g. garbage collected on another thread after Cancel
+  contextvars.Context().run(reader.close)
+  assert "read" in profiler.stages
+
+
+def test_signals_of_a_cancelled_load_are_ignored(qtbot, tmp_path):
+  imwrite(tmp_path / "a.tif", np.zeros((2, 16, 16), np.uint8), photometric='minisblack')
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  widget.params.selected_directory = str(tmp_path)
+  widget.params.selected_file = "a.tif"
+  widget.params.channel_axis_value = 0
+
+  widget.load_selected_file()
+  cancelled = widget.load_worker
+  widget.load_selected_file()
+  current = widget.load_worker
+  assert current is not cancelled
+
+  # late signals of the first load change nothing
+  cancelled.yielded.emit((5, 10))
+  cancelled.returned.emit(("old.tif", []))
+  assert widget.load_worker is current and widget.cancel_button.isEnabled()
+  assert widget.load_progress.maximum() != 10
+  qtbot.waitUntil(lambda: widget.load_worker is None, timeout=5000)
+  assert [layer.name for layer in viewer.layers] == ["a.tif_ch1", "a.tif_ch2"]
+
+
+def test_cancel_loading(qtbot, tmp_path, monkeypatch):
+  import threading
+
+  from napari_figure import figure_widget
+
+  for name in ("a.tif", "b.tif"):
+    imwrite(tmp_path / name, np.zeros((2, 16, 16), np.uint8), photometric='minisblack')
+  release = threading.Event()
+
+  def slow_load(path, lazy=True, workers=1):
+    # a read that only ends when released, one plane at a time
+    for idx in range(10):
+      release.wait(0.05)
+      yield idx + 1, 10
+    return np.zeros((2, 16, 16), np.uint8)
+
+  monkeypatch.setattr(figure_widget, "iter_load_image", slow_load)
+  viewer = ViewerModel()
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+  selector = widget.file_selector
+  widget.params.selected_directory = str(tmp_path)
+  widget.params.channel_axis_value = 0
+  widget.params.lazy_loading = False
+  selector.update_file_list()
+  qtbot.waitUntil(lambda: selector.index_worker is None, timeout=5000)
+
+  def start_loading():
+    widget.params.selected_file = "a.tif"
+    widget.load_selected_file()
+    assert widget.cancel_button.isEnabled()
+    qtbot.waitUntil(lambda: widget.load_progress.maximum() == 10, timeout=5000)
+
+  def assert_cancelled():
+    assert widget.load_worker is None
+    assert not widget.cancel_button.isEnabled()
+    assert (widget.load_progress.maximum(), widget.load_progress.value()) == (1, 0)
+    qtbot.wait(800)
+    assert len(viewer.layers) == 0
+
+  # the Cancel button
+  start_loading()
+  widget.cancel_button.click()
+  assert_cancelled()
+
+  # selecting another file
+  start_loading()
+  selector.file_items["b.tif"].setSelected(True)
+  assert_cancelled()
+  release.set()
+
+
+def test_layers_without_colormap_are_not_in_the_montage(qtbot):
+  viewer = ViewerModel()
+  viewer.add_points(np.array([[1, 1], [4, 4]]))
+  widget = FigureWidget(viewer)
+  qtbot.addWidget(widget)
+
+  viewer.add_labels(np.zeros((8, 8), np.uint8))
+  viewer.add_image(np.full((8, 8), 100, np.uint8), contrast_limits=[0, 255])
+  viewer.add_points(np.array([[2, 2]]))
+  widget.params.montage_rows = 1
+  widget.params.montage_columns = 2
+  widget.params.montage_spacing = 0
+  widget.create_montage_image()
+
+  assert widget.montage_image.shape[:2] == (8, 16)
+  widget.visual_settings_selector.update_boxes_from_viewer()
+  assert widget.params.channels[0].contrast_limits == [0, 255]
@@ -0,0 +1,280 @@
+"""
+Headless batch generation of montages, without Qt nor a napari viewer.
+
+    napari-figure-batch data/ --output figures/ --channels-LUTs biop_azure,biop_amber --workers 4
+
+Every TIFF (and OME-Zarr image) of a directory (or matching a glob) is rendered with the numpy
+montage engine, using the same settings as the widget `Params`. The time
+spent in each stage is printed at the end, and can be saved as JSON with
+`--timings-json`.
+
+Rendered montages are kept in the render cache (see render_store.py): running
+the batch again only renders the files, or settings, that changed.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .colormaps import get_lut
+from .contrast import AUTO_CONTRAST_METHODS, auto_contrast_limits, file_key
+from .image_io import channel_views, guess_channel_axis, is_image_file, is_zarr, load_image, probe_image
+from .export import export_montage, montage_level
+from .montage import default_panels
+from .profiling import Profiler, activate, stage
+from .projection import PROJECTION_METHODS, montage_plane, projection_size
+from .render_store import RenderStore, render_key
+from .settings import Params
+
+
+# stages of the summary, see profiling.py ('render' is what is left of the rendering
+# once reading, downsampling and coloring the channels are taken out, 'cache' is the lookup and
+# copy of the montages already rendered)
+SUMMARY_STEPS = ('load', 'projection', 'contrast', 'read', 'downsample', 'colormap', 'render', 'encode', 'cache',
+                 'total')
+
+
+def find_files(source):
+    """List the TIFF files and OME-Zarr images of a directory, or of the paths matching a glob, sorted by name."""
+    if os.path.isdir(source) and not is_zarr(source):
+        files = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        files = glob.glob(source)
+    return sorted(path for path in files if is_image_file(path))
+
+
+def output_path(path, output_directory, extension='png'):
+    basename = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_directory, f"{basename}_montage.{extension}")
+
+
+def montage_key(path, params, extension='png'):
+    """Key of the montage of a file in the render cache: the file identity, the settings and the LUTs."""
+    luts = [get_lut(channel.colormap) for channel in params.channels]
+    return render_key('montage', file_key(path), params.render_settings(), luts, extension)
+
+
+def render_file(path, params, output_directory, extension='png', store=None):
+    """Render and save the montage of one file, its stages are recorded in the active profiler.
+
+    With a `store` (`RenderStore`), a montage already rendered from the same
+    file and settings is copied instead. Returns True when it was.
+    """
+    output = output_path(path, output_directory, extension)
+    if store is None:
+        write_montage(path, params, output)
+        return False
+    with stage('cache'):
+        return store.save(montage_key(path, params, extension), output,
+                          lambda rendered: write_montage(path, params, rendered))
+
+
+def write_montage(path, params, output):
+    # read, project and render the montage of one file into `output`
+    with stage('load'):
+        info = probe_image(path)
+        channel_axis = params.channel_axis_value
+        if channel_axis is None:
+            channel_axis = guess_channel_axis(info.shape, info.axes)
+        # pyramids are read at the level closest to the output size
+        level = montage_level(info.level_shapes, params.montage_rows, params.montage_columns,
+                              params.montage_spacing, params.export_max_size)
+        image = load_image(path, lazy=params.lazy_loading, level=level, workers=params.thread_count)
+        channels = channel_views(image, channel_axis)
+        # nD channels are projected, or sliced in their middle (there are no dims here)
+        planes = [montage_plane(channel, params.montage_projection, params.montage_projection_axes)
+                  for channel in channels]
+
+    with stage('contrast'):
+        settings = params.channels_for(len(channels))
+        # the contrast limits are for single planes, sums add up that many planes
+        n_planes = projection_size(channels[0].shape, params.montage_projection_axes, params.montage_projection)
+        if params.montage_projection != 'sum':
+            n_planes = 1
+        contrast_limits = [[low * n_planes, high * n_planes] for low, high in (channel.contrast_limits for channel in settings)]
+        if params.auto_contrast != 'none':
+            if channels[0].ndim == 2:
+                source, axis, key = image, channel_axis, (file_key(path), level)
+            else:
+                source, axis = np.stack([np.asarray(plane) for plane in planes]), 0
+                key = (file_key(path), level, params.montage_projection, tuple(params.montage_projection_axes))
+            contrast_limits = auto_contrast_limits(source, axis, params.auto_contrast,
+                                                   (params.auto_contrast_low, params.auto_contrast_high),
+                                                   key=key)
+
+    export_montage( output,
+                    planes,
+                    [get_lut(channel.colormap) for channel in settings],
+                    contrast_limits,
+                    rows = params.montage_rows,
+                    cols = params.montage_columns,
+                    spacing = params.montage_spacing,
+                    panels = default_panels(len(channels)),
+                    max_size = params.export_max_size,
+                    workers = params.thread_count )
+
+
+def _render_file_safely(args):
+    # runs in the worker processes, errors are reported in the summary instead of stopping the batch
+    path, params, output_directory, extension, trace_memory, store = args
+    profiler = Profiler(path, trace_memory=trace_memory)
+    cached = False
+    try:
+        with activate(profiler):
+            cached = render_file(path, params, output_directory, extension, store)
+        error = None
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    return path, dict(profiler.finish().to_dict(), cached=cached), error
+
+
+def run_batch(files, params, output_directory, workers=1, extension='png', trace_memory=False, store=None):
+    """Render all `files`, with a pool of `workers` processes when > 1.
+
+    Results are returned in the order of `files`, as (path, profile, error),
+    the profile being the `Profiler.to_dict` of the file, with `cached` True
+    when the montage was copied from the `store` (a `RenderStore`, shared by the processes).
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    tasks = [(path, params, output_directory, extension, trace_memory, store) for path in files]
+    if workers <= 1:
+        return [_render_file_safely(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render_file_safely, tasks))
+
+
+def format_summary(results, wall_time):
+    lines = [f"{'file':40s} " + " ".join(f"{step:>8s}" for step in SUMMARY_STEPS)]
+    for path, profile, error in results:
+        name = os.path.basename(path)
+        if error:
+            lines.append(f"{name:40s} FAILED {error}")
+            continue
+        timings = {record['name']: record['seconds'] for record in profile['stages']}
+        timings['total'] = profile['total_seconds']
+        line = f"{name:40s} " + " ".join(f"{timings.get(step, 0):8.3f}" for step in SUMMARY_STEPS)
+        lines.append(line + (" cached" if profile.get('cached') else ""))
+    n_failed = sum(1 for _, _, error in results if error)
+    n_cached = sum(1 for _, profile, error in results if not error and profile.get('cached'))
+    line = f"{len(results)} files ({n_failed} failed) in {wall_time:.3f} s"
+    if n_cached:
+        line += f", {n_cached} from the render cache"
+    lines.append(line)
+    return "\n".join(lines)
+
+
+def write_timings(path, results, wall_time, workers):
+    """Save the profiles of a batch run as JSON."""
+    log = {'workers': workers,
+           'wall_time_seconds': wall_time,
+           'files': [dict(profile, path=file_path, error=error) for file_path, profile, error in results]}
+    with open(path, 'w') as file:
+        json.dump(log, file, indent=2)
+
+
+def params_from_args(args):
+    # the profile (if any) gives the defaults, the options given on the command line override it
+    params = Params()
+    if args.profile:
+        params.load_profile(args.profile)
+    params.lazy_loading = True
+
+    options = {'channel_axis': 'channel_axis_value',
+               'channels_names': 'channels_names',
+               'channels_LUTs': 'channels_LUTs',
+               'channels_mins': 'channels_mins',
+               'channels_maxs': 'channels_maxs',
+               'auto_contrast': 'auto_contrast',
+               'rows': 'montage_rows',
+               'columns': 'montage_columns',
+               'spacing': 'montage_spacing',
+               'projection': 'montage_projection',
+               'projection_axes': 'montage_projection_axes',
+               'max_size': 'export_max_size',
+               'threads': 'threads',
+               'cache_size': 'render_cache_mb'}
+    for option, name in options.items():
+        value = getattr(args, option)
+        if value is not None:
+            setattr(params, name, value)
+    params.validate()
+    return params
+
+
+def _axes(text):
+    return [int(axis) for axis in text.split(",") if axis.strip()]
+
+
+def build_parser():
+    defaults = Params()
+    parser = argparse.ArgumentParser(prog="napari-figure-batch",
+                                     description="Render the montages of a directory (or glob) of TIFF files.")
+    parser.add_argument("source", help="directory of TIFF files, or a glob pattern")
+    parser.add_argument("-o", "--output", default="montages", help="output directory (default: %(default)s)")
+    parser.add_argument("--format", default="png", choices=["png", "tif", "jpg"], help="output format (default: %(default)s)")
+    parser.add_argument("-p", "--profile", help="settings profile (JSON or YAML) saved from the widget")
+    parser.add_argument("--channel-axis", type=int, help="channel axis, guessed from the metadata by default")
+    parser.add_argument("--channels-names", help=f"comma separated (default: {defaults.channels_names})")
+    parser.add_argument("--channels-LUTs", help=f"comma separated (default: {defaults.channels_LUTs})")
+    parser.add_argument("--channels-mins", help=f"comma separated (default: {defaults.channels_mins})")
+    parser.add_argument("--channels-maxs", help=f"comma separated (default: {defaults.channels_maxs})")
+    parser.add_argument("--auto-contrast", choices=AUTO_CONTRAST_METHODS,
+                        help=f"contrast limits from the histograms instead of mins/maxs (default: {defaults.auto_contrast})")
+    parser.add_argument("--rows", type=int, help=f"default: {defaults.montage_rows}")
+    parser.add_argument("--columns", type=int, help=f"default: {defaults.montage_columns}")
+    parser.add_argument("--spacing", type=int, help=f"default: {defaults.montage_spacing}")
+    parser.add_argument("--projection", choices=PROJECTION_METHODS,
+                        help=f"nD channels: 'slice' takes the middle planes (default: {defaults.montage_projection})")
+    parser.add_argument("--projection-axes", type=_axes, help="comma separated axes to project (default: all but YX)")
+    parser.add_argument("--max-size", type=int,
+                        help=f"longest side of the montages in pixels, panels are downsampled to fit, 0 for full resolution (default: {defaults.export_max_size})")
+    parser.add_argument("--timings-json", help="save the time spent in each stage of each file to this JSON file")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also record the peak memory of each stage (with tracemalloc, slower)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: %(default)s)")
+    parser.add_argument("--threads", type=int,
+                        help="threads decoding and coloring each file (default: the cores left by the worker processes)")
+    parser.add_argument("--cache-dir", help="directory of the render cache (default: in the napari-figure cache directory)")
+    parser.add_argument("--cache-size", type=int,
+                        help=f"size of the render cache in MB, 0 renders every file again (default: {defaults.render_cache_mb})")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    files = find_files(args.source)
+    if not files:
+        print(f"no TIFF file found in {args.source}", file=sys.stderr)
+        return 1
+
+    try:
+        params = params_from_args(args)
+    except (OSError, ValueError, TypeError) as error:
+        print(f"invalid settings: {error}", file=sys.stderr)
+        return 2
+    if args.threads is None:
+        # the processes share the cores
+        params.threads = max(1, (os.cpu_count() or 1) // max(args.workers, 1))
+
+    store = None
+    if params.render_cache_mb:
+        store = RenderStore(args.cache_dir, max_bytes=params.render_cache_mb * 2 ** 20)
+
+    start = time.perf_counter()
+    results = run_batch(files, params, args.output, workers=args.workers, extension=args.format,
+                        trace_memory=args.trace_memory, store=store)
+    wall_time = time.perf_counter() - start
+    print(format_summary(results, wall_time))
+    if args.timings_json:
+        write_timings(args.timings_json, results, wall_time, args.workers)
+    return 1 if any(error for _, _, error in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
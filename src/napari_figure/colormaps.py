@@ -0,0 +1,135 @@
+"""
+Registry of the colormaps used for the layers and the montages.
+
+Each colormap is built once as a (N, 4) float32 RGBA lookup table, which is
+cached and shared by its napari, vispy and matplotlib views.
+"""
+import numpy as np
+
+
+N_COLORS = 256
+
+# The BIOP colormaps, linear from black to the given color
+BIOP_COLORS = {
+    'biop_amber': (1.0, 0.5, 0.0),
+    'biop_azure': (0.0, 0.5, 1.0),
+    'biop_brightpink': (1.0, 0.0, 0.5),
+    'biop_chartreuse': (0.5, 1.0, 0.0),
+    'biop_electricindigo': (0.5, 0.0, 1.0),
+    'biop_springgreen': (0.0, 1.0, 0.5),
+}
+
+# name -> color (linear colormap) or (N, 3|4) table
+_colormaps = {name: np.asarray(color, dtype=np.float32) for name, color in BIOP_COLORS.items()}
+# name -> cached float32 RGBA table
+_luts = {}
+_napari_registered = False
+
+
+def register_colormap(name, colors):
+    """Add (or replace) a colormap at runtime.
+
+    `colors` is either an RGB color, for a linear colormap from black to
+    that color, or a (N, 3) / (N, 4) table of colors in [0, 1].
+    """
+    colors = np.asarray(colors, dtype=np.float32)
+    if colors.ndim == 1 and colors.shape[0] not in (3, 4):
+        raise ValueError(f"{name}: a color must have 3 or 4 components, got {colors.shape[0]}")
+    if colors.ndim == 2 and colors.shape[1] not in (3, 4):
+        raise ValueError(f"{name}: a table must have 3 or 4 columns, got {colors.shape[1]}")
+
+    _colormaps[name] = colors
+    _luts.pop(name, None)
+    if _napari_registered:
+        _register_with_napari(name)
+
+
+def color_colormap(color):
+    """Name of the linear colormap to an RGB `color` (e.g. of a file channel), registered on first use."""
+    name = "color_" + "".join(f"{int(round(255 * component)):02x}" for component in color[:3])
+    if name not in _colormaps:
+        register_colormap(name, color[:3])
+    return name
+
+
+def is_registered(name):
+    return name in _colormaps
+
+
+def is_known(name):
+    """Whether `name` is a colormap of the registry, or one napari knows (e.g. 'gray', 'viridis')."""
+    if name in _colormaps or name in _luts:
+        return True
+    try:
+        get_lut(name)
+    except (KeyError, ValueError):
+        return False
+    return True
+
+
+def available_colormaps():
+    return list(_colormaps)
+
+
+def get_lut(name):
+    """Return the cached (N, 4) float32 RGBA table of a colormap.
+
+    Colormaps that are not in the registry are looked up in napari (e.g.
+    'gray', 'cyan'). The returned table is read-only.
+    """
+    lut = _luts.get(name)
+    if lut is None:
+        lut = _build_lut(name)
+        lut.setflags(write=False)
+        _luts[name] = lut
+    return lut
+
+
+def get_lut_uint8(name):
+    """The table of `get_lut` as uint8, e.g. to color 8-bit images."""
+    return (get_lut(name) * 255).round().astype(np.uint8)
+
+
+def _build_lut(name):
+    if name not in _colormaps:
+        from napari.utils.colormaps import ensure_colormap
+        return ensure_colormap(name).map(np.linspace(0, 1, N_COLORS)).astype(np.float32)
+
+    colors = _colormaps[name]
+    if colors.ndim == 1:
+        ramp = np.linspace(0, 1, N_COLORS, dtype=np.float32)[:, np.newaxis]
+        colors = ramp * colors[np.newaxis, :3]
+    if colors.shape[1] == 3:
+        colors = np.hstack([colors, np.ones((len(colors), 1), np.float32)])
+    return np.ascontiguousarray(colors, dtype=np.float32)
+
+
+def as_napari(name):
+    from napari.utils.colormaps import Colormap
+    return Colormap(colors=get_lut(name), name=name, display_name=name)
+
+
+def as_vispy(name):
+    import vispy.color
+    return vispy.color.Colormap(get_lut(name))
+
+
+def as_matplotlib(name):
+    from matplotlib.colors import ListedColormap
+    return ListedColormap(get_lut(name), name=name)
+
+
+def register_napari_colormaps():
+    """Make every colormap of the registry available by name in napari.
+
+    Colormaps registered afterwards are added to napari as well.
+    """
+    global _napari_registered
+    for name in _colormaps:
+        _register_with_napari(name)
+    _napari_registered = True
+
+
+def _register_with_napari(name):
+    from napari.utils.colormaps import ensure_colormap
+    ensure_colormap(as_napari(name))
@@ -0,0 +1,151 @@
+"""
+Comparison figures: one row per file (condition), one column per channel plus their merge.
+
+Files are read lazily and in parallel, one 2D plane per channel (nD stacks
+are sliced or projected as in the montages), and the contrast limits are
+shared by all the rows, so that the conditions can be compared. With a
+`RenderStore`, the planes of each file are kept on disk: comparing the same
+files again, or after one of them changed, only reads the new files.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from .colormaps import get_lut
+from .contrast import Histogram, channel_histogram, contrast_limits_from_histogram, file_key, merge_histograms
+from .export import export_montage, montage_level
+from .image_io import channel_views, guess_channel_axis, load_image, probe_image
+from .montage import render_montage
+from .projection import montage_plane
+from .render_store import render_key
+
+
+@dataclass
+class ComparisonRow:
+    path: str
+    # the 2D plane shown for each channel, and its histogram
+    planes: List[np.ndarray]
+    histograms: List[Histogram]
+
+
+def row_key(path, params):
+    """Key of the planes of a file in a `RenderStore`, the file identity and the settings they depend on."""
+    settings = params.render_settings()
+    return render_key('comparison row', file_key(path),
+                      {name: settings[name] for name in ('channel_axis_value', 'montage_spacing', 'export_max_size',
+                                                         'montage_projection', 'montage_projection_axes')},
+                      params.auto_contrast != 'none')
+
+
+def load_row(path, params, cache=None, store=None):
+    """Read the planes of one file, as shown in the montages (from the `cache`, an `ImageCache`, when it is there).
+
+    With a `store` (`RenderStore`), the planes (and histograms) are read from,
+    or written to, the store.
+    """
+    if store is None:
+        return _read_row(path, params, cache)
+    stored, _ = store.render(row_key(path, params), 'npz',
+                             lambda stored: _save_row(stored, _read_row(path, params, cache)))
+    return _load_row(stored, path)
+
+
+def _read_row(path, params, cache=None):
+    info = cache.probe(path) if cache is not None else probe_image(path)
+    channel_axis = params.channel_axis_value
+    if channel_axis is None:
+        channel_axis = guess_channel_axis(info.shape, info.axes)
+    # one row of n_channels + 1 panels, out of the export size
+    n_channels = 1 if channel_axis is None else info.shape[channel_axis]
+    level = montage_level(info.level_shapes, 1, n_channels + 1, params.montage_spacing, params.export_max_size)
+    image = cache.image(path) if cache is not None and level == 0 else None
+    if image is None:
+        image = load_image(path, lazy=True, level=level)
+    planes = [np.asarray(montage_plane(channel, params.montage_projection, params.montage_projection_axes))
+              for channel in channel_views(image, channel_axis)]
+    histograms = [channel_histogram(plane) for plane in planes] if params.auto_contrast != 'none' else []
+    return ComparisonRow(str(path), planes, histograms)
+
+
+def _save_row(path, row):
+    arrays = {f"plane_{idx}": plane for idx, plane in enumerate(row.planes)}
+    for idx, histogram in enumerate(row.histograms):
+        arrays[f"counts_{idx}"] = histogram.counts
+        arrays[f"bin_starts_{idx}"] = histogram.bin_starts
+        arrays[f"bin_{idx}"] = np.array([histogram.bin_width, histogram.discrete], np.float64)
+    np.savez(path, **arrays)
+
+
+def _load_row(stored, path):
+    with np.load(stored) as arrays:
+        planes = [arrays[f"plane_{idx}"] for idx in range(sum(name.startswith('plane_') for name in arrays.files))]
+        histograms = []
+        for idx in range(sum(name.startswith('counts_') for name in arrays.files)):
+            bin_width, discrete = arrays[f"bin_{idx}"]
+            histograms.append(Histogram(arrays[f"counts_{idx}"], arrays[f"bin_starts_{idx}"],
+                                        int(bin_width) if discrete else float(bin_width), bool(discrete)))
+    return ComparisonRow(str(path), planes, histograms)
+
+
+def load_rows(paths, params, workers=None, cache=None, store=None):
+    """`load_row` of every file, in parallel threads (decoding releases the GIL), in the order of `paths`."""
+    with ThreadPoolExecutor(max_workers=workers or min(len(paths), os.cpu_count() or 1) or 1) as executor:
+        rows = list(executor.map(lambda path: load_row(path, params, cache, store), paths))
+
+    shapes = {row.planes[0].shape for row in rows}
+    if len(shapes) > 1:
+        raise ValueError(f"the files must have planes of the same shape to be compared, got {sorted(shapes)}")
+    return rows
+
+
+def shared_contrast_limits(rows, params):
+    """Contrast limits of each channel, the same for every row.
+
+    With auto contrast, they are computed from the histograms of all the rows
+    together, otherwise they are the limits of the channel settings.
+    """
+    n_channels = max(len(row.planes) for row in rows)
+    if params.auto_contrast == 'none':
+        return [channel.contrast_limits for channel in params.channels_for(n_channels)]
+    percentiles = (params.auto_contrast_low, params.auto_contrast_high)
+    return [contrast_limits_from_histogram(merge_histograms([row.histograms[idx] for row in rows if idx < len(row.histograms)]),
+                                           params.auto_contrast, percentiles)
+            for idx in range(n_channels)]
+
+
+def comparison_inputs(rows, params):
+    """The arguments of `render_montage` for a grid of len(rows) x (channels + merge) panels.
+
+    The channels of all rows are listed one after the other, channels missing
+    from a file give black panels.
+    """
+    n_channels = max(len(row.planes) for row in rows)
+    settings = params.channels_for(n_channels)
+    contrast_limits = shared_contrast_limits(rows, params)
+
+    images, luts, limits, panels = [], [], [], []
+    for row in rows:
+        first = len(images)
+        images += row.planes
+        luts += [get_lut(channel.colormap) for channel in settings[:len(row.planes)]]
+        limits += contrast_limits[:len(row.planes)]
+        columns = [[first + idx] if idx < len(row.planes) else [] for idx in range(n_channels)]
+        # the merge of (up to) the first three channels, last
+        columns.append(list(range(first, first + min(len(row.planes), 3))))
+        panels += columns
+    return images, luts, limits, panels, len(rows), n_channels + 1
+
+
+def render_comparison(rows, params):
+    images, luts, limits, panels, n_rows, n_cols = comparison_inputs(rows, params)
+    return render_montage(images, luts, limits, n_rows, n_cols, spacing=params.montage_spacing, panels=panels,
+                          workers=params.thread_count)
+
+
+def export_comparison(path, rows, params):
+    images, luts, limits, panels, n_rows, n_cols = comparison_inputs(rows, params)
+    return export_montage(path, images, luts, limits, n_rows, n_cols, spacing=params.montage_spacing,
+                          panels=panels, max_size=params.export_max_size, workers=params.thread_count)
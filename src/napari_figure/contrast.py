@@ -0,0 +1,153 @@
+"""
+Automatic contrast limits, from per-channel histograms.
+
+Histograms are computed on a strided subsample of each channel, so that only
+a fraction of a large (possibly lazy) stack is read, and are cached per file.
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from .image_io import channel_views
+
+
+# 'none' keeps the contrast limits of the settings
+AUTO_CONTRAST_METHODS = ['none', 'percentile', 'minmax']
+
+# number of pixels sampled per channel, and number of bins for float images
+MAX_SAMPLES = 2 ** 22
+FLOAT_BINS = 1024
+# number of histograms kept in the cache
+CACHE_SIZE = 256
+
+
+@dataclass
+class Histogram:
+    counts: np.ndarray
+    # first value of each bin, bins of integer images hold one value each
+    bin_starts: np.ndarray
+    bin_width: float
+    discrete: bool
+
+    def percentile(self, q, upper=False):
+        cdf = np.cumsum(self.counts) / max(self.counts.sum(), 1)
+        idx = min(int(np.searchsorted(cdf, q / 100.0)), len(self.counts) - 1)
+        value = self.bin_starts[idx]
+        if upper and not self.discrete:
+            value += self.bin_width
+        return float(value)
+
+
+def subsample(data, max_samples=MAX_SAMPLES):
+    """A strided view of `data` with at most about `max_samples` values.
+
+    Planes are skipped first (for nD stacks), then rows and columns, so that
+    lazy arrays only read the planes they need.
+    """
+    shape = np.shape(data)
+    n_values = int(np.prod(shape, dtype=np.int64))
+    if n_values <= max_samples:
+        return data
+
+    steps = [1] * len(shape)
+    ratio = n_values / max_samples
+    # skip planes along the leading axes
+    for axis in range(len(shape) - 2):
+        step = int(min(shape[axis], np.ceil(ratio)))
+        steps[axis] = step
+        ratio /= step
+    # then pixels within the planes
+    if ratio > 1:
+        step = int(np.ceil(np.sqrt(ratio)))
+        steps[-2:] = [step, step]
+    return data[tuple(slice(None, None, step) for step in steps)]
+
+
+def channel_histogram(data, max_samples=MAX_SAMPLES):
+    sample = np.asarray(subsample(data, max_samples))
+    if sample.dtype == bool:
+        sample = sample.view(np.uint8)
+
+    if sample.dtype.kind in 'ui' and sample.dtype.itemsize <= 2:
+        low = int(sample.min())
+        counts = np.bincount((sample.astype(np.int64) - low).ravel())
+        return Histogram(counts, np.arange(low, low + len(counts)), 1, discrete=True)
+
+    sample = sample[np.isfinite(sample)] if sample.dtype.kind == 'f' else sample
+    counts, edges = np.histogram(sample, bins=FLOAT_BINS)
+    return Histogram(counts, edges[:-1], float(edges[1] - edges[0]), discrete=False)
+
+
+def merge_histograms(histograms):
+    """One histogram of the values of several images, e.g. to share contrast limits between them."""
+    if len(histograms) == 1:
+        return histograms[0]
+    if all(histogram.discrete for histogram in histograms):
+        low = min(int(histogram.bin_starts[0]) for histogram in histograms)
+        high = max(int(histogram.bin_starts[-1]) for histogram in histograms)
+        counts = np.zeros(high - low + 1, np.int64)
+        for histogram in histograms:
+            start = int(histogram.bin_starts[0]) - low
+            counts[start:start + len(histogram.counts)] += histogram.counts
+        return Histogram(counts, np.arange(low, high + 1), 1, discrete=True)
+
+    # bins of different images do not match, their centers are binned again over the whole range
+    centers = np.concatenate([histogram.bin_starts + histogram.bin_width / 2 for histogram in histograms])
+    weights = np.concatenate([histogram.counts for histogram in histograms])
+    low = min(float(histogram.bin_starts[0]) for histogram in histograms)
+    high = max(float(histogram.bin_starts[-1]) + histogram.bin_width for histogram in histograms)
+    counts, edges = np.histogram(centers, bins=FLOAT_BINS, range=(low, max(high, low + 1e-12)), weights=weights)
+    return Histogram(counts, edges[:-1], float(edges[1] - edges[0]), discrete=False)
+
+
+def contrast_limits_from_histogram(histogram, method='percentile', percentiles=(0.1, 99.9)):
+    if method == 'minmax':
+        low, high = 0.0, 100.0
+    elif method == 'percentile':
+        low, high = percentiles
+    else:
+        raise ValueError(f"unknown auto contrast method {method!r}, expected one of {AUTO_CONTRAST_METHODS[1:]}")
+
+    # bins before the first / after the last non-empty one are skipped by the cdf
+    contrast_min = histogram.percentile(low)
+    contrast_max = histogram.percentile(high, upper=True)
+    if contrast_max <= contrast_min:
+        contrast_max = contrast_min + 1
+    return [contrast_min, contrast_max]
+
+
+_histograms = OrderedDict()
+_histograms_lock = threading.Lock()
+
+
+def file_key(path):
+    """Identity of a file on disk: any change of size or modification time is a new file."""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def cached_histograms(image, channel_axis, key=None):
+    """Histograms of every channel of `image`, cached under `key` (e.g. `file_key`)."""
+    cache_key = None if key is None else (key, channel_axis)
+    with _histograms_lock:
+        if cache_key is not None and cache_key in _histograms:
+            _histograms.move_to_end(cache_key)
+            return _histograms[cache_key]
+
+    histograms = [channel_histogram(channel) for channel in channel_views(image, channel_axis)]
+
+    if cache_key is not None:
+        with _histograms_lock:
+            _histograms[cache_key] = histograms
+            while len(_histograms) > CACHE_SIZE:
+                _histograms.popitem(last=False)
+    return histograms
+
+
+def auto_contrast_limits(image, channel_axis, method='percentile', percentiles=(0.1, 99.9), key=None):
+    """Contrast limits of every channel of `image`, see `contrast_limits_from_histogram`."""
+    return [contrast_limits_from_histogram(histogram, method, percentiles)
+            for histogram in cached_histograms(image, channel_axis, key)]
@@ -0,0 +1,202 @@
+"""
+Export of montages of large images, with a bounded memory use.
+
+The output size is computed up front: each panel is downsampled by an
+integer factor (area averaging) so that the montage fits in `max_size`
+pixels. The montage is then rendered in horizontal strips, reading only the
+rows of the channels needed for each strip, and the strips are streamed to
+a BigTIFF (tifffile) or PNG (zlib) file. Memory use follows the size of the
+output, not of the images. Images with a pyramid are read at the coarsest
+level that is still finer than the output, see `montage_level`.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+from .montage import apply_lut, blend_additive, default_panels, montage_shape, parallel_map, save_image
+from .profiling import stage
+
+
+# longest side of the exported montages, in pixels
+MAX_SIZE = 8192
+# height of the rendered strips, in output pixels
+STRIP_HEIGHT = 256
+# pyramid levels giving montages at least this fraction of the full resolution size are good enough
+LEVEL_TOLERANCE = 0.9
+# TIFFs larger than this are written as BigTIFF
+BIGTIFF_SIZE = 2 ** 31
+
+
+def downsample_factor(panel_shape, rows, cols, spacing, max_size=MAX_SIZE):
+    """The smallest integer factor for the montage of `panel_shape` panels to fit in `max_size` (0: no limit)."""
+    if not max_size:
+        return 1
+    height, width = panel_shape
+    factor = 1
+    while max(montage_shape(_downsampled_shape(panel_shape, factor), rows, cols, spacing)[:2]) > max_size:
+        if factor >= max(height, width):
+            break
+        factor += 1
+    return factor
+
+
+def montage_level(level_shapes, rows, cols, spacing=0, max_size=MAX_SIZE):
+    """The pyramid level to render a montage of at most `max_size` pixels from (0 without a pyramid).
+
+    Levels are downsampled by integer factors, so a coarse level can give a
+    smaller montage than the full resolution: the coarsest level whose
+    montage is within `LEVEL_TOLERANCE` of the largest one is used.
+    """
+    if len(level_shapes) < 2:
+        return 0
+    sizes = []
+    for shape in level_shapes:
+        panel_shape = tuple(shape[-2:])
+        factor = downsample_factor(panel_shape, rows, cols, spacing, max_size)
+        sizes.append(max(montage_shape(_downsampled_shape(panel_shape, factor), rows, cols, spacing)[:2]))
+    return max(level for level, size in enumerate(sizes) if size >= LEVEL_TOLERANCE * max(sizes))
+
+
+def _downsampled_shape(panel_shape, factor):
+    height, width = panel_shape
+    return -(-height // factor), -(-width // factor)
+
+
+def downsample(image, factor):
+    """Average `image` over blocks of `factor` x `factor` pixels.
+
+    Blocks cut by the bottom/right edges are averaged over the pixels they
+    have. Integer images are returned as is when `factor` is 1.
+    """
+    image = np.asarray(image)
+    if factor == 1:
+        return image
+    height, width = image.shape
+    row_starts, col_starts = np.arange(0, height, factor), np.arange(0, width, factor)
+    sums = np.add.reduceat(image, row_starts, axis=0, dtype=np.float64)
+    sums = np.add.reduceat(sums, col_starts, axis=1)
+    counts = np.outer(np.diff(np.append(row_starts, height)), np.diff(np.append(col_starts, width)))
+    return (sums / counts).astype(np.float32)
+
+
+def iter_montage_strips(images, luts, contrast_limits, rows, cols, spacing=0, panels=None, background=255,
+                        factor=1, strip_height=STRIP_HEIGHT, workers=None):
+    """Render the montage of `render_montage`, downsampled by `factor`, as strips of `strip_height` rows.
+
+    `images` can be lazy (dask, zarr, memmap): only the rows of each strip are
+    read. The channels of a strip are downsampled and colored by `workers` threads.
+    """
+    if panels is None:
+        panels = default_panels(len(images))
+    panels = panels[:rows * cols]
+    height, width = _downsampled_shape(np.shape(images[0])[-2:], factor)
+    total_height = montage_shape((height, width), rows, cols, spacing)[0]
+
+    for top in range(0, total_height, strip_height):
+        with stage('render'):
+            strip = _render_strip(images, luts, contrast_limits, rows, cols, spacing, panels, background,
+                                  factor, top, min(top + strip_height, total_height), workers)
+        yield strip
+
+
+def _render_strip(images, luts, contrast_limits, rows, cols, spacing, panels, background, factor, top, bottom,
+                  workers=None):
+    full_height, full_width = np.shape(images[0])[-2:]
+    height, width = _downsampled_shape((full_height, full_width), factor)
+    total_width = montage_shape((height, width), rows, cols, spacing)[1]
+
+    strip = np.full((bottom - top, total_width, 3), background, np.uint8)
+    for r in range(rows):
+        # rows of this panel row within the strip, in panel coordinates
+        y = r * (height + spacing)
+        start, stop = max(top, y) - y, min(bottom, y + height) - y
+        if start >= stop:
+            continue
+        # the rows of every channel of this panel row, each channel once
+        channels = sorted({channel for idx in range(r * cols, min((r + 1) * cols, len(panels)))
+                           for channel in panels[idx]})
+        with stage('read'):
+            rows_read = [np.asarray(images[channel][start * factor:min(stop * factor, full_height)])
+                         for channel in channels]
+        with stage('downsample'):
+            rows_read = parallel_map(lambda data: downsample(data, factor), rows_read, workers)
+        with stage('colormap'):
+            rgbs = dict(zip(channels, parallel_map(lambda item: apply_lut(item[1], luts[item[0]], contrast_limits[item[0]]),
+                                                   zip(channels, rows_read), workers)))
+        for c in range(cols):
+            idx = r * cols + c
+            x = c * (width + spacing)
+            target = strip[y + start - top:y + stop - top, x:x + width]
+            if idx >= len(panels):
+                target[...] = 0
+                continue
+            blend_additive([rgbs[channel] for channel in panels[idx]], target)
+    return strip
+
+
+def render_downsampled(images, luts, contrast_limits, rows, cols, spacing=0, panels=None, background=255,
+                       max_size=MAX_SIZE, strip_height=STRIP_HEIGHT, workers=None):
+    """The montage of `export_montage` as an in-memory array, e.g. a frame of a movie."""
+    factor = downsample_factor(np.shape(images[0])[-2:], rows, cols, spacing, max_size)
+    return np.concatenate(list(iter_montage_strips(images, luts, contrast_limits, rows, cols, spacing, panels,
+                                                   background, factor, strip_height, workers)))
+
+
+def write_png(path, strips, shape):
+    """Stream (h, w, 3) uint8 strips into a PNG file, compressed with zlib as they come."""
+    height, width, n_components = shape
+    color_type = 6 if n_components == 4 else 2
+
+    def chunk(file, kind, data):
+        file.write(struct.pack(">I", len(data)) + kind + data)
+        file.write(struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    compressor = zlib.compressobj(6)
+    with open(path, 'wb') as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+        for strip in strips:
+            # each row starts with its filter type, 0 (none)
+            with stage('encode'):
+                rows = np.zeros((strip.shape[0], 1 + width * n_components), np.uint8)
+                rows[:, 1:] = strip.reshape(strip.shape[0], -1)
+                data = compressor.compress(rows.tobytes())
+                if data:
+                    chunk(file, b"IDAT", data)
+        with stage('encode'):
+            chunk(file, b"IDAT", compressor.flush())
+            chunk(file, b"IEND", b"")
+
+
+def write_tiff(path, strips, shape, strip_height=STRIP_HEIGHT):
+    """Stream (h, w, 3) uint8 strips into a (Big)TIFF file with tifffile."""
+    from tifffile import imwrite
+    # the strips are rendered while tifffile writes, their 'render' stages are not counted as 'encode'
+    with stage('encode'):
+        imwrite(path, strips, shape=shape, dtype=np.uint8, photometric='rgb', rowsperstrip=strip_height,
+                bigtiff=int(np.prod(shape, dtype=np.int64)) >= BIGTIFF_SIZE)
+
+
+def export_montage(path, images, luts, contrast_limits, rows, cols, spacing=0, panels=None, background=255,
+                   max_size=MAX_SIZE, strip_height=STRIP_HEIGHT, workers=None):
+    """Render and write a montage (see `render_montage`) at most `max_size` pixels wide/high.
+
+    PNG and TIFF files are written strip by strip, other formats are rendered
+    whole and saved with `save_image`. Returns the shape of the montage.
+    """
+    panel_shape = np.shape(images[0])[-2:]
+    factor = downsample_factor(panel_shape, rows, cols, spacing, max_size)
+    shape = montage_shape(_downsampled_shape(panel_shape, factor), rows, cols, spacing)
+    strips = iter_montage_strips(images, luts, contrast_limits, rows, cols, spacing, panels, background,
+                                 factor, strip_height, workers)
+
+    path = str(path)
+    extension = path.lower().rsplit('.', 1)[-1]
+    if extension == 'png':
+        write_png(path, strips, shape)
+    elif extension in ('tif', 'tiff'):
+        write_tiff(path, strips, shape, strip_height)
+    else:
+        save_image(path, np.concatenate(list(strips)))
+    return shape
@@ -8,27 +8,41 @@ Replace code below according to your needs.
 """
 from typing import TYPE_CHECKING
 
+import json
 import os
-from tifffile import imread # https://pypi.org/project/tifffile/#examples
-from skimage import io
+from contextlib import nullcontext
+from copy import deepcopy
+from dataclasses import replace
 import numpy as np
 import string
 from pathlib import Path
 
-from qtpy.QtWidgets import (QWidget, QPushButton, QListWidget, QDialog, QSpinBox,
+from qtpy.QtWidgets import (QWidget, QPushButton, QListWidget, QListWidgetItem, QDialog, QSpinBox,
 QGroupBox, QGridLayout, QHBoxLayout,QVBoxLayout, QLabel, 
-QTabWidget, QLineEdit, QCheckBox, QFileDialog , QApplication)
-from qtpy.QtGui import QPixmap, QColor
-from qtpy.QtCore import Qt
-
-from microfilm.microplot import Micropanel
-from microfilm.microplot import microshow
+QTabWidget, QLineEdit, QCheckBox, QFileDialog , QProgressBar, QComboBox, QAbstractItemView,
+QPlainTextEdit)
+from qtpy.QtGui import QPixmap, QImage, QColor, QIcon
+from qtpy.QtCore import Qt, QTimer
+
+from .comparison import export_comparison, load_rows, render_comparison
+from .contrast import AUTO_CONTRAST_METHODS, MAX_SAMPLES, auto_contrast_limits, file_key
+from .file_index import THUMBNAIL_SIZE, DirectoryIndex
+from .colormaps import as_matplotlib, color_colormap, is_registered, register_napari_colormaps
+from .image_cache import ImageCache, prefetch
+from .image_io import iter_load_image, level_downsampling, load_multiscale, probe_image, select_level
+from .export import export_montage as write_montage, montage_level, render_downsampled
+from .montage import RenderCache, default_panels, figure_to_array, render_montage
+from .movie import MAX_WORKERS, frame_plane, frame_projection_size, movie_frames, write_movie
+from .profiling import Profiler, activate, stage
+from .projection import PROJECTION_METHODS, montage_plane, projected_axes, projection_size
+from .render_store import RenderStore, render_key
+from .settings import MONTAGE_ENGINES, Params
 
 import napari
+from napari.layers.utils.stack_utils import split_channels
+from napari.qt.threading import thread_worker
 from napari.utils.notifications import show_info
 
-import vispy.color # to make own colormaps
-from matplotlib.colors import ListedColormap # to make own colormaps
 
 
 class FigureWidget(QWidget):
@@ -40,6 +54,8 @@ class FigureWidget(QWidget):
         super().__init__()
         self.viewer = napari_viewer   
         self.params = Params()
+        # set the defaults first, so that the settings widgets show them
+        self.initialize()
         #self.colormaps = ColorMaps()  
 
         # Create a VerticalBox layout for the widget
@@ -62,6 +78,9 @@ class FigureWidget(QWidget):
         self._montage_layout = QVBoxLayout()
         self.montage.setLayout(self._montage_layout)
         self.tabs.addTab(self.montage, 'Montage')
+        # Diagnostics tab, timings of the loading and montage operations (when enabled)
+        self.diagnostics = DiagnosticsPanel(params = self.params)
+        self.tabs.addTab(self.diagnostics, 'Diagnostics')
         ## Add Tabs to the layout
         self._layout.addWidget(self.tabs)
         ###############################
@@ -72,8 +91,13 @@ class FigureWidget(QWidget):
         self.file_grid = QGridLayout()
         self._file_layout.addLayout(self.file_grid)
 
+        # decoded images, shared by the file selector, the loader and the comparisons, see image_cache.py
+        self.image_cache = ImageCache(self.params.image_cache_mb * 2**20)
+        # saved montages and the planes of the compared files, on disk, see render_store.py
+        self.render_store = RenderStore(max_bytes=self.params.render_cache_mb * 2**20)
+
         ###############create a file selector
-        self.file_selector = FileSelector(napari_viewer=self.viewer, params= self.params)
+        self.file_selector = FileSelector(napari_viewer=self.viewer, params= self.params, image_cache= self.image_cache)
         # make a groupbox for the file selector    
         self.file_groupbox = QGroupBox('Select a file')
         self.file_groupbox_layout = QVBoxLayout()       
@@ -82,15 +106,56 @@ class FigureWidget(QWidget):
         # add the groupbox to the grid
         self.file_grid.addWidget(self.file_groupbox,0,0)
         
-        # Add a "remove existing layers" checkbox
+        # Add a "remove existing layers" checkbox, and one to reuse the layers of the same channels instead
+        self.layers_layout = QHBoxLayout()
         self.remove_existing_layers = QCheckBox('Remove existing layers')
-        self.remove_existing_layers.setChecked(True)
-        self.file_grid.addWidget(self.remove_existing_layers , 1,0)
+        self.remove_existing_layers.setChecked(self.params.remove_existing_layers)
+        self.layers_layout.addWidget(self.remove_existing_layers)
+        self.reuse_layers = QCheckBox('Reuse matching layers')
+        self.reuse_layers.setToolTip('Put the channels of the new file in the layers of the same channels, '
+                                     'keeping their colormaps and contrast limits until the settings change')
+        self.reuse_layers.setChecked(self.params.reuse_layers)
+        self.reuse_layers.setEnabled(self.params.remove_existing_layers)
+        self.layers_layout.addWidget(self.reuse_layers)
+        self.file_grid.addLayout(self.layers_layout , 1,0)
+
+        # Add a "lazy loading" checkbox, planes are then read on display
+        self.lazy_loading = QCheckBox('Lazy loading (read displayed planes only)')
+        self.lazy_loading.setChecked(self.params.lazy_loading)
+        self.file_grid.addWidget(self.lazy_loading , 2,0)
+
+        # Add the image cache size, and a checkbox to decode the next/previous files in the background
+        self.cache_layout = QHBoxLayout()
+        self.prefetch_neighbours = QCheckBox('Prefetch neighbour files')
+        self.prefetch_neighbours.setChecked(self.params.prefetch_neighbours)
+        self.cache_layout.addWidget(self.prefetch_neighbours)
+        self.cache_layout.addWidget(QLabel('Image cache (MB)'))
+        self.image_cache_size = QSpinBox( minimum = 0, maximum = 2**20, singleStep = 256, value = self.params.image_cache_mb )
+        self.image_cache_size.setSpecialValueText('off')
+        self.cache_layout.addWidget(self.image_cache_size)
+        # threads decoding the files and coloring the montage channels
+        self.cache_layout.addWidget(QLabel('Threads'))
+        self.threads = QSpinBox( minimum = 0, maximum = 256, value = self.params.threads )
+        self.threads.setSpecialValueText('auto')
+        self.cache_layout.addWidget(self.threads)
+        self.file_grid.addLayout(self.cache_layout , 3,0)
 
         # Add a "Load Image" button
         self.load_button = QPushButton('Load Image')
         self.load_button.setEnabled(  True ) #TODO: make this dependent on the file selector
-        self.file_grid.addWidget(self.load_button , 2 ,0)
+        self.file_grid.addWidget(self.load_button , 4 ,0)
+
+        # Add a progress bar and a "Cancel" button, for the loading in the background
+        self.load_progress_layout = QHBoxLayout()
+        self.load_progress = QProgressBar()
+        self.load_progress.setValue(0)
+        self.load_progress_layout.addWidget(self.load_progress)
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.setEnabled(False)
+        self.load_progress_layout.addWidget(self.cancel_button)
+        self.file_grid.addLayout(self.load_progress_layout , 5 ,0)
+        self.load_worker = None
+        self.load_profiler = None
 
         ###############create a settings selector
         self.visual_settings_selector = SettingsSelector(napari_viewer=self.viewer, params= self.params)
@@ -98,11 +163,30 @@ class FigureWidget(QWidget):
         self.visual_settings_groupbox_layout = QVBoxLayout() 
         self.visual_settings_groupbox_layout.addWidget(self.visual_settings_selector )
         self.visual_settings_groupbox.setLayout(self.visual_settings_groupbox_layout )
-        self.file_grid.addWidget(self.visual_settings_groupbox,3,0)
+        self.file_grid.addWidget(self.visual_settings_groupbox,6,0)
+
+        # Add "Save profile" and "Load profile" buttons, to reuse all the settings with other files
+        self.profile_layout = QHBoxLayout()
+        self.save_profile_button = QPushButton('Save Profile...')
+        self.load_profile_button = QPushButton('Load Profile...')
+        self.profile_layout.addWidget(self.save_profile_button)
+        self.profile_layout.addWidget(self.load_profile_button)
+        self.file_grid.addLayout(self.profile_layout , 7 ,0)
         ###############################
 
         # Connect signals to slots
         self.load_button.clicked.connect(self.load_selected_file)
+        self.lazy_loading.stateChanged.connect(self.update_lazy_loading)
+        self.remove_existing_layers.stateChanged.connect(self.update_remove_existing_layers)
+        self.reuse_layers.stateChanged.connect(self.update_reuse_layers)
+        self.prefetch_neighbours.stateChanged.connect(self.update_prefetch_neighbours)
+        self.image_cache_size.valueChanged.connect(self.update_image_cache_size)
+        self.threads.valueChanged.connect(self.update_threads)
+        self.cancel_button.clicked.connect(self.cancel_loading)
+        self.save_profile_button.clicked.connect(self.save_profile)
+        self.load_profile_button.clicked.connect(self.load_profile)
+        # selecting another file cancels the in-flight read
+        self.file_selector.file_list.itemSelectionChanged.connect(self.cancel_loading)
         ##############################################################
 
         ##############################################################
@@ -116,55 +200,97 @@ class FigureWidget(QWidget):
         self.montage_button.setEnabled(  True )
         self._montage_layout.addWidget(self.montage_button)
 
+        # Comparison figure of the files selected in the File tab: a row per file, a column per channel + merge
+        self.comparison_button = QPushButton('Compare Selected Files')
+        self._montage_layout.addWidget(self.comparison_button)
+        self.comparison_worker = None
+        self.comparison_rows = None
+
+        # Live preview: the montage is rendered again when a layer, the dims or the grid change.
+        # Colored channels and merged panels are cached, only the changed ones are rendered.
+        self.live_preview = QCheckBox('Live preview')
+        self.live_preview.setChecked(self.params.montage_live_preview)
+        self._montage_layout.addWidget(self.live_preview)
+        self.render_cache = RenderCache()
+        # data version of each layer, the cache keys change when a layer data is replaced
+        self.layer_versions = {}
+        # several events in a row (e.g. dragging a contrast slider) give one update
+        self.preview_timer = QTimer()
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(50)
+
+        # Preview of the montage, rendered in memory
+        self.montage_preview = QLabel()
+        self.montage_preview.setMinimumSize(300, 200)
+        self.montage_preview.setAlignment(Qt.AlignCenter)
+        self._montage_layout.addWidget(self.montage_preview)
+        self.montage_image = None
+
+        # Saving to a file is a separate step
+        self.export_button = QPushButton('Save Montage...')
+        self.export_button.setEnabled( False )
+        self._montage_layout.addWidget(self.export_button)
+
+        # one montage per timepoint / z-plane, streamed to a movie file
+        self.movie_button = QPushButton('Save Movie...')
+        self._montage_layout.addWidget(self.movie_button)
+
         # Connect signals to slots
         self.montage_button.clicked.connect(self.create_montage_image)
+        self.comparison_button.clicked.connect(self.create_comparison_image)
+        self.live_preview.stateChanged.connect(self.update_live_preview)
+        self.preview_timer.timeout.connect(self.refresh_preview)
+        self.viewer.layers.events.inserted.connect(self.layer_inserted)
+        self.viewer.layers.events.removed.connect(self.schedule_preview)
+        self.viewer.dims.events.current_step.connect(self.schedule_preview)
+        for layer in self.viewer.layers:
+            self.connect_layer(layer)
+        for spinbox in (self.montage_creator.montage_rows_value,
+                        self.montage_creator.montage_columns_value,
+                        self.montage_creator.montage_spacing_value):
+            spinbox.valueChanged.connect(self.schedule_preview)
+        self.montage_creator.montage_projection_value.currentTextChanged.connect(self.schedule_preview)
+        self.export_button.clicked.connect(self.export_montage)
+        self.movie_button.clicked.connect(self.export_movie)
         ##############################################################
 
-        #  Initialize the widget WITH LOADING OF A 6 channels image, for loading biop_colormaps
-        #TODO find a way to add colormaps to napa without loading an image !!!
-        self.initialize()
+        # Make the biop colormaps available in napari, no image needs to be loaded for that
+        register_napari_colormaps()
 
     def initialize(self):
-        # This method is called when the widget is added to the viewer dock widget
-        # You can do things like connect to events here
-        self.params.selected_directory = 'data/'
-        self.params.selected_file = '6chs_loading.tif'
+        # Default settings, for the 6 channels images of the facility
+        # (no image is loaded, the directory and file are selected in the File tab)
         self.params.channel_axis_value = 0
         self.params.channels_LUTs = "biop_azure,biop_amber,biop_brightpink,biop_chartreuse,biop_electricindigo,biop_springgreen"
         self.params.channels_names = "ch1,ch2,ch3,ch4,ch5,ch6"
         self.params.channels_mins = "0,0,0,0,0,0"
         self.params.channels_maxs = "255,255,255,255,255,255"
-        self.load_selected_file() 
 
 
-    def create_montage_image(self):
+    def build_micropanel(self):
+        # microfilm and matplotlib are only imported when this engine is used
+        from microfilm.microplot import Micropanel, microshow
+        import matplotlib.pyplot as plt
+
+        layers = image_layers(self.viewer)
+        if not layers:
+            raise ValueError("there are no image layers")
         layers_data = []
-        for layer in self.viewer.layers:
-            layers_data.append(layer.data)
+        for layer in layers:
+            layers_data.append(np.asarray(self.layer_plane(layer)))
 
-        colormaps = self.params.channels_LUTs.split(",")
-        while (  len( colormaps) != len(self.viewer.layers) ): colormaps.append("gray")
-        
-        N=256
+        colormaps = [channel.colormap for channel in self.params.channels_for(len(layers))]
+
+        # matplotlib views of our colormaps, other names are handled by microfilm
         for idx in range(len(colormaps)):
-            if colormaps[idx] == "biop_amber":
-                colormaps[idx] = self.MakeMltCmap(N, N  , N/2,0)
-            elif colormaps[idx] == "biop_azure":
-                colormaps[idx] = self.MakeMltCmap(N, 0  , N/2,N)
-            elif colormaps[idx] == "biop_brightpink":
-                colormaps[idx] = self.MakeMltCmap(N, N  , 0  ,N/2)
-            elif colormaps[idx] == "biop_chartreuse":
-                colormaps[idx] = self.MakeMltCmap(N, N/2, N  ,0)
-            elif colormaps[idx] == "biop_electricindigo":
-                colormaps[idx] = self.MakeMltCmap(N, N/2, 0  ,N)
-            elif colormaps[idx] == "biop_springgreen":
-                colormaps[idx] = self.MakeMltCmap(N, 0  , N  ,N/2)
+            if is_registered( colormaps[idx] ):
+                colormaps[idx] = as_matplotlib( colormaps[idx] )
 
         panels = []
 
         panels.append( microshow( images=layers_data[0:3] , cmaps=colormaps[0:3] ) )
                       
-        for idx in range(len(self.viewer.layers)):
+        for idx in range(len(layers)):
             layer = layers_data[idx]
             colormap = colormaps[idx]
             panels.append( microshow( images=layer , cmaps=colormap ) )
@@ -174,137 +300,692 @@ class FigureWidget(QWidget):
                                 )
         
         #TODO make sure it works with r x c > len(panels)
-        if self.params.montage_rows*self.params.montage_columns != len(panels):
-            if self.params.montage_rows*self.params.montage_columns < len(panels):
-                show_info("you've defined less panels than the number of layers, some layers will be missing")
-            else:
-                show_info("you've defined more panels than the number of layers, some panels will be empty")
-                panels.append( microshow( images=[np.zeros(layers_data[0].shape)] ))
+        if self.check_panels_count( len(panels) ) > 0:
+            panels.append( microshow( images=[np.zeros(layers_data[0].shape)] ))
         
+        # add_element moves the panels to the micropanel figure, so keep their own figures to close them
+        panel_figures = [panel.fig for panel in panels]
+
         i=0
         for r in range(self.params.montage_rows):
             for c in range(self.params.montage_columns):
-                micropanel.add_element( pos=[r,c] , microim=panels[i] )
+                if i < len(panels):
+                    micropanel.add_element( pos=[r,c] , microim=panels[i] )
                 i+=1
 
-
-        # Save the montage image
-        montage_path = os.path.join(self.params.selected_directory, "montage.png")
-        micropanel.savefig(str(montage_path), bbox_inches = 'tight', pad_inches = 0, dpi=600)
-       
-        #TODO replace this with a QPixMap
-        #montage_image = io.imread(str(montage_path))
-        #montage_viewer = napari.Viewer()
-        #montage_viewer.add_image(montage_image, name="montage")
-        app = QApplication([])
-        label = QLabel()
-
-        # Create a QPixmap object from a local image file
-        pixmap = QPixmap(str( montage_path) )
-        pixmap.width()
-        pixmap.height()
-        # Scale the pixmap to fit within the label
-        scaled_pixmap = pixmap.scaled(label.width(), label.height())
-        # Create a QLabel widget and set the pixmap as its image
-        label.setPixmap(scaled_pixmap)
-        # Show the label
-        label.show()
-        # Run the event loop
-        app.exec_()
-
-
-
-    #TODO move this to a separate file
-    def MakeMltCmap(self, N, red_lim,g_lim,blue_lim):
-        array = np.ones((N, 4))
-        array[:, 0] = np.linspace(0, red_lim /N, N)
-        array[:, 1] = np.linspace(0, g_lim   /N, N)
-        array[:, 2] = np.linspace(0, blue_lim/N, N)
-        return ListedColormap(array)
-    
+        for figure in panel_figures:
+            plt.close(figure)
+
+        return micropanel
+
+    def layer_key(self, layer):
+        # identity of the pixels of a layer plane: layer, data version, and projection or slice
+        axes = projected_axes( layer.ndim, self.params.montage_projection_axes, self.params.montage_projection )
+        position = layer.world_to_data(self.viewer.dims.point) if layer.ndim > 2 else ()
+        index = tuple( int(round(float(position[axis]))) for axis in range(layer.ndim - 2) if axis not in axes )
+        return ( layer.unique_id, self.layer_versions.get(layer.unique_id, 0),
+                 self.params.montage_projection, axes, index )
+
+    def layer_level(self, layer, step=1, max_size=None):
+        # the pyramid level of a multiscale layer (0 for other layers), for a preview of every `step` pixel,
+        # or for an export of at most `max_size` pixels
+        if not layer.multiscale:
+            return 0
+        shapes = [level.shape for level in layer.data]
+        if max_size is not None:
+            return montage_level( shapes, self.params.montage_rows, self.params.montage_columns,
+                                  self.params.montage_spacing, max_size )
+        return select_level( shapes, step )[0]
+
+    def layer_data(self, layer, level=0):
+        # the data of a layer at a pyramid level, and the current dims position in its pixels
+        position = layer.world_to_data(self.viewer.dims.point) if layer.ndim > 2 else None
+        data = layer.data
+        if layer.multiscale:
+            data = layer.data[level]
+            # the position is in full resolution pixels
+            if position is not None:
+                position = [ value * length / full for value, length, full in zip(position, data.shape, layer.data.shape) ]
+        return data, position
+
+    def layer_plane(self, layer, level=0):
+        # nD layers are sliced at the current dims position, or projected, see Params.montage_projection
+        data, position = self.layer_data(layer, level)
+        return montage_plane( data, self.params.montage_projection,
+                              self.params.montage_projection_axes, position )
+
+    def layer_frame(self, layer, index, level=0):
+        # the plane of movie frame `index`, the movie axis is never projected
+        data, position = self.layer_data(layer, level)
+        return frame_plane( data, self.params.movie_axis, index, self.params.montage_projection,
+                            self.params.montage_projection_axes, position )
+
+    def layer_contrast_limits(self, layer, level=0, movie=False):
+        # the contrast limits of a layer are for single planes, sums add up that many planes
+        low, high = layer.contrast_limits
+        if self.params.montage_projection == 'sum':
+            shape = layer.data[level].shape if layer.multiscale else layer.data.shape
+            if movie:
+                n_planes = frame_projection_size( shape, self.params.movie_axis, self.params.montage_projection_axes )
+            else:
+                n_planes = projection_size( shape, self.params.montage_projection_axes, 'sum' )
+            return [low * n_planes, high * n_planes]
+        return [low, high]
+
+    def check_panels_count(self, n_panels):
+        # Warn when the grid does not match the panels, returns the number of empty panels
+        n_cells = self.params.montage_rows*self.params.montage_columns
+        if n_cells < n_panels:
+            show_info("you've defined less panels than the number of layers, some layers will be missing")
+        elif n_cells > n_panels:
+            show_info("you've defined more panels than the number of layers, some panels will be empty")
+        return n_cells - n_panels
+
+    def numpy_montage_inputs(self, notify=True, step=1, max_size=None):
+        # The layers planes (every `step` full resolution pixel), colormaps and contrast limits as shown in the viewer,
+        # and the panels. Multiscale layers are read at the pyramid level of the `step`, or of the export `max_size`
+        layers = image_layers(self.viewer)
+        if not layers:
+            raise ValueError("there are no image layers")
+        with stage('planes'):
+            images, contrast_limits = [], []
+            for layer in layers:
+                level = self.layer_level(layer, step, max_size)
+                stride = step
+                if layer.multiscale:
+                    stride = max(1, int(step / level_downsampling([data.shape for data in layer.data], level) + 1e-3))
+                images.append( self.layer_plane(layer, level)[::stride, ::stride] )
+                contrast_limits.append( self.layer_contrast_limits(layer, level) )
+            luts = [layer.colormap.map(np.linspace(0, 1, 256)) for layer in layers]
+
+        panels = default_panels(len(layers))
+        if notify:
+            self.check_panels_count( len(panels) )
+        return images, luts, contrast_limits, panels
+
+    def build_numpy_montage(self, notify=True, step=1):
+        # Compose the montage in memory, reusing the cached channels and panels
+        images, luts, contrast_limits, panels = self.numpy_montage_inputs(notify, step)
+        with stage('render'):
+            return render_montage( images, luts, contrast_limits,
+                                   rows = self.params.montage_rows,
+                                   cols = self.params.montage_columns,
+                                   spacing = self.params.montage_spacing,
+                                   panels = panels,
+                                   keys = [self.layer_key(layer) + (step,) for layer in image_layers(self.viewer)],
+                                   cache = self.render_cache,
+                                   workers = self.params.thread_count )
+
+    def preview_step(self):
+        # the preview does not need more than about twice the pixels of its label
+        layers = image_layers(self.viewer)
+        if not layers:
+            return 1
+        panel_height, panel_width = layers[0].data.shape[-2:]
+        height = self.params.montage_rows * panel_height
+        width = self.params.montage_columns * panel_width
+        return max(1, int(min(height / (2 * self.montage_preview.height()), width / (2 * self.montage_preview.width()))))
+
+    def create_montage_image(self, notify=True):
+        # Render the montage in memory and show it in the preview, nothing is written to disk
+        profiler = self.diagnostics.new_profiler( f"montage preview ({self.params.montage_engine})" )
+        try:
+            with activate(profiler):
+                try:
+                    if self.params.montage_engine == "numpy":
+                        self.montage_image = self.build_numpy_montage(notify, self.preview_step())
+                    else:
+                        with stage('microfilm panels'):
+                            micropanel = self.build_micropanel()
+                        self.montage_image = figure_to_array(micropanel.fig, dpi=self.params.montage_preview_dpi)
+                except ValueError as error:
+                    show_info( f"Can't create the montage: {error}" )
+                    return
+                self.comparison_rows = None
+                with stage('preview'):
+                    self.show_montage_preview(self.montage_image)
+            self.export_button.setEnabled(True)
+            self.diagnostics.record(profiler)
+        finally:
+            self.diagnostics.discard(profiler)
+
+    def update_live_preview(self):
+        self.params.montage_live_preview = self.live_preview.isChecked()
+        self.schedule_preview()
+
+    def layer_inserted(self, event):
+        self.connect_layer(event.value)
+        self.schedule_preview()
+
+    def connect_layer(self, layer):
+        # only image layers are in the montage (labels, points, shapes... have no colormap nor contrast limits)
+        if not isinstance(layer, napari.layers.Image):
+            return
+        layer.events.contrast_limits.connect(self.schedule_preview)
+        layer.events.colormap.connect(self.schedule_preview)
+        layer.events.data.connect(lambda event, layer=layer: self.layer_data_changed(layer))
+
+    def layer_data_changed(self, layer):
+        self.layer_versions[layer.unique_id] = self.layer_versions.get(layer.unique_id, 0) + 1
+        # the data does not come from its file any more (the loader sets it again, see swap_layers_data)
+        layer.metadata.pop('source', None)
+        self.schedule_preview()
+
+    def schedule_preview(self, event=None):
+        if self.params.montage_live_preview and self.params.montage_engine == "numpy":
+            self.preview_timer.start()
+
+    def refresh_preview(self):
+        # only the channels and panels that changed are rendered again, see RenderCache
+        if image_layers(self.viewer) and self.params.montage_live_preview:
+            self.create_montage_image(notify=False)
+
+    def create_comparison_image(self):
+        # The selected files are read in parallel in a worker, then rendered with shared contrast limits
+        names = [item.data(Qt.UserRole) for item in self.file_selector.file_list.selectedItems()]
+        if not names or not self.params.selected_directory:
+            show_info( "Select the files to compare in the File tab" )
+            return
+        paths = [os.path.join(self.params.selected_directory, name) for name in sorted(names)]
+        if self.comparison_worker is not None:
+            self.comparison_worker.quit()
+        # the settings are copied, they may change while the files are read
+        self.comparison_worker = thread_worker(load_rows)(paths, deepcopy(self.params), cache=self.image_cache,
+                                                          store=self.montage_store())
+        self.comparison_worker.returned.connect(self.show_comparison)
+        self.comparison_worker.errored.connect(self.comparison_failed)
+        self.comparison_button.setEnabled(False)
+        self.comparison_worker.start()
+
+    def show_comparison(self, rows):
+        self.comparison_worker = None
+        self.comparison_button.setEnabled(True)
+        self.comparison_rows = rows
+        self.montage_image = render_comparison(rows, self.params)
+        self.show_montage_preview(self.montage_image)
+        self.export_button.setEnabled(True)
+
+    def comparison_failed(self, error):
+        self.comparison_worker = None
+        self.comparison_button.setEnabled(True)
+        show_info( f"Can't compare the files: {error}" )
+
+    def show_montage_preview(self, image):
+        height, width, n_components = image.shape
+        image_format = QImage.Format_RGBA8888 if n_components == 4 else QImage.Format_RGB888
+        image = np.ascontiguousarray(image)
+        qimage = QImage(image.data, width, height, image.strides[0], image_format).copy()
+        pixmap = QPixmap.fromImage(qimage)
+        # Scale the pixmap to fit within the preview label
+        self.montage_preview.setPixmap( pixmap.scaled(self.montage_preview.width(),
+                                                      self.montage_preview.height(),
+                                                      Qt.KeepAspectRatio,
+                                                      Qt.SmoothTransformation) )
+
+    def export_montage(self):
+        # Explicit export step, the montage is rendered again at the export resolution
+        default_path = os.path.join(self.output_directory(), "montage.png")
+        montage_path, _ = QFileDialog.getSaveFileName(self, 'Save Montage', default_path, 'Images (*.png *.tif *.pdf *.svg)')
+        if montage_path:
+            self.save_montage(montage_path)
+
+    def save_montage(self, montage_path):
+        profiler = self.diagnostics.new_profiler( f"export {os.path.basename(str(montage_path))}" )
+        try:
+            with activate(profiler):
+                try:
+                    self.write_montage_file(montage_path)
+                except ValueError as error:
+                    show_info( f"Can't save the montage: {error}" )
+                    return
+            self.diagnostics.record(profiler)
+        finally:
+            self.diagnostics.discard(profiler)
+        show_info( str(montage_path)+" saved!" )
+
+    def write_montage_file(self, montage_path):
+        import matplotlib.pyplot as plt
+
+        if self.comparison_rows is not None:
+            # the last preview was a comparison of files
+            export_comparison(montage_path, self.comparison_rows, self.params)
+            return
+        if self.params.montage_engine == "numpy":
+            # a montage of the same files and settings is copied from the render store, nothing is read
+            key = self.montage_key(montage_path)
+            if key is not None:
+                with stage('cache'):
+                    self.montage_store().save(key, montage_path, self.write_numpy_montage)
+            else:
+                self.write_numpy_montage(montage_path)
+            return
+        with stage('microfilm panels'):
+            micropanel = self.build_micropanel()
+        # matplotlib draws and encodes the figure in one go
+        with stage('encode'):
+            micropanel.savefig(str(montage_path), bbox_inches = 'tight', pad_inches = 0, dpi=self.params.montage_dpi)
+        plt.close(micropanel.fig)
+
+    def write_numpy_montage(self, montage_path):
+        # downsampled to the export size and streamed to the file, strip by strip
+        images, luts, contrast_limits, panels = self.numpy_montage_inputs(max_size=self.params.export_max_size)
+        write_montage( montage_path, images, luts, contrast_limits,
+                       rows = self.params.montage_rows,
+                       cols = self.params.montage_columns,
+                       spacing = self.params.montage_spacing,
+                       panels = panels,
+                       max_size = self.params.export_max_size,
+                       workers = self.params.thread_count )
+
+    def output_directory(self):
+        # where the figures are saved by default
+        return self.params.output_directory or self.params.selected_directory or ""
+
+    def montage_store(self):
+        # the render store, None when it is turned off
+        if not self.params.render_cache_mb:
+            return None
+        self.render_store.max_bytes = self.params.render_cache_mb * 2**20
+        return self.render_store
+
+    def montage_key(self, montage_path):
+        # key of the exported montage in the render store: the files and channels of the layers, their
+        # slice/projection, LUTs and contrast limits, and the grid and output size. None without a store,
+        # or when a layer was not loaded from a file
+        layers = image_layers(self.viewer)
+        if self.montage_store() is None or not layers or not all('source' in layer.metadata for layer in layers):
+            return None
+        try:
+            sources = [ (file_key(layer.metadata['source'][0]),) + tuple(layer.metadata['source'][1:]) for layer in layers ]
+        except OSError:
+            # the file was removed or moved
+            return None
+        levels = [ self.layer_level(layer, max_size=self.params.export_max_size) for layer in layers ]
+        return render_key( 'widget montage', sources, levels,
+                           [ self.layer_key(layer)[2:] for layer in layers ],
+                           [ layer.colormap.map(np.linspace(0, 1, 256)) for layer in layers ],
+                           [ self.layer_contrast_limits(layer, level) for layer, level in zip(layers, levels) ],
+                           self.params.montage_rows, self.params.montage_columns, self.params.montage_spacing,
+                           default_panels(len(layers)), self.params.export_max_size,
+                           os.path.splitext(str(montage_path))[1].lower() )
+
+    def export_movie(self):
+        # one montage per index of the movie axis, rendered a few frames ahead and streamed to the file
+        default_path = os.path.join(self.output_directory(), "montage.mp4")
+        movie_path, _ = QFileDialog.getSaveFileName(self, 'Save Movie', default_path, 'Movies (*.mp4 *.gif *.tif)')
+        if movie_path:
+            self.save_movie(movie_path)
+
+    def save_movie(self, movie_path):
+        profiler = self.diagnostics.new_profiler( f"movie {os.path.basename(str(movie_path))}" )
+        try:
+            with activate(profiler):
+                try:
+                    n_frames = self.write_movie_file(movie_path)
+                except (ValueError, ImportError) as error:
+                    show_info( f"Can't save the movie: {error}" )
+                    return
+            self.diagnostics.record(profiler)
+        finally:
+            self.diagnostics.discard(profiler)
+        show_info( f"{movie_path} saved ({n_frames} frames)!" )
+
+    def write_movie_file(self, movie_path):
+        # numpy engine only: the frames are rendered like the exported montages, at the export size
+        layers = image_layers(self.viewer)
+        if not layers:
+            raise ValueError("there are no image layers")
+        levels = [self.layer_level(layer, max_size=self.params.export_max_size) for layer in layers]
+        shapes = [layer.data[level].shape if layer.multiscale else layer.data.shape for layer, level in zip(layers, levels)]
+        if any(len(shape) < 3 for shape in shapes):
+            raise ValueError("every layer needs a time or z axis")
+        n_frames = min(shape[self.params.movie_axis % len(shape)] for shape in shapes)
+        luts = [layer.colormap.map(np.linspace(0, 1, 256)) for layer in layers]
+        contrast_limits = [self.layer_contrast_limits(layer, level, movie=True) for layer, level in zip(layers, levels)]
+        panels = default_panels(len(layers))
+        self.check_panels_count( len(panels) )
+
+        def render_frame(index):
+            images = [self.layer_frame(layer, index, level) for layer, level in zip(layers, levels)]
+            # each frame is rendered by a single thread, the workers render different frames
+            return render_downsampled( images, luts, contrast_limits,
+                                       rows = self.params.montage_rows,
+                                       cols = self.params.montage_columns,
+                                       spacing = self.params.montage_spacing,
+                                       panels = panels,
+                                       max_size = self.params.export_max_size,
+                                       workers = 1 )
+
+        # write_movie renders the first frame before creating the file, invalid settings leave no file
+        workers = min(self.params.thread_count, MAX_WORKERS)
+        return write_movie( movie_path, movie_frames(render_frame, n_frames, workers), fps=self.params.movie_fps )
+
+
+
+    def update_lazy_loading(self):
+        self.params.lazy_loading = self.lazy_loading.isChecked()
+
+    def update_remove_existing_layers(self):
+        self.params.remove_existing_layers = self.remove_existing_layers.isChecked()
+        self.reuse_layers.setEnabled(self.params.remove_existing_layers)
+
+    def update_reuse_layers(self):
+        self.params.reuse_layers = self.reuse_layers.isChecked()
+
+    def update_prefetch_neighbours(self):
+        self.params.prefetch_neighbours = self.prefetch_neighbours.isChecked()
+
+    def update_threads(self):
+        self.params.threads = self.threads.value()
+
+    def update_image_cache_size(self):
+        self.params.image_cache_mb = self.image_cache_size.value()
+        self.image_cache.max_bytes = self.params.image_cache_mb * 2**20
+
+    def save_profile(self):
+        profile_path, _ = QFileDialog.getSaveFileName(self, 'Save Profile', 'figure_profile.json', 'Profiles (*.json *.yaml *.yml)')
+        if profile_path:
+            self.params.save_profile(profile_path)
+            show_info( str(profile_path)+" saved!" )
+
+    def load_profile(self):
+        profile_path, _ = QFileDialog.getOpenFileName(self, 'Load Profile', '', 'Profiles (*.json *.yaml *.yml)')
+        if profile_path:
+            try:
+                self.params.load_profile(profile_path)
+            except (OSError, ValueError, TypeError) as error:
+                show_info( f"Invalid profile {profile_path}: {error}" )
+                return
+            self.update_widgets_from_params()
+
+    def update_widgets_from_params(self):
+        # after a profile is loaded, show its values in all the widgets
+        self.lazy_loading.setChecked(self.params.lazy_loading)
+        self.remove_existing_layers.setChecked(self.params.remove_existing_layers)
+        self.reuse_layers.setChecked(self.params.reuse_layers)
+        if self.params.channel_axis_value is not None:
+            self.file_selector.channel_axis_value.setValue(self.params.channel_axis_value)
+        self.visual_settings_selector.update_boxes_from_params()
+        self.montage_creator.update_values_from_params()
+        self.live_preview.setChecked(self.params.montage_live_preview)
 
     def load_selected_file(self):
-        # Remove existing layers
-        if self.remove_existing_layers.isChecked():
-            self.viewer.layers.clear()
-
-        # Load the selected file in the current napari viewer
+        # Load the selected file in the current napari viewer, reading happens in a worker
         if self.params.selected_file and self.params.selected_directory:
             path = os.path.join(self.params.selected_directory, self.params.selected_file)
-                        
-            image_basename = os.path.basename(self.params.selected_file)         
-
-            image =  io.imread(path)
-            
-            #TODO check channel axis value, if it's too big pop up a warning
-            ch_axis = self.params.channel_axis_value
-
-            # Get the channel names
-            names = self.params.channels_names.split(",")    
-            while (  len( names) < image.shape[ch_axis] ): names.append("null")    
-            layer_names = np.char.add( [image_basename+"_"]*len(names) , names)
-
-            colormaps = self.params.channels_LUTs.split(",")
-            while (  len( colormaps) < image.shape[ch_axis]  & len( colormaps) <10  ): colormaps.append("gray")
-            
-            for idx in range(len(colormaps)):
-                if colormaps[idx] == "biop_amber":
-                    colormaps[idx] =  ( "biop_amber", vispy.color.Colormap([[0.0, 0.0, 0.0], [1.0, 0.5, 0.0]]) )
-                elif colormaps[idx] == "biop_azure":
-                    colormaps[idx] =  ( "biop_azure", vispy.color.Colormap([[0.0, 0.0, 0.0], [0.0, 0.5, 1.0]]) ) 
-                elif colormaps[idx] == "biop_brightpink":
-                    colormaps[idx] = ("biop_brightpink", vispy.color.Colormap([[0.0, 0.0, 0.0], [1.0, 0.0, 0.5]]))
-                elif colormaps[idx] == "biop_chartreuse":
-                    colormaps[idx] = ("biop_chartreuse", vispy.color.Colormap([[0.0, 0.0, 0.0], [0.5, 1.0, 0.0]]))
-                elif colormaps[idx] == "biop_electricindigo":
-                    colormaps[idx] = ("biop_electricindigo", vispy.color.Colormap([[0.0, 0.0, 0.0], [0.5, 0.0, 1.0]]))
-                elif colormaps[idx] == "biop_springgreen":
-                    colormaps[idx] = ("biop_springgreen", vispy.color.Colormap([[0.0, 0.0, 0.0], [0, 1.0, 0.5]]))
-
-                #TODO continue with other colors
-
-            print( colormaps )
-
-            contrast_mins = [int(x) for x in self.params.channels_mins.split(",")]
-            contrast_maxs = [int(x) for x in self.params.channels_maxs.split(",")]
-            while (  len( contrast_mins) < image.shape[ch_axis] ): contrast_mins.append(0)
-            while (  len( contrast_maxs) < image.shape[ch_axis] ): contrast_maxs.append(255)
-            contrast_limits=[]
-            for x in range( 0 , len(contrast_mins) ): contrast_limits.append( [ contrast_mins[x] , contrast_maxs[x] ] )
-
-
-            self.viewer.add_image( image, 
-                                   channel_axis = ch_axis,
-                                   name = layer_names,
-                                   colormap = colormaps,
-                                   contrast_limits = contrast_limits
-                                   )
-            
-            show_info( str(path)+" done!" )
-
-
-
-
-class Params():
-    def __init__(self):
-        # File settings
-        self.selected_file = None
-        self.selected_directory = None
-        self.load_button_status = True
-        self.channel_axis_value = None
-        # Visual settings
-        self.channels_names = 'DAPI,A488,A555'
-        self.channels_LUTs = 'cyan,biop_amber,biop_pink'
-        self.channels_mins = '0,0,0'
-        self.channels_maxs = '255,255,255'
-        self.remove_existing_layers = True
-        # Montage settings
-        self.montage_rows = 2
-        self.montage_columns = 4
-        self.montage_spacing = 3
-
-
-class MontageSettingsSelector(QWidget , Params):
+            self.cancel_loading()
+
+            self.load_profiler = self.diagnostics.new_profiler( f"load {self.params.selected_file}" )
+            self.load_worker = read_image_layers(path,
+                                                 lazy = self.params.lazy_loading,
+                                                 channel_axis = self.params.channel_axis_value,
+                                                 layer_settings = self.layer_settings,
+                                                 auto_contrast = self.params.auto_contrast,
+                                                 percentiles = (self.params.auto_contrast_low, self.params.auto_contrast_high),
+                                                 profiler = self.load_profiler,
+                                                 cache = self.image_cache,
+                                                 workers = self.params.thread_count)
+            self.connect_load_worker(self.load_worker)
+
+            self.load_progress.setRange(0, 0) # busy until the first plane is read
+            self.cancel_button.setEnabled(True)
+            self.load_worker.start()
+
+    def connect_load_worker(self, worker):
+        # a cancelled worker may still deliver the signals it queued, only the current worker changes the state
+        def if_current(slot):
+            return lambda value: slot(value) if worker is self.load_worker else None
+        worker.yielded.connect(if_current(self.update_load_progress))
+        worker.returned.connect(if_current(self.add_image_layers))
+        worker.errored.connect(if_current(self.loading_failed))
+
+    def cancel_loading(self):
+        # Abort the in-flight read, if any. Its layers will never be added.
+        if self.load_worker is not None:
+            self.load_worker.quit()
+            self.load_worker = None
+        self.diagnostics.discard(self.load_profiler)
+        self.load_profiler = None
+        self.loading_finished()
+
+    def update_load_progress(self, progress):
+        done, total = progress
+        self.load_progress.setRange(0, total)
+        self.load_progress.setValue(done)
+
+    def loading_finished(self):
+        self.load_progress.setRange(0, 1)
+        self.load_progress.setValue(0)
+        self.cancel_button.setEnabled(False)
+
+    def loading_failed(self, error):
+        self.load_worker = None
+        self.diagnostics.discard(self.load_profiler)
+        self.load_profiler = None
+        self.loading_finished()
+        show_info( f"Loading failed: {error}" )
+
+    def add_image_layers(self, result):
+        path, layers_data = result
+        try:
+            with activate(self.load_profiler), stage('add layers'):
+                # Reuse or remove existing layers
+                reused = False
+                if self.remove_existing_layers.isChecked():
+                    reused = self.params.reuse_layers and self.swap_layers_data(path, layers_data)
+                    if not reused:
+                        self.viewer.layers.clear()
+                if not reused:
+                    for index, (data, kwargs, _) in enumerate(layers_data):
+                        layer = self.viewer.add_image( data, **kwargs )
+                        layer.metadata['channel'] = channel_label(path, kwargs['name'])
+                        layer.metadata['source'] = (path, self.params.channel_axis_value, index)
+                        layer.metadata['settings'] = channel_display(kwargs)
+        except Exception as error:
+            # the loading state is reset whatever napari raised, see loading_failed
+            self.loading_failed(error)
+            return
+        self.diagnostics.record(self.load_profiler)
+
+        self.load_worker = None
+        self.load_profiler = None
+        self.loading_finished()
+        show_info( str(path)+" done!" )
+
+    def swap_layers_data(self, path, layers_data):
+        # Put the channels in the layers of the same channel (by name, else in order), their vispy nodes and
+        # textures are kept, as are their colormaps and contrast limits, unless the channel settings (or the
+        # file ones) changed since the layer was loaded, or auto contrast is on.
+        # Returns False, and changes nothing, when the layers do not match the channels
+        layers = list(self.viewer.layers)
+        if len(layers) != len(layers_data) or not all(isinstance(layer, napari.layers.Image) for layer in layers):
+            return False
+        labels = [channel_label(path, kwargs['name']) for _, kwargs, _ in layers_data]
+        by_label = {layer.metadata.get('channel'): layer for layer in layers}
+        if set(labels) <= set(by_label) and len(set(labels)) == len(labels):
+            layers = [by_label[label] for label in labels]
+        multiscale = [kwargs.get('multiscale', False) for _, kwargs, _ in layers_data]
+        ndims = [np.ndim(data[0] if scales else data) for (data, _, _), scales in zip(layers_data, multiscale)]
+        if any(layer.multiscale != scales or layer.ndim != ndim for layer, scales, ndim in zip(layers, multiscale, ndims)):
+            return False
+
+        for index, (layer, (data, kwargs, _), label) in enumerate(zip(layers, layers_data, labels)):
+            layer.data = data
+            layer.name = kwargs['name']
+            layer.metadata['channel'] = label
+            layer.metadata['source'] = (path, self.params.channel_axis_value, index)
+            settings = channel_display(kwargs)
+            changed = settings != layer.metadata.get('settings')
+            layer.metadata['settings'] = settings
+            if changed:
+                # edited LUTs, mins and maxs (or a loaded profile) are applied, as when the layers are created
+                layer.colormap = kwargs['colormap']
+            if changed or self.params.auto_contrast != 'none':
+                low, high = kwargs['contrast_limits']
+                range_low, range_high = layer.contrast_limits_range
+                layer.contrast_limits_range = [min(low, range_low), max(high, range_high)]
+                layer.contrast_limits = [low, high]
+        return True
+
+    def layer_settings(self, image_basename, n_channels):
+        channels = self.params.channels_for(n_channels)
+        # colormaps are registered with napari by name, see colormaps.register_napari_colormaps
+        return dict( name = [image_basename+"_"+channel.name for channel in channels],
+                     colormap = [channel.colormap for channel in channels],
+                     contrast_limits = [channel.contrast_limits for channel in channels] )
+
+
+@thread_worker
+def read_image_layers(path, lazy, channel_axis, layer_settings, auto_contrast='none', percentiles=(0.1, 99.9),
+                      profiler=None, cache=None, workers=1):
+    # Read the image with `workers` threads, yielding progress, then split it into per-channel layer data.
+    # Images in the `cache` (an ImageCache) are not read again, whether loading lazily or not.
+    # The profiler is only activated between the yields: the generator may be closed from another context
+    read_stage = profiler.stage('read') if profiler is not None else nullcontext()
+    with read_stage:
+        with activate(profiler):
+            info = cache.probe(path) if cache is not None else probe_image(path)
+            image = cache.image(path) if cache is not None else None
+            # pyramids (OME-Zarr, pyramidal OME-TIFF) are added as multiscale layers when loading lazily
+            multiscale = image is None and lazy and info.n_levels > 1
+            if multiscale:
+                levels = load_multiscale(path, info.n_levels)
+                image = levels[0]
+        if not multiscale and image is None:
+            image = yield from iter_load_image(path, lazy=lazy, workers=workers)
+            if not lazy and cache is not None:
+                cache.put(path, image)
+
+    with activate(profiler):
+        #TODO check channel axis value, if it's too big pop up a warning
+        image_basename = os.path.basename(os.path.normpath(path))
+        kwargs = apply_channel_metadata( layer_settings(image_basename, image.shape[channel_axis]),
+                                         info.channels, image_basename )
+        if auto_contrast != 'none':
+            # histograms are cached per file, reloading it does not scan the data again
+            # (pyramids: the first level, from the coarsest, with enough pixels to sample)
+            source = image
+            if multiscale:
+                source = next( (level for level in reversed(levels) if level.size >= MAX_SAMPLES), image )
+            with stage('contrast'):
+                kwargs['contrast_limits'] = auto_contrast_limits(source, channel_axis, auto_contrast, percentiles, key=file_key(path))
+        with stage('split channels'):
+            if multiscale:
+                return path, split_channels(levels, channel_axis, multiscale=True, **kwargs)
+            return path, split_channels(image, channel_axis, **kwargs)
+
+
+def image_layers(viewer):
+    # the layers of the montage, other layers (labels, points, shapes...) have no colormap nor contrast limits
+    return [layer for layer in viewer.layers if isinstance(layer, napari.layers.Image)]
+
+
+def channel_label(path, layer_name):
+    # the channel part of a layer name, see FigureWidget.layer_settings
+    prefix = os.path.basename(os.path.normpath(path)) + "_"
+    return layer_name[len(prefix):] if layer_name.startswith(prefix) else layer_name
+
+
+def channel_display(kwargs):
+    # the colormap and contrast limits a channel is loaded with, to know when the settings change
+    return kwargs['colormap'], [float(value) for value in kwargs['contrast_limits']]
+
+
+def apply_channel_metadata(kwargs, channels, image_basename):
+    # the channel names, colors and contrast limits stored in the file (OMERO rendering settings, OME-XML)
+    # replace the ones of the settings
+    for idx, channel in enumerate(channels[:len(kwargs['name'])]):
+        if channel.name:
+            kwargs['name'][idx] = image_basename+"_"+channel.name
+        if channel.color is not None:
+            kwargs['colormap'][idx] = color_colormap(channel.color)
+        if channel.window is not None:
+            kwargs['contrast_limits'][idx] = list(channel.window)
+    return kwargs
+
+
+
+
+class DiagnosticsPanel(QWidget):
+    # Timings (and memory) of the loading and montage operations, see profiling.py
+    def __init__(self, params, max_profiles=200):
+        super().__init__()
+
+        self.params = params
+        self.profiles = []
+        self.max_profiles = max_profiles
+
+        self._layout = QVBoxLayout()
+        self.setLayout(self._layout)
+
+        self.record_timings = QCheckBox('Record timings')
+        self.record_timings.setChecked(self.params.record_timings)
+        self._layout.addWidget(self.record_timings)
+
+        self.trace_memory = QCheckBox('Trace memory (slower)')
+        self.trace_memory.setChecked(self.params.trace_memory)
+        self._layout.addWidget(self.trace_memory)
+
+        # one summary per operation, the last one at the bottom
+        self.log = QPlainTextEdit()
+        self.log.setReadOnly(True)
+        self.log.setMaximumBlockCount(2000)
+        self._layout.addWidget(self.log)
+
+        self.buttons_layout = QHBoxLayout()
+        self.clear_button = QPushButton('Clear')
+        self.save_button = QPushButton('Save JSON...')
+        self.buttons_layout.addWidget(self.clear_button)
+        self.buttons_layout.addWidget(self.save_button)
+        self._layout.addLayout(self.buttons_layout)
+
+        self.record_timings.stateChanged.connect(self.update_record_timings)
+        self.trace_memory.stateChanged.connect(self.update_trace_memory)
+        self.clear_button.clicked.connect(self.clear)
+        self.save_button.clicked.connect(self.save_log)
+
+    def update_record_timings(self):
+        self.params.record_timings = self.record_timings.isChecked()
+
+    def update_trace_memory(self):
+        self.params.trace_memory = self.trace_memory.isChecked()
+
+    def new_profiler(self, name):
+        # None when the timings are not recorded, the stages are then not measured at all
+        if not self.params.record_timings:
+            return None
+        return Profiler(name, trace_memory=self.params.trace_memory)
+
+    def record(self, profiler):
+        if profiler is None:
+            return
+        profiler.finish()
+        self.profiles.append(profiler.to_dict())
+        del self.profiles[:-self.max_profiles]
+        self.log.appendPlainText(profiler.summary())
+
+    def discard(self, profiler):
+        # an operation that failed or was cancelled is not recorded, but the memory tracing it started is stopped
+        if profiler is not None:
+            profiler.finish()
+
+    def clear(self):
+        self.profiles = []
+        self.log.clear()
+
+    def save_log(self):
+        log_path, _ = QFileDialog.getSaveFileName(self, 'Save Timings', 'figure_timings.json', 'JSON (*.json)')
+        if log_path:
+            self.save_profiles(log_path)
+
+    def save_profiles(self, log_path):
+        with open(log_path, 'w') as file:
+            json.dump(self.profiles, file, indent=2)
+
+
+
+
+class MontageSettingsSelector(QWidget):
     def __init__(self, napari_viewer, params):
         super().__init__()    
 
@@ -335,15 +1016,96 @@ class MontageSettingsSelector(QWidget , Params):
         self.montage_spacing_value = QSpinBox( minimum = 0, maximum = 10 , singleStep = 1, value = 3)
         self.montage_grid.addWidget(self.montage_spacing_label ,  2, 0)
         self.montage_grid.addWidget(self.montage_spacing_value,  2, 1)
-        
+
+        # add the rendering engine drop-down menu
+        self.montage_engine_label = QLabel('Engine')
+        self.montage_engine_value = QComboBox()
+        self.montage_engine_value.addItems(MONTAGE_ENGINES)
+        self.montage_engine_value.setCurrentText(self.params.montage_engine)
+        self.montage_grid.addWidget(self.montage_engine_label ,  3, 0)
+        self.montage_grid.addWidget(self.montage_engine_value,  3, 1)
+
+        # nD layers: slice at the dims position, or project the chosen axes (all leading axes when empty)
+        self.montage_projection_label = QLabel('Z/T planes')
+        self.montage_projection_value = QComboBox()
+        self.montage_projection_value.addItems(PROJECTION_METHODS)
+        self.montage_grid.addWidget(self.montage_projection_label ,  4, 0)
+        self.montage_grid.addWidget(self.montage_projection_value,  4, 1)
+
+        self.montage_projection_axes_label = QLabel('Projection axes')
+        self.montage_projection_axes_value = QLineEdit()
+        self.montage_projection_axes_value.setPlaceholderText('all but YX, e.g. 0 or 0,1')
+        self.montage_grid.addWidget(self.montage_projection_axes_label ,  5, 0)
+        self.montage_grid.addWidget(self.montage_projection_axes_value,  5, 1)
+
+        # longest side of the exported montage, panels are downsampled to fit (0: full resolution)
+        self.export_max_size_label = QLabel('Export size (px)')
+        self.export_max_size_value = QSpinBox( minimum = 0, maximum = 1000000 , singleStep = 1024, value = self.params.export_max_size)
+        self.export_max_size_value.setSpecialValueText('full resolution')
+        self.montage_grid.addWidget(self.export_max_size_label ,  6, 0)
+        self.montage_grid.addWidget(self.export_max_size_value,  6, 1)
+
+        # movies: one montage per index of a leading axis (time, z), see Save Movie...
+        self.movie_axis_label = QLabel('Movie axis')
+        self.movie_axis_value = QSpinBox( minimum = 0, maximum = 10 , singleStep = 1, value = self.params.movie_axis)
+        self.montage_grid.addWidget(self.movie_axis_label ,  7, 0)
+        self.montage_grid.addWidget(self.movie_axis_value,  7, 1)
+
+        self.movie_fps_label = QLabel('Frames per second')
+        self.movie_fps_value = QSpinBox( minimum = 1, maximum = 120 , singleStep = 1, value = self.params.movie_fps)
+        self.montage_grid.addWidget(self.movie_fps_label ,  8, 0)
+        self.montage_grid.addWidget(self.movie_fps_value,  8, 1)
+
+        # saved figures go to this folder (next to the images when empty)
+        self.output_directory_label = QLabel('Output folder')
+        self.output_directory_layout = QHBoxLayout()
+        self.output_directory_value = QLineEdit()
+        self.output_directory_value.setPlaceholderText('next to the images')
+        self.output_directory_button = QPushButton('...')
+        self.output_directory_layout.addWidget(self.output_directory_value)
+        self.output_directory_layout.addWidget(self.output_directory_button)
+        self.montage_grid.addWidget(self.output_directory_label ,  9, 0)
+        self.montage_grid.addLayout(self.output_directory_layout,  9, 1)
+
+        # montages already saved with the same files and settings are copied from this cache, see render_store.py
+        self.render_cache_size_label = QLabel('Render cache (MB)')
+        self.render_cache_size_value = QSpinBox( minimum = 0, maximum = 2**20 , singleStep = 256, value = self.params.render_cache_mb)
+        self.render_cache_size_value.setSpecialValueText('off')
+        self.montage_grid.addWidget(self.render_cache_size_label ,  10, 0)
+        self.montage_grid.addWidget(self.render_cache_size_value,  10, 1)
 
         
         # create connect when text is changed
         self.montage_rows_value.valueChanged.connect(self.update_montage_rows)
         self.montage_columns_value.valueChanged.connect(self.update_montage_columns)
         self.montage_spacing_value.valueChanged.connect(self.update_montage_spacing)
-
-
+        self.montage_engine_value.currentTextChanged.connect(self.update_montage_engine)
+        self.montage_projection_value.currentTextChanged.connect(self.update_montage_projection)
+        self.montage_projection_axes_value.editingFinished.connect(self.update_montage_projection_axes)
+        self.export_max_size_value.valueChanged.connect(self.update_export_max_size)
+        self.movie_axis_value.valueChanged.connect(self.update_movie_axis)
+        self.movie_fps_value.valueChanged.connect(self.update_movie_fps)
+        self.output_directory_value.editingFinished.connect(self.update_output_directory)
+        self.output_directory_button.clicked.connect(self.select_output_directory)
+        self.render_cache_size_value.valueChanged.connect(self.update_render_cache_size)
+
+        # show the values in use
+        self.update_values_from_params()
+
+
+
+    def update_values_from_params(self):
+        self.montage_rows_value.setValue(self.params.montage_rows)
+        self.montage_columns_value.setValue(self.params.montage_columns)
+        self.montage_spacing_value.setValue(self.params.montage_spacing)
+        self.montage_engine_value.setCurrentText(self.params.montage_engine)
+        self.montage_projection_value.setCurrentText(self.params.montage_projection)
+        self.montage_projection_axes_value.setText(",".join(str(axis) for axis in self.params.montage_projection_axes))
+        self.export_max_size_value.setValue(self.params.export_max_size)
+        self.movie_axis_value.setValue(self.params.movie_axis)
+        self.movie_fps_value.setValue(self.params.movie_fps)
+        self.output_directory_value.setText(self.params.output_directory or "")
+        self.render_cache_size_value.setValue(self.params.render_cache_mb)
 
     def update_montage_rows(self):
         self.params.montage_rows = self.montage_rows_value.value()
@@ -354,11 +1116,53 @@ class MontageSettingsSelector(QWidget , Params):
     def update_montage_spacing(self):
         self.params.montage_spacing = self.montage_spacing_value.value()
 
+    def update_montage_engine(self):
+        self.params.montage_engine = self.montage_engine_value.currentText()
+
+    def update_export_max_size(self):
+        self.params.export_max_size = self.export_max_size_value.value()
+
+    def update_movie_axis(self):
+        self.params.movie_axis = self.movie_axis_value.value()
+
+    def update_movie_fps(self):
+        self.params.movie_fps = self.movie_fps_value.value()
+
+    def update_output_directory(self):
+        self.params.output_directory = self.output_directory_value.text().strip() or None
+
+    def select_output_directory(self):
+        directory = QFileDialog.getExistingDirectory(self, 'Output folder', self.params.output_directory or "")
+        if directory:
+            self.output_directory_value.setText(directory)
+            self.update_output_directory()
 
+    def update_render_cache_size(self):
+        self.params.render_cache_mb = self.render_cache_size_value.value()
 
+    def update_montage_projection(self):
+        self.params.montage_projection = self.montage_projection_value.currentText()
 
+    def update_montage_projection_axes(self):
+        # invalid axes are shown in red and not applied
+        edit = self.montage_projection_axes_value
+        try:
+            axes = [int(axis) for axis in edit.text().split(",") if axis.strip()]
+            if any(axis < 0 for axis in axes):
+                raise ValueError("the projection axes can't be negative")
+        except ValueError as error:
+            edit.setStyleSheet( "color: red" )
+            edit.setToolTip( str(error) )
+        else:
+            self.params.montage_projection_axes = axes
+            edit.setStyleSheet( "" )
+            edit.setToolTip( "" )
 
-class SettingsSelector(QWidget , Params):
+
+
+
+
+class SettingsSelector(QWidget):
     def __init__(self, napari_viewer, params):
         super().__init__()
 
@@ -426,63 +1230,87 @@ class SettingsSelector(QWidget , Params):
         self._advanced_layout.addWidget( self.channels_maxs , 4,0)
         self._advanced_layout.addWidget( self.channels_maxs_edit , 4,1  )
 
+        # contrast limits from the histograms of the channels, instead of mins and maxs
+        self.auto_contrast = QLabel('Auto contrast')
+        self.auto_contrast_value = QComboBox()
+        self.auto_contrast_value.addItems(AUTO_CONTRAST_METHODS)
+        self.auto_contrast_value.setCurrentText(self.params.auto_contrast)
+        self._advanced_layout.addWidget( self.auto_contrast , 5,0)
+        self._advanced_layout.addWidget( self.auto_contrast_value , 5,1  )
+
         # create connect when text is changed
         self.channels_names_edit.textChanged.connect(self.update_channels_names)
         self.channels_LUTs_edit.textChanged.connect(self.update_channels_LUTs)
         self.channels_mins_edit.textChanged.connect(self.update_channels_mins)
         self.channels_maxs_edit.textChanged.connect(self.update_channels_maxs)
+        self.auto_contrast_value.currentTextChanged.connect(self.update_auto_contrast)
 
         # create connect to update the text boxes when button is clicked
         self.settings_from_viewer.clicked.connect(self.update_boxes_from_viewer)
 
-    def update_boxes_from_viewer(self, event):
-        colormaps = self.params.channels_LUTs.split(",")
-        contrast_mins = self.params.channels_mins.split(",")
-        contrast_maxs = self.params.channels_maxs.split(",")
-        
-        for layer in self.viewer.layers :
-            layer_index = self.viewer.layers.index(layer)
-            new_color_map = layer.colormap.name
-            colormaps[layer_index] = new_color_map
-
-            new_contrast_min = int( layer.contrast_limits[0] )
-            contrast_mins[layer_index] = str( new_contrast_min)
+    def update_boxes_from_viewer(self, event=None):
+        layers = image_layers(self.viewer)
+        n_channels = max( len(self.params.channels), len(layers) )
+        channels = self.params.channels_for( n_channels )
+
+        for layer_index, layer in enumerate(layers):
+            channel = replace( channels[layer_index],
+                               contrast_min = layer.contrast_limits[0],
+                               contrast_max = layer.contrast_limits[1] )
+            try:
+                channel = replace( channel, colormap = layer.colormap.name )
+            except ValueError:
+                # a colormap napari can't find by its name (e.g. unnamed), the channel keeps its own
+                pass
+            channels[layer_index] = channel
+
+        # then update the params and the text boxes
+        self.params.channels = channels
+        self.update_boxes_from_params()
+
+    def update_boxes_from_params(self):
+        self.channels_names_edit.setText( self.params.channels_names )
+        self.channels_LUTs_edit.setText( self.params.channels_LUTs )
+        self.channels_mins_edit.setText( self.params.channels_mins )
+        self.channels_maxs_edit.setText( self.params.channels_maxs )
+        self.auto_contrast_value.setCurrentText( self.params.auto_contrast )
 
-            new_contrast_max = int( layer.contrast_limits[1] )
-            contrast_maxs[layer_index] = str( new_contrast_max  )
-
-        
-        # then update the text box and the params
-        self.channels_LUTs_edit.setText( ",".join(colormaps) )
-        self.params.channels_LUTs = self.channels_LUTs_edit.text()
-
-        self.channels_mins_edit.setText( ",".join(contrast_mins) )
-        self.params.channels_mins = self.channels_mins_edit.text()
-        self.channels_maxs_edit.setText( ",".join(contrast_maxs) )
-        self.params.channels_maxs = self.channels_maxs_edit.text()
-
-        
     def update_channels_names(self):
-        self.params.channels_names = self.channels_names_edit.text()
-        
+        self.update_param( 'channels_names', self.channels_names_edit )
+
     def update_channels_LUTs(self):
-        self.params.channels_LUTs = self.channels_LUTs_edit.text()
-        
+        self.update_param( 'channels_LUTs', self.channels_LUTs_edit )
+
     def update_channels_mins(self):
-        self.params.channels_mins = self.channels_mins_edit.text()
+        self.update_param( 'channels_mins', self.channels_mins_edit )
 
     def update_channels_maxs(self):
-        self.params.channels_maxs = self.channels_maxs_edit.text()
+        self.update_param( 'channels_maxs', self.channels_maxs_edit )
 
+    def update_auto_contrast(self):
+        self.params.auto_contrast = self.auto_contrast_value.currentText()
 
+    def update_param(self, name, edit):
+        # the text is parsed once here, invalid values are shown in red and not applied
+        try:
+            setattr( self.params, name, edit.text() )
+        except ValueError as error:
+            edit.setStyleSheet( "color: red" )
+            edit.setToolTip( str(error) )
+        else:
+            edit.setStyleSheet( "" )
+            edit.setToolTip( "" )
 
 
-class FileSelector(QWidget , Params):
-    def __init__(self, napari_viewer, params):
+
+
+class FileSelector(QWidget):
+    def __init__(self, napari_viewer, params, image_cache=None):
         super().__init__()
         
         self.viewer = napari_viewer
         self.params = params
+        self.image_cache = image_cache
 
         # Create a VerticalBox layout for the widget
         self._layout = QVBoxLayout()
@@ -520,22 +1348,32 @@ class FileSelector(QWidget , Params):
         self.channel_grid.addWidget(self.shape_value,  0, 1)
 
         # Add a drop-down menu to select the axis of the channel
-        self.params.channel_axis_value = QSpinBox( minimum = 0, maximum = 5 , singleStep = 1, value = 0)
-        self.channel_grid.addWidget(self.params.channel_axis_value,  1, 1)
+        self.channel_axis_value = QSpinBox( minimum = 0, maximum = 5 , singleStep = 1, value = 0)
+        self.channel_grid.addWidget(self.channel_axis_value,  1, 1)
+        self.params.channel_axis_value = self.channel_axis_value.value()
 
-        # Create a QListWidget to display the files in the directory
+        # Create a QListWidget to display the files in the directory, with their thumbnail
         self.file_list = QListWidget()
+        # several files can be selected, for comparison figures
+        self.file_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.file_list.setIconSize(QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE).size())
         self._layout.addWidget(self.file_list)
+        # the items of the list by file name
+        self.file_items = {}
 
         # Connect signals to slots
         self.dir_button.clicked.connect(self.select_directory )
         self.file_list.itemSelectionChanged.connect( self.update_selected_file )
+        self.channel_axis_value.valueChanged.connect( self.update_channel_axis )
 
         # Initialize the selected directory and file
         self.selected_directory = params.selected_directory
         self.selected_file = params.selected_file
         self.selected_channel_axis = params.channel_axis_value
         self.shape_value.setText('') 
+        self.probe_worker = None
+        self.index_worker = None
+        self.prefetch_worker = None
 
 
     def select_directory(self):
@@ -548,27 +1386,97 @@ class FileSelector(QWidget , Params):
             self.update_file_list()
 
     def update_file_list(self):
-        # Clear the file list and update it with the files in the selected directory
+        # Show the files of the selected directory as last indexed, then refresh the index
+        # (only new or modified files are read) in a worker
+        if self.index_worker is not None:
+            self.index_worker.quit()
+            self.index_worker = None
         self.file_list.clear()
+        self.file_items = {}
         if self.params.selected_directory:
-            files = os.listdir(self.params.selected_directory)
-            for file in files:
-                if file.endswith('.tif') or file.endswith('.tiff'):
-                    self.file_list.addItem(file)
+            index = DirectoryIndex(self.params.selected_directory)
+            # the list is drawn once, when all the indexed files are in
+            self.file_list.setUpdatesEnabled(False)
+            try:
+                for entry in index.entries():
+                    self.update_file_item(entry)
+            finally:
+                self.file_list.setUpdatesEnabled(True)
+            worker = self.index_worker = thread_worker(index.scan)()
+            # a quit worker may still deliver the files it queued, only the current worker changes the list
+            worker.yielded.connect(lambda progress: self.index_progress(progress) if worker is self.index_worker else None)
+            worker.returned.connect(lambda entries: self.index_finished(entries) if worker is self.index_worker else None)
+            worker.start()
             self.params.load_button_status = True
 
+    def index_progress(self, progress):
+        done, total, entry = progress
+        self.update_file_item(entry)
+
+    def index_finished(self, entries):
+        # drop the files that were removed since the last scan
+        names = {entry.name for entry in entries}
+        for row in reversed(range(self.file_list.count())):
+            name = self.file_list.item(row).data(Qt.UserRole)
+            if name not in names:
+                self.file_list.takeItem(row)
+                self.file_items.pop(name, None)
+        self.index_worker = None
+
+    def update_file_item(self, entry):
+        # the file name is kept in the item data, the text also shows the indexed metadata
+        item = self.file_items.get(entry.name)
+        if item is None:
+            item = QListWidgetItem(entry.name)
+            item.setData(Qt.UserRole, entry.name)
+            self.file_list.addItem(item)
+            self.file_items[entry.name] = item
+        item.setText(f'{entry.name}\n{entry.summary()}')
+        if entry.thumbnail is not None:
+            thumbnail = np.ascontiguousarray(entry.thumbnail)
+            height, width = thumbnail.shape[:2]
+            qimage = QImage(thumbnail.data, width, height, thumbnail.strides[0], QImage.Format_RGB888).copy()
+            item.setIcon(QIcon(QPixmap.fromImage(qimage)))
+
     def update_selected_file(self):
         # Update the selected file when the item selection changes
         items = self.file_list.selectedItems()
         if items:
-            self.params.selected_file = items[0].text()
+            self.params.selected_file = items[0].data(Qt.UserRole)
 
-            # read shape of selected file
+            # read shape of selected file, from its metadata only, in a worker
             path = os.path.join( self.params.selected_directory, self.params.selected_file )
-            image = imread(path)
-            self.update_shape_value( image.shape )
+            if self.probe_worker is not None:
+                self.probe_worker.quit()
+            probe = self.image_cache.probe if self.image_cache is not None else probe_image
+            self.probe_worker = thread_worker(probe)(path)
+            self.probe_worker.returned.connect(self.update_shape_value)
+            self.probe_worker.start()
             self.params.load_button_status = True
-
-    def update_shape_value(self, shape):
+            self.prefetch_neighbour_files()
+
+    def prefetch_neighbour_files(self):
+        # Decode the next and previous files of the list in the background, see image_cache.prefetch
+        if self.prefetch_worker is not None:
+            self.prefetch_worker.quit()
+            self.prefetch_worker = None
+        if self.image_cache is None or not self.params.prefetch_neighbours or not self.image_cache.max_bytes:
+            return
+        row = self.file_list.currentRow()
+        rows = [idx for idx in (row + 1, row - 1) if 0 <= idx < self.file_list.count()]
+        paths = [os.path.join(self.params.selected_directory, self.file_list.item(idx).data(Qt.UserRole)) for idx in rows]
+        if paths:
+            self.prefetch_worker = thread_worker(prefetch)(self.image_cache, paths)
+            self.prefetch_worker.start()
+
+    def update_shape_value(self, info):
         # Update the shape label text
-        self.shape_value.setText(f'{shape}')   
\ No newline at end of file
+        levels = f', {info.n_levels} levels' if info.n_levels > 1 else ''
+        self.shape_value.setText(f'{info.shape} {info.dtype} ({info.axes}{levels})')
+        # and use the guessed channel axis as new default
+        self.channel_axis_value.setMaximum( max( len(info.shape) - 1 , 0 ) )
+        if info.channel_axis is not None:
+            self.channel_axis_value.setValue( info.channel_axis )
+
+    def update_channel_axis(self):
+        self.params.channel_axis_value = self.channel_axis_value.value()
@@ -0,0 +1,192 @@
+"""
+Persistent index of the images of a directory, for the file browser.
+
+For each TIFF file (or OME-Zarr directory) the index keeps its shape, dtype, axes, number of channels,
+size and modification time, and a small multichannel thumbnail. It is stored
+in a SQLite database per directory, in the local cache directory, and is
+refreshed incrementally: only new or modified files are read again.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .image_io import TIFF_SUFFIXES, ZARR_SUFFIX
+
+
+THUMBNAIL_SIZE = 64
+# thumbnails do not depend on the settings, channels are colored in this order
+THUMBNAIL_COLORMAPS = ['biop_azure', 'biop_amber', 'biop_brightpink',
+                       'biop_chartreuse', 'biop_electricindigo', 'biop_springgreen']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    shape TEXT,
+    dtype TEXT,
+    axes TEXT,
+    channel_axis INTEGER,
+    thumbnail BLOB,
+    thumbnail_shape TEXT,
+    error TEXT
+)
+"""
+
+
+def cache_directory():
+    """Local cache directory of the plugin, can be set with NAPARI_FIGURE_CACHE_DIR."""
+    directory = os.environ.get('NAPARI_FIGURE_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'napari-figure')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+@dataclass
+class IndexEntry:
+    name: str
+    size: int
+    mtime_ns: int
+    shape: Tuple[int, ...] = ()
+    dtype: str = ''
+    axes: str = ''
+    channel_axis: Optional[int] = None
+    thumbnail: Optional[np.ndarray] = None
+    error: Optional[str] = None
+
+    @property
+    def n_channels(self):
+        if self.channel_axis is None or not self.shape:
+            return 1
+        return self.shape[self.channel_axis]
+
+    def summary(self):
+        if self.error:
+            return f"unreadable: {self.error}"
+        return f"{self.shape} {self.dtype}, {self.n_channels} ch"
+
+
+class DirectoryIndex:
+    def __init__(self, directory, cache_dir=None):
+        self.directory = os.path.abspath(directory)
+        digest = hashlib.sha1(self.directory.encode()).hexdigest()[:16]
+        self.db_path = os.path.join(cache_dir or cache_directory(), f"index_{digest}.sqlite")
+        with closing(self._connect()) as db, db:
+            db.execute(SCHEMA)
+
+    def _connect(self):
+        # one connection per call, so that the index can be scanned in a worker thread
+        return sqlite3.connect(self.db_path)
+
+    def entries(self):
+        """The indexed files, sorted by name, as last scanned (nothing is read from the directory)."""
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT * FROM files ORDER BY name").fetchall()
+        return [_entry_from_row(row) for row in rows]
+
+    def scan(self):
+        """Refresh the index, yielding `(done, total, entry)` for each new or modified file.
+
+        Files are listed with `os.scandir`; a file is only read again when its
+        size or modification time changed. Removed files are dropped from the
+        index. Returns the up-to-date entries.
+        """
+        with os.scandir(self.directory) as it:
+            files = {item.name: item.stat() for item in it if _is_indexed(item)}
+
+        with closing(self._connect()) as db:
+            known = {name: (size, mtime_ns) for name, size, mtime_ns
+                     in db.execute("SELECT name, size, mtime_ns FROM files")}
+            removed = [(name,) for name in known if name not in files]
+            with db:
+                db.executemany("DELETE FROM files WHERE name = ?", removed)
+
+        outdated = sorted(name for name, stat in files.items()
+                          if known.get(name) != (stat.st_size, stat.st_mtime_ns))
+        for done, name in enumerate(outdated, start=1):
+            stat = files[name]
+            entry = index_file(os.path.join(self.directory, name), stat.st_size, stat.st_mtime_ns)
+            with closing(self._connect()) as db, db:
+                db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", _row_from_entry(entry))
+            yield done, len(outdated), entry
+
+        return self.entries()
+
+    def refresh(self):
+        """Blocking version of `scan`."""
+        scan = self.scan()
+        while True:
+            try:
+                next(scan)
+            except StopIteration as stop:
+                return stop.value
+
+
+def index_file(path, size, mtime_ns):
+    from .image_io import probe_image
+
+    entry = IndexEntry(os.path.basename(path), size, mtime_ns)
+    try:
+        info = probe_image(path)
+        entry.shape, entry.dtype, entry.axes, entry.channel_axis = info.shape, info.dtype, info.axes, info.channel_axis
+        entry.thumbnail = make_thumbnail(path, info.channel_axis, level_shapes=info.level_shapes)
+    except Exception as error:
+        entry.error = f"{type(error).__name__}: {error}"
+    return entry
+
+
+def _is_indexed(item):
+    # OME-Zarr images are directories, their modification time only changes when their top-level entries do
+    name = item.name.lower()
+    if name.endswith(ZARR_SUFFIX):
+        return item.is_dir()
+    return item.is_file() and name.endswith(TIFF_SUFFIXES)
+
+
+def make_thumbnail(path, channel_axis, size=THUMBNAIL_SIZE, level_shapes=()):
+    """A (h, w, 3) uint8 composite of the channels, at most `size` pixels wide/high.
+
+    Only one plane (the middle one of nD stacks) of each channel is read, with
+    a stride, and each channel is stretched to its min/max. Pyramids are read
+    at their smallest level still larger than the thumbnail.
+    """
+    from .colormaps import get_lut
+    from .contrast import auto_contrast_limits
+    from .image_io import channel_views, load_image, select_level
+    from .montage import apply_lut, blend_additive
+
+    level = 0
+    if level_shapes:
+        level, _ = select_level(level_shapes, max(level_shapes[0][-2:]) / size)
+    image = load_image(path, lazy=True, level=level)
+    planes = []
+    for channel in channel_views(image, channel_axis):
+        if channel.ndim < 2:
+            raise ValueError(f"can't make a thumbnail of a {channel.ndim}D channel")
+        middle = tuple(length // 2 for length in channel.shape[:-2])
+        height, width = channel.shape[-2:]
+        step = max(1, int(np.ceil(max(height, width) / size)))
+        planes.append(np.asarray(channel[middle + (slice(None, None, step), slice(None, None, step))]))
+
+    rgbs = [apply_lut(plane, get_lut(THUMBNAIL_COLORMAPS[idx % len(THUMBNAIL_COLORMAPS)]), limits)
+            for idx, (plane, limits) in enumerate(zip(planes, auto_contrast_limits(np.stack(planes), 0, 'minmax')))]
+    return blend_additive(rgbs, np.empty(rgbs[0].shape, np.uint8))
+
+
+def _row_from_entry(entry):
+    thumbnail = None if entry.thumbnail is None else np.ascontiguousarray(entry.thumbnail).tobytes()
+    thumbnail_shape = None if entry.thumbnail is None else json.dumps(entry.thumbnail.shape)
+    return (entry.name, entry.size, entry.mtime_ns, json.dumps(entry.shape), entry.dtype, entry.axes,
+            entry.channel_axis, thumbnail, thumbnail_shape, entry.error)
+
+
+def _entry_from_row(row):
+    name, size, mtime_ns, shape, dtype, axes, channel_axis, thumbnail, thumbnail_shape, error = row
+    if thumbnail is not None:
+        thumbnail = np.frombuffer(thumbnail, np.uint8).reshape(json.loads(thumbnail_shape))
+    return IndexEntry(name, size, mtime_ns, tuple(json.loads(shape)), dtype, axes, channel_axis, thumbnail, error)
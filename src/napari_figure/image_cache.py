@@ -0,0 +1,132 @@
+"""
+Memory-bounded cache of decoded images, with prefetching of neighbour files.
+
+The widget keeps one `ImageCache`, shared by the shape probe, the loader and
+the comparison figures. Decoded images are kept up to a byte budget and the
+least recently used ones are evicted first. While a file is viewed, its
+neighbours in the file list are decoded in the background (`prefetch`), so
+that stepping to them, or back, reads nothing from disk.
+
+Entries are keyed by `contrast.file_key`: a file modified on disk is a new
+entry, its outdated image is evicted in time.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .contrast import file_key
+from .image_io import load_image, probe_image
+
+
+CACHE_BYTES = 1024 * 2 ** 20
+# number of probed metadata kept, they are small
+INFO_CACHE_SIZE = 1024
+# files larger than this fraction of the budget are not prefetched, they would evict everything else
+PREFETCH_FRACTION = 4
+
+
+class ImageCache:
+    """LRU cache of decoded images bounded in bytes, and of their `ImageInfo`.
+
+    Thread-safe, images are put by the loading and prefetching workers.
+    """
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self._max_bytes = max_bytes
+        self.n_bytes = 0
+        self._images = OrderedDict()
+        self._infos = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def probe(self, path):
+        """`probe_image`, cached."""
+        key = file_key(path)
+        with self._lock:
+            if key in self._infos:
+                self._infos.move_to_end(key)
+                return self._infos[key]
+        info = probe_image(path)
+        with self._lock:
+            self._infos[key] = info
+            while len(self._infos) > INFO_CACHE_SIZE:
+                self._infos.popitem(last=False)
+        return info
+
+    def image(self, path):
+        """The decoded image of `path`, or None when it is not cached."""
+        key = file_key(path)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, path, image):
+        """Keep a decoded (numpy) image of `path`, unless it is larger than the budget."""
+        image = np.asarray(image)
+        key = file_key(path)
+        with self._lock:
+            if key in self._images:
+                self.n_bytes -= self._images.pop(key).nbytes
+            if image.nbytes > self._max_bytes:
+                return
+            self._images[key] = image
+            self.n_bytes += image.nbytes
+            self._evict()
+
+    def load(self, path, workers=None):
+        """The decoded image of `path`, read (and cached) when it is not cached."""
+        image = self.image(path)
+        if image is None:
+            image = load_image(path, lazy=False, workers=workers)
+            self.put(path, image)
+        return image
+
+    def _evict(self):
+        while self.n_bytes > self._max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self.n_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._infos.clear()
+            self.n_bytes = 0
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, path):
+        return self.image(path) is not None
+
+
+def prefetchable(cache, info):
+    """Whether an image of `info` is worth decoding ahead: single level, and a small part of the budget."""
+    n_bytes = int(np.prod(info.shape, dtype=np.int64)) * np.dtype(info.dtype).itemsize
+    return info.n_levels == 1 and n_bytes <= cache.max_bytes // PREFETCH_FRACTION
+
+
+def prefetch(cache, paths):
+    """Decode `paths` into `cache`, in order, yielding each path once it is cached (to run in a worker).
+
+    Files already cached, unreadable or too large (see `prefetchable`) are skipped.
+    """
+    for path in paths:
+        try:
+            if path in cache or not prefetchable(cache, cache.probe(path)):
+                continue
+            cache.load(path)
+        except Exception:
+            # the error is reported if the file is loaded
+            continue
+        yield path
@@ -0,0 +1,288 @@
+"""
+Helpers to read images, and their metadata, from disk.
+
+TIFF files (including pyramidal OME-TIFFs) are read with tifffile, OME-Zarr
+directories with zarr: their NGFF metadata (`multiscales` and `omero`
+attributes) is parsed here, ome-zarr-py is not needed.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+# tifffile, dask and zarr are imported on first use, to keep the plugin startup fast
+
+
+# Axes that are never considered as a channel axis
+SPATIAL_AXES = 'YX'
+
+TIFF_SUFFIXES = ('.tif', '.tiff')
+ZARR_SUFFIX = '.zarr'
+
+
+@dataclass
+class ChannelMetadata:
+    """Display settings of a channel stored in the file (OMERO rendering settings, OME-XML)."""
+    name: Optional[str] = None
+    # RGB in [0, 1]
+    color: Optional[Tuple[float, float, float]] = None
+    # contrast limits
+    window: Optional[Tuple[float, float]] = None
+
+
+@dataclass
+class ImageInfo:
+    """Metadata of an image file, read without decoding any pixel."""
+    shape: Tuple[int, ...]
+    dtype: str
+    axes: str
+    channel_axis: Optional[int] = None
+    # shapes of the pyramid levels, full resolution first (empty when there is a single level)
+    level_shapes: Tuple[Tuple[int, ...], ...] = ()
+    channels: Tuple[ChannelMetadata, ...] = ()
+
+    @property
+    def n_channels(self):
+        if self.channel_axis is None:
+            return 1
+        return self.shape[self.channel_axis]
+
+    @property
+    def n_levels(self):
+        return max(1, len(self.level_shapes))
+
+
+def is_image_file(path):
+    """TIFF files and OME-Zarr directories (by name, nothing is read)."""
+    name = os.path.basename(os.path.normpath(path)).lower()
+    if name.endswith(ZARR_SUFFIX):
+        return os.path.isdir(path)
+    return name.endswith(TIFF_SUFFIXES) and os.path.isfile(path)
+
+
+def is_zarr(path):
+    return os.path.basename(os.path.normpath(path)).lower().endswith(ZARR_SUFFIX)
+
+
+def probe_image(path):
+    """Read shape, dtype and axes of the first series of a TIFF file, or of an OME-Zarr image.
+
+    Only the TIFF IFDs (and the OME-XML / ImageJ metadata, when present) or
+    the zarr metadata are parsed, so this is cheap even for multi-GB stacks.
+    """
+    if is_zarr(path):
+        return _probe_zarr(path)
+
+    from tifffile import TiffFile # https://pypi.org/project/tifffile/#examples
+
+    with TiffFile(path) as tif:
+        series = tif.series[0]
+        shape = tuple(series.shape)
+        dtype = str(series.dtype)
+        axes = series.axes
+        level_shapes = tuple(tuple(level.shape) for level in series.levels) if len(series.levels) > 1 else ()
+        channels = _ome_xml_channels(tif.ome_metadata) if tif.is_ome else ()
+    return ImageInfo(shape=shape,
+                     dtype=dtype,
+                     axes=axes,
+                     channel_axis=guess_channel_axis(shape, axes),
+                     level_shapes=level_shapes,
+                     channels=channels)
+
+
+def _ome_xml_channels(ome_metadata):
+    from tifffile import xml2dict
+
+    try:
+        image = xml2dict(ome_metadata)['OME']['Image']
+        pixels = (image[0] if isinstance(image, list) else image)['Pixels']
+    except (KeyError, TypeError, IndexError, ValueError):
+        return ()
+    channels = pixels.get('Channel') or []
+    if isinstance(channels, dict):
+        channels = [channels]
+    result = []
+    for channel in channels:
+        color = channel.get('Color')
+        if color is not None:
+            # signed 32 bits RGBA
+            color = int(color) & 0xFFFFFFFF
+            color = tuple(((color >> shift) & 0xFF) / 255 for shift in (24, 16, 8))
+        result.append(ChannelMetadata(name=channel.get('Name'), color=color))
+    return tuple(result)
+
+
+def _zarr_multiscales(path):
+    # the image group, its first multiscales and the omero settings (NGFF 0.5 nests them under 'ome')
+    import zarr
+
+    group = zarr.open_group(path, mode='r')
+    attributes = dict(group.attrs)
+    attributes = attributes.get('ome', attributes)
+    if 'multiscales' not in attributes:
+        raise ValueError(f"{path} is not an OME-Zarr image (no multiscales metadata)")
+    return group, attributes['multiscales'][0], attributes.get('omero') or {}
+
+
+def _probe_zarr(path):
+    group, multiscales, omero = _zarr_multiscales(path)
+    levels = [group[dataset['path']] for dataset in multiscales['datasets']]
+    shape = tuple(levels[0].shape)
+    # NGFF >= 0.4 axes are dicts, 0.3 axes are names, older versions are TCZYX
+    axes = multiscales.get('axes') or 'tczyx'[-len(shape):]
+    axes = ''.join((axis['name'] if isinstance(axis, dict) else axis)[0] for axis in axes).upper()
+
+    channels = []
+    for channel in omero.get('channels', []):
+        color = channel.get('color')
+        if color:
+            color = tuple(int(color[idx:idx + 2], 16) / 255 for idx in (0, 2, 4))
+        window = channel.get('window') or {}
+        window = (window['start'], window['end']) if 'start' in window and 'end' in window else None
+        channels.append(ChannelMetadata(name=channel.get('label'), color=color or None, window=window))
+
+    return ImageInfo(shape=shape,
+                     dtype=str(levels[0].dtype),
+                     axes=axes,
+                     channel_axis=guess_channel_axis(shape, axes),
+                     level_shapes=tuple(tuple(level.shape) for level in levels) if len(levels) > 1 else (),
+                     channels=tuple(channels))
+
+
+def guess_channel_axis(shape, axes):
+    """Guess which axis holds the channels.
+
+    Uses the axes order from the metadata when it has a channel ('C') or a
+    sample ('S') axis, otherwise falls back to the smallest non-spatial axis.
+    Returns None for a single plane.
+    """
+    for ax in 'CS':
+        if ax in axes:
+            return axes.index(ax)
+
+    candidates = [idx for idx, ax in enumerate(axes)
+                  if ax not in SPATIAL_AXES and shape[idx] > 1]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda idx: shape[idx])
+
+
+def load_image(path, lazy=True, level=0, workers=None):
+    """Load the first series of a TIFF file, or an OME-Zarr image, at a pyramid `level`.
+
+    With `lazy`, no pixel is read here: uncompressed files are memory-mapped
+    and compressed (or tiled) ones are wrapped in a dask array backed by the
+    tifffile zarr store, with one chunk per plane. OME-Zarr levels are dask
+    arrays with the chunks of the zarr arrays. napari then only reads the
+    planes it displays.
+
+    `workers` is the number of threads tifffile decodes the pages (or the
+    tiles of a plane) with, None lets tifffile choose.
+    """
+    if is_zarr(path):
+        import dask.array as da
+
+        group, multiscales, _ = _zarr_multiscales(path)
+        array = da.from_zarr(group[multiscales['datasets'][level]['path']])
+        return array if lazy else array.compute()
+
+    from tifffile import TiffFile, imread, memmap
+
+    if not lazy:
+        return imread(path, level=level, maxworkers=workers)
+
+    with TiffFile(path) as tif:
+        series = tif.series[0]
+        # dataoffset is only set when the series (level 0) is uncompressed and contiguous
+        memmappable = level == 0 and series.dataoffset is not None
+        # first axis of a plane, samples of RGB images stay in the plane
+        plane_axis = series.axes.index('Y') if 'Y' in series.axes else len(series.shape) - 2
+
+    if memmappable:
+        return memmap(path, mode='r')
+
+    import dask.array as da
+    import zarr
+
+    store = imread(path, aszarr=True, level=level, maxworkers=workers)
+    array = zarr.open(store, mode='r')
+    plane_chunks = (1,) * plane_axis + tuple(array.shape[plane_axis:])
+    return da.from_zarr(array, chunks=plane_chunks)
+
+
+def load_multiscale(path, n_levels=None):
+    """Every pyramid level of an image, full resolution first, as lazy arrays (see `load_image`)."""
+    if n_levels is None:
+        n_levels = probe_image(path).n_levels
+    return [load_image(path, lazy=True, level=level) for level in range(n_levels)]
+
+
+def level_downsampling(level_shapes, level):
+    """How much smaller than the full resolution the planes of a pyramid `level` are."""
+    return level_shapes[0][-1] / level_shapes[level][-1]
+
+
+def select_level(level_shapes, factor):
+    """The coarsest pyramid level still at least as fine as a downsampling by `factor`.
+
+    Returns the level and the (integer) factor left to downsample its planes by.
+    """
+    level = 0
+    for idx in range(1, len(level_shapes)):
+        # levels are listed from the finest to the coarsest
+        if level_downsampling(level_shapes, idx) <= factor * 1.001:
+            level = idx
+    return level, max(1, int(factor / level_downsampling(level_shapes, level) + 1e-3))
+
+
+def iter_load_image(path, lazy=True, level=0, workers=1):
+    """Generator version of `load_image`, to be run in a worker.
+
+    When the image is fully read, planes are copied along the first axis by
+    `workers` threads (decoding releases the GIL) and `(done, total)` is
+    yielded after each of them, so that callers can report progress or abort
+    between planes. The image is the return value.
+    """
+    # with several workers the planes are decoded in parallel, the tiles of each plane are not
+    image = load_image(path, lazy=True, level=level, workers=1 if workers and workers > 1 else None)
+    if lazy:
+        return image
+    if image.ndim < 3:
+        return np.asarray(image)
+
+    data = np.empty(image.shape, image.dtype)
+    total = image.shape[0]
+
+    def copy_plane(idx):
+        data[idx] = image[idx]
+
+    if not workers or workers <= 1:
+        for idx in range(total):
+            copy_plane(idx)
+            yield idx + 1, total
+        return data
+
+    executor = ThreadPoolExecutor(max_workers=min(workers, total))
+    futures = [executor.submit(copy_plane, idx) for idx in range(total)]
+    try:
+        # planes are decoded in parallel, and reported in order
+        for done, future in enumerate(futures, start=1):
+            future.result()
+            yield done, total
+    finally:
+        # an abort drops the planes not started yet (and does not wait for the others, it may run
+        # when the generator is garbage collected)
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+    return data
+
+
+def channel_views(image, channel_axis):
+    """Views of every channel of `image` (lazy arrays stay lazy)."""
+    if channel_axis is None:
+        return [image]
+    index = (slice(None),) * channel_axis
+    return [image[index + (idx,)] for idx in range(image.shape[channel_axis])]
@@ -0,0 +1,240 @@
+"""
+Rendering of montages into in-memory RGB(A) buffers.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .profiling import stage
+
+
+# memory used by the colored channels and panels of a RenderCache
+CACHE_BYTES = 512 * 2 ** 20
+
+
+def figure_to_array(fig, dpi=100, close=True):
+    """Rasterise a matplotlib figure with Agg and return it as a (h, w, 4) uint8 array.
+
+    Nothing is encoded nor written to disk. The figure is closed afterwards
+    unless `close` is False.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import matplotlib.pyplot as plt
+
+    with stage('rasterize'):
+        fig.set_dpi(dpi)
+        canvas = FigureCanvasAgg(fig)
+        canvas.draw()
+        image = np.array(canvas.buffer_rgba())
+    if close:
+        plt.close(fig)
+    return image
+
+
+def lookup_table(lut, contrast_limits, dtype):
+    """Build a table mapping every value of an 8/16-bit integer `dtype` to a uint8 RGB color.
+
+    `lut` is a (N, 3) array in [0, 1] and values are linearly mapped to it
+    between `contrast_limits`. Returns the table and the offset to add to the
+    values before indexing it (for signed dtypes), or None for the dtypes
+    that are too large to be tabulated.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'ui' or dtype.itemsize > 2:
+        return None
+    info = np.iinfo(dtype)
+    values = np.arange(info.min, info.max + 1, dtype=np.float32)
+    return _map_values(values, lut, contrast_limits), -int(info.min)
+
+
+def _map_values(values, lut, contrast_limits):
+    low, high = contrast_limits
+    n_colors = len(lut)
+    scale = (n_colors - 1) / max(float(high) - float(low), np.finfo(np.float32).eps)
+    indices = np.clip((values - low) * scale, 0, n_colors - 1).astype(np.intp)
+    return (np.asarray(lut[:, :3]) * 255).round().astype(np.uint8)[indices]
+
+
+def apply_lut(image, lut, contrast_limits):
+    """Color a 2D image with `lut` within `contrast_limits`, as a (h, w, 3) uint8 array.
+
+    8/16-bit images go through a per-value lookup table, so that a single
+    fancy indexing does all the work; other dtypes are scaled as float32.
+    """
+    image = np.asarray(image)
+    if image.dtype == bool:
+        image = image.view(np.uint8)
+    table = lookup_table(lut, contrast_limits, image.dtype)
+    if table is not None:
+        table, offset = table
+        if offset:
+            return table[image.astype(np.int32) + offset]
+        return table[image]
+    return _map_values(image.astype(np.float32, copy=False), lut, contrast_limits)
+
+
+def parallel_map(function, items, workers=None):
+    """`[function(item) for item in items]`, in `workers` threads when there are more than one.
+
+    For numpy work that releases the GIL (lookup tables, reductions). The
+    stages of the profiler are not recorded in the threads, time the whole
+    call instead.
+    """
+    items = list(items)
+    if not workers or workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def blend_additive(rgbs, out):
+    """Additively blend uint8 RGB images into `out`, saturating at 255."""
+    if len(rgbs) == 1:
+        out[...] = rgbs[0]
+        return out
+    acc = np.zeros(out.shape, np.uint16)
+    for rgb in rgbs:
+        acc += rgb
+    np.minimum(acc, 255, out=acc)
+    out[...] = acc
+    return out
+
+
+def montage_shape(panel_shape, rows, cols, spacing):
+    height, width = panel_shape
+    return (rows * height + (rows - 1) * spacing,
+            cols * width + (cols - 1) * spacing,
+            3)
+
+
+class RenderCache:
+    """LRU cache of colored channels and merged panels, bounded in bytes.
+
+    Used by `render_montage` so that a change of one channel (LUT, contrast
+    limits) only colors that channel again and blends the panels showing it.
+    """
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    def put(self, key, value):
+        if key in self._items:
+            self.n_bytes -= self._items.pop(key).nbytes
+        if value.nbytes > self.max_bytes:
+            return
+        self._items[key] = value
+        self.n_bytes += value.nbytes
+        while self.n_bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.n_bytes -= evicted.nbytes
+
+    def clear(self):
+        self._items.clear()
+        self.n_bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+def lut_key(lut):
+    # LUTs are small (N x 4), hashing their values is cheap
+    lut = np.ascontiguousarray(lut)
+    return (lut.shape, hash(lut.tobytes()))
+
+
+def render_montage(images, luts, contrast_limits, rows, cols, spacing=0, panels=None, background=255,
+                   keys=None, cache=None, workers=None):
+    """Compose a montage of 2D channels into one preallocated (h, w, 3) uint8 array.
+
+    `images`, `luts` and `contrast_limits` are per channel. `panels` is the list
+    of channel indices shown in each panel, in row-major order; by default
+    the merge of the first three channels followed by every single channel.
+    Panels are separated by `spacing` pixels of `background`, panels beyond
+    rows x cols are dropped and missing ones stay black.
+
+    With a `cache` (`RenderCache`), `keys` identifies the pixels of each image
+    (e.g. layer, data version and slice): colored channels and merged panels
+    are reused as long as their image, LUT and contrast limits are the same.
+
+    The channels are colored by `workers` threads, see `parallel_map`.
+    """
+    if panels is None:
+        panels = default_panels(len(images))
+    panels = panels[:rows * cols]
+    panel_shape = np.shape(images[0])[-2:]
+    height, width = panel_shape
+    use_cache = cache is not None and keys is not None
+
+    def channel_key(channel):
+        return ('channel', keys[channel], tuple(panel_shape), lut_key(luts[channel]),
+                tuple(float(limit) for limit in contrast_limits[channel]))
+
+    def panel_key(channels):
+        return ('panel',) + tuple(channel_key(channel) for channel in channels)
+
+    # merged panels still in the cache
+    cached_panels = {}
+    if use_cache:
+        for idx, channels in enumerate(panels):
+            panel = cache.get(panel_key(channels)) if len(channels) > 1 else None
+            if panel is not None:
+                cached_panels[idx] = panel
+
+    # color each channel once (it may be used by several panels), the missing ones in parallel
+    rgbs = {}
+    needed = sorted({channel for idx, channels in enumerate(panels) if idx not in cached_panels for channel in channels})
+    if use_cache:
+        rgbs = {channel: cache.get(channel_key(channel)) for channel in needed}
+        rgbs = {channel: rgb for channel, rgb in rgbs.items() if rgb is not None}
+    missing = [channel for channel in needed if channel not in rgbs]
+    if missing:
+        with stage('colormap'):
+            colored = parallel_map(lambda channel: apply_lut(images[channel], luts[channel], contrast_limits[channel]),
+                                   missing, workers)
+        for channel, rgb in zip(missing, colored):
+            rgbs[channel] = rgb
+            if use_cache:
+                cache.put(channel_key(channel), rgb)
+
+    montage = np.full(montage_shape(panel_shape, rows, cols, spacing), background, np.uint8)
+    for idx, channels in enumerate(panels):
+        r, c = divmod(idx, cols)
+        y, x = r * (height + spacing), c * (width + spacing)
+        target = montage[y:y + height, x:x + width]
+        if idx in cached_panels:
+            target[...] = cached_panels[idx]
+            continue
+        blend_additive([rgbs[channel] for channel in channels], target)
+        if use_cache and len(channels) > 1:
+            cache.put(panel_key(channels), target.copy())
+
+    for idx in range(len(panels), rows * cols):
+        r, c = divmod(idx, cols)
+        y, x = r * (height + spacing), c * (width + spacing)
+        montage[y:y + height, x:x + width] = 0
+    return montage
+
+
+def default_panels(n_channels):
+    # the merge of (up to) the first three channels, then each channel
+    return [list(range(min(n_channels, 3)))] + [[idx] for idx in range(n_channels)]
+
+
+def save_image(path, image):
+    """Write an RGB(A) uint8 image, as TIFF with tifffile or with matplotlib for the other formats."""
+    path = str(path)
+    with stage('encode'):
+        if path.lower().endswith(('.tif', '.tiff')):
+            from tifffile import imwrite
+            imwrite(path, image, photometric='rgb')
+        else:
+            import matplotlib.pyplot as plt
+            plt.imsave(path, image)
@@ -0,0 +1,170 @@
+"""
+Movies of montages, one frame per timepoint or z-plane.
+
+Frames are rendered one at a time by a small pool of threads, a few frames
+ahead of the encoder, and streamed to it: memory use stays at a few frames
+whatever the length of the movie.
+
+    frames = movie_frames(render_frame, n_frames, workers=2)
+    write_movie("movie.mp4", frames, fps=10)
+
+Multi-page TIFFs are written with tifffile, GIFs with Pillow and MP4s with
+imageio and its ffmpeg plugin (`pip install imageio-ffmpeg`), imported when
+needed.
+"""
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .profiling import stage
+from .projection import project, projected_axes
+
+
+MOVIE_FORMATS = ['mp4', 'gif', 'tif']
+# frames rendered ahead of the encoder, per worker
+FRAMES_AHEAD = 2
+# threads rendering frames, the encoder can't keep up with more
+MAX_WORKERS = 4
+
+
+def _frame_axes(ndim, axis, axes, method):
+    # the projected axes of a frame, the movie axis is removed (and never projected)
+    axis = axis % ndim
+    frame_axes = [other - (other > axis) for other in projected_axes(ndim, axes, method) if other != axis]
+    return axis, tuple(frame_axes)
+
+
+def frame_plane(data, axis, index, method='slice', axes=None, position=None):
+    """The montage plane (see `projection.montage_plane`) of frame `index` along the movie `axis` of `data`.
+
+    The movie axis is sliced first, so that only one frame of the data is read
+    and projected, the projections are not cached. Other leading axes are
+    projected or sliced at `position` as in the montages.
+    """
+    ndim = np.ndim(data)
+    if ndim < 3:
+        raise ValueError(f"a {ndim}D image has no axis to make a movie along")
+    axis, frame_axes = _frame_axes(ndim, axis, axes, method)
+    if axis >= ndim - 2:
+        raise ValueError(f"the movie axis must be a leading axis of the {ndim}D image, got {axis}")
+    frame = data[(slice(None),) * axis + (index,)]
+    if frame_axes:
+        frame = project(frame, frame_axes, method)
+
+    plane_index = []
+    for other in range(ndim - 2):
+        if other == axis or (other - (other > axis)) in frame_axes:
+            continue
+        length = data.shape[other]
+        if position is None:
+            plane_index.append(length // 2)
+        else:
+            plane_index.append(int(np.clip(round(float(position[other])), 0, length - 1)))
+    return frame[tuple(plane_index)]
+
+
+def frame_projection_size(shape, axis, axes=None, method='sum'):
+    """Number of values summed into each pixel of a frame (see `projection.projection_size`)."""
+    axis, frame_axes = _frame_axes(len(shape), axis, axes, method)
+    frame_shape = shape[:axis] + shape[axis + 1:]
+    return int(np.prod([frame_shape[other] for other in frame_axes], dtype=np.int64))
+
+
+def movie_frames(render_frame, n_frames, workers=2):
+    """Yield `render_frame(index)` for every frame, in order.
+
+    Frames are rendered by `workers` threads, at most `FRAMES_AHEAD` per worker
+    ahead of the consumer. Closing the generator cancels the frames not
+    started yet.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    pending = deque()
+    indices = iter(range(n_frames))
+    try:
+        for index in itertools.islice(indices, FRAMES_AHEAD * max(1, workers)):
+            pending.append(executor.submit(render_frame, index))
+        while pending:
+            with stage('render'):
+                frame = pending.popleft().result()
+            for index in itertools.islice(indices, 1):
+                pending.append(executor.submit(render_frame, index))
+            yield frame
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def write_movie(path, frames, fps=10):
+    """Encode (h, w, 3) uint8 `frames` (any iterable) as MP4, GIF or multi-page TIFF, by the extension of `path`.
+
+    Frames are consumed one by one. Returns the number of frames written.
+    """
+    path = str(path)
+    extension = path.lower().rsplit('.', 1)[-1]
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        raise ValueError("a movie needs at least one frame")
+    counted = _Counter(itertools.chain([first], frames))
+
+    if extension in ('tif', 'tiff'):
+        _write_tiff(path, counted)
+    elif extension == 'gif':
+        _write_gif(path, counted, fps)
+    elif extension == 'mp4':
+        _write_mp4(path, counted, fps)
+    else:
+        raise ValueError(f"unknown movie format {extension!r}, expected one of {MOVIE_FORMATS}")
+    return counted.count
+
+
+class _Counter:
+    # counts the frames pulled by the encoders
+    def __init__(self, frames):
+        self.frames = frames
+        self.count = 0
+
+    def __iter__(self):
+        for frame in self.frames:
+            self.count += 1
+            yield frame
+
+
+def _write_tiff(path, frames):
+    from tifffile import TiffWriter
+
+    # one page per frame, appended as it comes (the total number of frames is not needed)
+    with TiffWriter(path, bigtiff=True) as tif:
+        for frame in frames:
+            with stage('encode'):
+                tif.write(frame, photometric='rgb', contiguous=True)
+
+
+def _write_gif(path, frames, fps):
+    from PIL import Image
+
+    # Pillow keeps the (palettized, 1 byte per pixel) frames until the file is written
+    frames = (Image.fromarray(frame) for frame in frames)
+    first = next(frames)
+    with stage('encode'):
+        first.save(path, save_all=True, append_images=frames, duration=int(round(1000 / fps)), loop=0)
+
+
+def _write_mp4(path, frames, fps):
+    try:
+        import imageio.v2 as imageio
+        import imageio_ffmpeg  # noqa: F401
+    except ImportError as error:
+        raise ImportError("MP4 export needs imageio and imageio-ffmpeg: pip install imageio-ffmpeg") from error
+
+    # yuv420p needs even sizes, frames are padded with black
+    with imageio.get_writer(path, fps=fps, codec='libx264', macro_block_size=1, pixelformat='yuv420p') as writer:
+        for frame in frames:
+            height, width = frame.shape[:2]
+            if height % 2 or width % 2:
+                frame = np.pad(frame, ((0, height % 2), (0, width % 2), (0, 0)))
+            with stage('encode'):
+                writer.append_data(frame)
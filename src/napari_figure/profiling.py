@@ -0,0 +1,138 @@
+"""
+Timing (and optionally memory) instrumentation of the figure operations.
+
+A `Profiler` records named stages. The code being profiled marks its stages
+with `stage(name)`, which records into the profiler activated in the current
+thread/context, and does nothing when there is none:
+
+    profiler = Profiler("montage")
+    with activate(profiler):
+        with stage("render"):
+            ...
+    print(profiler.summary())
+
+Nested stages are allowed, the time of a stage excludes its nested stages,
+so that the durations add up to the total. Stages with the same name (e.g.
+one per strip of an export) are accumulated.
+"""
+import contextvars
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+
+_active = contextvars.ContextVar('napari_figure_profiler', default=None)
+
+
+@dataclass
+class Stage:
+    name: str
+    seconds: float = 0.0
+    calls: int = 0
+    # largest increase of the traced memory during a call, when memory is traced
+    peak_memory_mb: Optional[float] = None
+
+
+class Profiler:
+    def __init__(self, name, trace_memory=False):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.started = time.time()
+        self.total = None
+        self.stages = {}
+        self._start = time.perf_counter()
+        self._stack = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        with self._lock:
+            # the enclosing stage is paused
+            if self._stack:
+                parent = self._stack[-1]
+                parent['seconds'] += now - parent['resumed']
+            frame = {'name': name, 'seconds': 0.0, 'resumed': now}
+            self._stack.append(frame)
+        memory_start = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            peak = None
+            if memory_start is not None:
+                peak = max(tracemalloc.get_traced_memory()[1] - memory_start, 0) / 2 ** 20
+            with self._lock:
+                self._stack.remove(frame)
+                if self._stack:
+                    self._stack[-1]['resumed'] = now
+                record = self.stages.setdefault(name, Stage(name))
+                record.seconds += frame['seconds'] + now - frame['resumed']
+                record.calls += 1
+                if peak is not None:
+                    record.peak_memory_mb = round(max(record.peak_memory_mb or 0.0, peak), 3)
+
+    def finish(self):
+        """Set the total time (once), and stop tracing the memory if this profiler started it."""
+        if self.total is None:
+            self.total = time.perf_counter() - self._start
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return self
+
+    def durations(self):
+        return {name: record.seconds for name, record in self.stages.items()}
+
+    def to_dict(self):
+        return {'name': self.name,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'total_seconds': self.total,
+                'stages': [asdict(record) for record in self.stages.values()]}
+
+    def summary(self):
+        total = self.total if self.total is not None else time.perf_counter() - self._start
+        lines = [f"{self.name}: {total:.3f} s"]
+        for record in self.stages.values():
+            line = f"  {record.name:20s} {record.seconds:8.3f} s {100 * record.seconds / max(total, 1e-9):5.1f} %"
+            if record.calls > 1:
+                line += f"  ({record.calls} calls)"
+            if record.peak_memory_mb is not None:
+                line += f"  peak +{record.peak_memory_mb:.1f} MB"
+            lines.append(line)
+        other = total - sum(record.seconds for record in self.stages.values())
+        lines.append(f"  {'(other)':20s} {other:8.3f} s")
+        return "\n".join(lines)
+
+
+@contextmanager
+def activate(profiler):
+    """Make `profiler` (or None, to profile nothing) receive the stages of this context."""
+    token = _active.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _active.reset(token)
+
+
+def active_profiler():
+    return _active.get()
+
+
+def stage(name):
+    """Time a stage in the active profiler, does nothing without one."""
+    profiler = _active.get()
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
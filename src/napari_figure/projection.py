@@ -0,0 +1,181 @@
+"""
+Reduction of nD layers (z-stacks, time series) to the 2D planes of a montage.
+
+The leading axes of a layer (all but the last two) are either projected
+(max, mean or sum) or sliced at a given position, e.g. the current dims
+position of the viewer. Projections are computed a few planes at a time, so
+that lazy stacks are never loaded whole, and are cached per array, axes,
+method and position of the other axes.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from .profiling import stage
+
+
+# 'slice' projects nothing, every leading axis is sliced
+PROJECTION_METHODS = ['slice', 'max', 'mean', 'sum']
+
+# size of the blocks read at once, in bytes
+CHUNK_BYTES = 64 * 2 ** 20
+# number of projections kept in the cache
+CACHE_SIZE = 16
+
+
+def projected_axes(ndim, axes=None, method='max'):
+    """The axes of an `ndim` array reduced by `method`, sorted.
+
+    `axes` are indices of the leading axes (negative ones are allowed), None
+    or empty means all the leading axes. The last two axes (the planes) are
+    never projected.
+    """
+    if method == 'slice' or ndim <= 2:
+        return ()
+    if not axes:
+        return tuple(range(ndim - 2))
+    normalized = sorted({axis % ndim for axis in axes})
+    if normalized[-1] >= ndim - 2:
+        raise ValueError(f"can't project over the plane axes of a {ndim}D image, got axes {list(axes)}")
+    return tuple(normalized)
+
+
+def projection_size(shape, axes=None, method='max'):
+    """Number of values reduced into each pixel of the projection."""
+    return int(np.prod([shape[axis] for axis in projected_axes(len(shape), axes, method)], dtype=np.int64))
+
+
+def _accumulator_dtype(dtype, method):
+    if method == 'max':
+        return dtype
+    if dtype.kind == 'f':
+        return np.float64
+    return np.uint64 if dtype.kind in 'ub' else np.int64
+
+
+def project(data, axes=None, method='max', chunk_bytes=CHUNK_BYTES):
+    """Reduce `data` over its leading `axes` with max, mean or sum.
+
+    Blocks of about `chunk_bytes` are read along the last projected axis and
+    reduced one after the other, so only one block and the result are in
+    memory. Sums are accumulated as (u)int64/float64, means are float32.
+    """
+    if method not in PROJECTION_METHODS[1:]:
+        raise ValueError(f"unknown projection {method!r}, expected one of {PROJECTION_METHODS[1:]}")
+    shape = np.shape(data)
+    axes = projected_axes(len(shape), axes, method)
+    if not axes:
+        return data
+
+    dtype = np.dtype(data.dtype)
+    accumulator_dtype = _accumulator_dtype(dtype, method)
+    outer, inner = axes[:-1], axes[-1]
+    # axes indexed with an integer are dropped, the inner axis moves left accordingly
+    inner_position = inner - len(outer)
+    plane_bytes = int(np.prod([length for axis, length in enumerate(shape) if axis not in axes], dtype=np.int64)) * dtype.itemsize
+    step = max(1, chunk_bytes // max(plane_bytes, 1))
+
+    result = None
+    for outer_index in np.ndindex(*[shape[axis] for axis in outer]):
+        index = [slice(None)] * len(shape)
+        for axis, position in zip(outer, outer_index):
+            index[axis] = position
+        for start in range(0, shape[inner], step):
+            index[inner] = slice(start, start + step)
+            block = np.asarray(data[tuple(index)])
+            if method == 'max':
+                partial = block.max(axis=inner_position)
+            else:
+                partial = block.sum(axis=inner_position, dtype=accumulator_dtype)
+            if result is None:
+                result = partial
+            elif method == 'max':
+                np.maximum(result, partial, out=result)
+            else:
+                result += partial
+
+    if method == 'mean':
+        return (result / projection_size(shape, axes)).astype(np.float32)
+    return result
+
+
+_projections = OrderedDict()
+_projections_lock = threading.Lock()
+
+
+def _reference(data):
+    # the cache must not keep removed layers alive when it can be avoided
+    try:
+        return weakref.ref(data)
+    except TypeError:
+        return lambda: data
+
+
+def cached_projection(data, axes=None, method='max', index=()):
+    """`project`, cached per array (by identity), axes, method and index.
+
+    `index` has the positions of the leading axes that are not projected, in
+    order. They are sliced before projecting, so that only the projected
+    axes at that position are read and kept in the cache.
+    """
+    ndim = np.ndim(data)
+    axes = projected_axes(ndim, axes, method)
+    if not axes:
+        return data
+    index = tuple(int(position) for position in index)
+    if len(index) != ndim - 2 - len(axes):
+        raise ValueError(f"expected {ndim - 2 - len(axes)} positions for the axes that are not projected, got {len(index)}")
+    key = (id(data), axes, method, index)
+    with _projections_lock:
+        if key in _projections:
+            reference, result = _projections[key]
+            if reference() is data:
+                _projections.move_to_end(key)
+                return result
+
+    positions = iter(index)
+    selection = tuple(slice(None) if axis in axes else next(positions) for axis in range(ndim - 2))
+    with stage('projection'):
+        # the projected axes are the leading axes of the slice
+        result = project(data[selection], tuple(range(len(axes))), method)
+
+    with _projections_lock:
+        _projections[key] = (_reference(data), result)
+        while len(_projections) > CACHE_SIZE:
+            _projections.popitem(last=False)
+    return result
+
+
+def clear_projections():
+    with _projections_lock:
+        _projections.clear()
+
+
+def montage_plane(data, method='slice', axes=None, position=None):
+    """The 2D plane of `data` shown in a montage.
+
+    The leading `axes` are projected with `method` (see `project`), the other
+    leading axes are sliced at `position` (one index per axis of `data`, e.g.
+    from the viewer dims), or in their middle when no position is given.
+    The other axes are sliced first, only the planes projected into the
+    result are read. Slices of lazy arrays stay lazy.
+    """
+    ndim = np.ndim(data)
+    if ndim < 2:
+        raise ValueError(f"can't show a {ndim}D image in a montage")
+    axes = projected_axes(ndim, axes, method)
+
+    index = []
+    for axis in range(ndim - 2):
+        if axis in axes:
+            continue
+        length = data.shape[axis]
+        if position is None:
+            index.append(length // 2)
+        else:
+            index.append(int(np.clip(round(float(position[axis])), 0, length - 1)))
+    if axes:
+        return cached_projection(data, axes, method, index)
+    return data[tuple(index)]
@@ -0,0 +1,166 @@
+"""
+On-disk cache of rendered montages, addressed by the hash of their inputs.
+
+A montage is fully determined by the files it shows (path, size and
+modification time, see `contrast.file_key`) and by the settings it is
+rendered with: slice or projection, LUTs, contrast limits, grid and output
+size. `render_key` hashes all of them, and the `RenderStore` keeps the
+rendered file under that hash:
+
+    store = RenderStore()
+    key = render_key('montage', file_key(path), settings, luts)
+    store.save(key, "figures/a_montage.png", lambda path: export_montage(path, ...))
+
+Rendering the same figure again copies the stored file, a modified file (or
+setting) is a new key and is rendered. The store is bounded in bytes, the
+least recently used files are removed first. Files are written to a
+temporary name and renamed, so that several processes (the batch workers)
+can share a store.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .file_index import cache_directory
+
+
+STORE_BYTES = 2048 * 2 ** 20
+# part of every key, to be increased when the rendering changes
+STORE_VERSION = 1
+
+
+def store_directory():
+    """Default directory of the store, in the plugin cache directory (see `file_index.cache_directory`)."""
+    return os.path.join(cache_directory(), 'renders')
+
+
+def _canonical(value):
+    # JSON-able version of a key part, arrays (LUTs, contrast limits) are replaced by a hash of their values
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        return {'shape': array.shape, 'dtype': array.dtype.str, 'sha1': hashlib.sha1(array.tobytes()).hexdigest()}
+    if isinstance(value, dict):
+        return {str(name): _canonical(item) for name, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def render_key(*parts):
+    """Hex digest of `parts` (numbers, strings, lists, dicts and numpy arrays)."""
+    text = json.dumps(_canonical([STORE_VERSION, *parts]), sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class RenderStore:
+    """Rendered files on disk, by key, bounded to `max_bytes` (LRU by modification time)."""
+    def __init__(self, directory=None, max_bytes=STORE_BYTES):
+        self._directory = directory
+        self.max_bytes = max_bytes
+
+    @property
+    def directory(self):
+        # the default directory is resolved (and created) when the store is used
+        return self._directory or store_directory()
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, f"{key}.{extension.lstrip('.')}")
+
+    def get(self, key, extension):
+        """The stored file of `key`, or None. A file found is marked as recently used."""
+        path = self.path(key, extension)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def render(self, key, extension, write):
+        """The stored file of `key`, written with `write(path)` when it is not stored yet.
+
+        Returns `(path, stored)`, `stored` being True when nothing was rendered.
+        """
+        path = self.get(key, extension)
+        if path is not None:
+            return path, True
+        path = self.path(key, extension)
+        os.makedirs(self.directory, exist_ok=True)
+        # the temporary file has the same extension, writers choose the format by it
+        handle, temporary = tempfile.mkstemp(suffix=f".{extension.lstrip('.')}", dir=self.directory)
+        os.close(handle)
+        try:
+            write(temporary)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.evict(keep=path)
+        return path, False
+
+    def save(self, key, output_path, write):
+        """Write the file of `key` to `output_path`, rendered with `write(path)` only when it is not stored.
+
+        Returns True when the stored file was used.
+        """
+        extension = os.path.splitext(str(output_path))[1].lstrip('.').lower()
+        path, stored = self.render(key, extension, write)
+        directory = os.path.dirname(str(output_path))
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        shutil.copyfile(path, output_path)
+        return stored
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        with os.scandir(self.directory) as it:
+            for item in it:
+                # files being written by other processes have a temporary name, see `render`
+                if item.is_file() and not item.name.startswith('tmp'):
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, item.path))
+        return entries
+
+    @property
+    def n_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep=None):
+        """Remove the least recently used files until the store fits in `max_bytes` (`keep` is never removed)."""
+        entries = sorted(self._entries())
+        n_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if n_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by another process
+                pass
+            n_bytes -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __contains__(self, key):
+        return any(os.path.basename(path).split('.')[0] == key for _, _, path in self._entries())
@@ -0,0 +1,299 @@
+"""
+Settings of the figures, shared by the widget and the batch runner (no Qt here).
+
+The per-channel settings are parsed and validated once, when they are set,
+and can be saved to / loaded from JSON or YAML profiles.
+"""
+import json
+import os
+from dataclasses import asdict, dataclass, field, fields, replace
+from typing import List, Optional
+
+from .colormaps import is_known
+from .contrast import AUTO_CONTRAST_METHODS
+from .projection import PROJECTION_METHODS
+
+# 'numpy' composes the montage with lookup tables, 'microfilm' draws it with matplotlib
+MONTAGE_ENGINES = ['numpy', 'microfilm']
+
+
+@dataclass
+class ChannelSettings:
+    name: str = "null"
+    colormap: str = "gray"
+    contrast_min: float = 0
+    contrast_max: float = 255
+
+    def __post_init__(self):
+        self.name = str(self.name)
+        self.colormap = str(self.colormap)
+        self.contrast_min = float(self.contrast_min)
+        self.contrast_max = float(self.contrast_max)
+        if not self.colormap:
+            raise ValueError("the colormap of a channel can't be empty")
+        if not is_known(self.colormap):
+            raise ValueError(f"channel {self.name}: unknown colormap {self.colormap!r}")
+        if self.contrast_min > self.contrast_max:
+            raise ValueError(f"channel {self.name}: min ({self.contrast_min:g}) is larger than max ({self.contrast_max:g})")
+
+    @property
+    def contrast_limits(self):
+        return [self.contrast_min, self.contrast_max]
+
+
+def default_channels():
+    return [ChannelSettings('DAPI', 'cyan'),
+            ChannelSettings('A488', 'biop_amber'),
+            ChannelSettings('A555', 'biop_brightpink')]
+
+
+# the settings saved in a profile, besides the channels
+PROFILE_FIELDS = ('channel_axis_value', 'lazy_loading', 'remove_existing_layers', 'reuse_layers',
+                  'auto_contrast', 'auto_contrast_low', 'auto_contrast_high',
+                  'montage_rows', 'montage_columns', 'montage_spacing', 'montage_engine', 'montage_live_preview',
+                  'montage_projection', 'montage_projection_axes',
+                  'montage_preview_dpi', 'montage_dpi', 'export_max_size', 'movie_axis', 'movie_fps')
+
+# the settings changing the montages rendered from a file, part of the keys of the stored renders (see render_store.py)
+RENDER_FIELDS = ('channel_axis_value', 'auto_contrast', 'auto_contrast_low', 'auto_contrast_high',
+                 'montage_rows', 'montage_columns', 'montage_spacing', 'montage_projection', 'montage_projection_axes',
+                 'export_max_size')
+
+
+@dataclass
+class Params:
+    # File settings
+    selected_file: Optional[str] = None
+    selected_directory: Optional[str] = None
+    load_button_status: bool = True
+    channel_axis_value: Optional[int] = None
+    lazy_loading: bool = True
+    # decoded images kept in memory (0: no cache), and decoding of the next/previous files in the background,
+    # see image_cache.py (not saved in profiles, they depend on the machine)
+    image_cache_mb: int = 1024
+    prefetch_neighbours: bool = True
+    # threads decoding the TIFF pages/tiles and coloring the channels (0: one per core)
+    threads: int = 0
+    # rendered montages kept on disk (0: no cache), and the directory of the saved figures
+    # (None: next to the images), see render_store.py
+    render_cache_mb: int = 2048
+    output_directory: Optional[str] = None
+    # Visual settings
+    channels: List[ChannelSettings] = field(default_factory=default_channels)
+    remove_existing_layers: bool = True
+    # with remove_existing_layers, the new channels replace the data of the matching layers
+    reuse_layers: bool = True
+    # 'none' uses the contrast limits of the channels, see contrast.AUTO_CONTRAST_METHODS
+    auto_contrast: str = 'none'
+    auto_contrast_low: float = 0.1
+    auto_contrast_high: float = 99.9
+    # Montage settings
+    montage_rows: int = 2
+    montage_columns: int = 4
+    montage_spacing: int = 3
+    montage_engine: str = 'numpy'
+    # render the montage again when the layers change (numpy engine only)
+    montage_live_preview: bool = False
+    # nD layers: 'slice' shows the current dims position, otherwise the leading axes in
+    # montage_projection_axes (all of them when empty) are projected, see projection.py
+    montage_projection: str = 'slice'
+    montage_projection_axes: List[int] = field(default_factory=list)
+    montage_preview_dpi: int = 100
+    montage_dpi: int = 600
+    # longest side of the montages exported by the numpy engine, in pixels (0: full resolution)
+    export_max_size: int = 8192
+    # movies of montages: one frame per index of this leading axis (e.g. time or z), see movie.py
+    movie_axis: int = 0
+    movie_fps: int = 10
+    # Diagnostics, see profiling.py
+    record_timings: bool = False
+    trace_memory: bool = False
+
+    def __post_init__(self):
+        self.validate()
+
+    def validate(self):
+        if self.montage_rows < 1 or self.montage_columns < 1:
+            raise ValueError("a montage needs at least 1 row and 1 column")
+        if self.montage_spacing < 0:
+            raise ValueError("the montage spacing can't be negative")
+        if self.export_max_size < 0:
+            raise ValueError("the export size can't be negative")
+        if self.movie_axis < 0:
+            raise ValueError("the movie axis can't be negative")
+        if self.movie_fps < 1:
+            raise ValueError("a movie needs at least 1 frame per second")
+        if self.image_cache_mb < 0:
+            raise ValueError("the image cache size can't be negative")
+        if self.render_cache_mb < 0:
+            raise ValueError("the render cache size can't be negative")
+        if self.threads < 0:
+            raise ValueError("the number of threads can't be negative")
+        if self.montage_engine not in MONTAGE_ENGINES:
+            raise ValueError(f"unknown montage engine {self.montage_engine!r}, expected one of {MONTAGE_ENGINES}")
+        if self.montage_projection not in PROJECTION_METHODS:
+            raise ValueError(f"unknown projection {self.montage_projection!r}, expected one of {PROJECTION_METHODS}")
+        if any(int(axis) != axis or axis < 0 for axis in self.montage_projection_axes):
+            raise ValueError("the projection axes must be non-negative integers")
+        if self.auto_contrast not in AUTO_CONTRAST_METHODS:
+            raise ValueError(f"unknown auto contrast method {self.auto_contrast!r}, expected one of {AUTO_CONTRAST_METHODS}")
+        if not 0 <= self.auto_contrast_low < self.auto_contrast_high <= 100:
+            raise ValueError("auto contrast percentiles must be increasing, between 0 and 100")
+        if self.channel_axis_value is not None and self.channel_axis_value < 0:
+            raise ValueError("the channel axis can't be negative")
+
+    def channels_for(self, n_channels):
+        """Settings of `n_channels` channels, missing ones are filled with defaults."""
+        channels = [replace(channel) for channel in self.channels[:n_channels]]
+        channels += [ChannelSettings() for _ in range(n_channels - len(channels))]
+        return channels
+
+    @property
+    def thread_count(self):
+        return self.threads or os.cpu_count() or 1
+
+    # Comma separated views of the channel settings, as edited in the widget.
+    # Setting one parses (and validates) it once, a ValueError leaves the settings unchanged.
+    @property
+    def channels_names(self):
+        return ",".join(channel.name for channel in self.channels)
+
+    @channels_names.setter
+    def channels_names(self, text):
+        self._set_channels_values('name', text, str)
+
+    @property
+    def channels_LUTs(self):
+        return ",".join(channel.colormap for channel in self.channels)
+
+    @channels_LUTs.setter
+    def channels_LUTs(self, text):
+        self._set_channels_values('colormap', text, str)
+
+    @property
+    def channels_mins(self):
+        return ",".join(_format_number(channel.contrast_min) for channel in self.channels)
+
+    @channels_mins.setter
+    def channels_mins(self, text):
+        self._set_channels_values('contrast_min', text, float)
+
+    @property
+    def channels_maxs(self):
+        return ",".join(_format_number(channel.contrast_max) for channel in self.channels)
+
+    @channels_maxs.setter
+    def channels_maxs(self, text):
+        self._set_channels_values('contrast_max', text, float)
+
+    def _set_channels_values(self, attribute, text, parse):
+        # empty entries (e.g. "DAPI,,A555") keep their position, with the default value
+        default = getattr(ChannelSettings(), attribute)
+        values = [parse(value.strip()) if value.strip() else default for value in text.split(",")] if text.strip() else []
+        channels = self.channels_for(max(len(values), len(self.channels)))
+        for idx, channel in enumerate(channels):
+            value = values[idx] if idx < len(values) else default
+            channels[idx] = ChannelSettings(**{**asdict(channel), attribute: value})
+        # channels left with only defaults are dropped
+        while channels and channels[-1] == ChannelSettings():
+            channels.pop()
+        self.channels = channels
+
+    def render_settings(self):
+        """The settings a montage depends on (`RENDER_FIELDS` and the channels), as a dictionary."""
+        settings = {name: getattr(self, name) for name in RENDER_FIELDS}
+        settings['channels'] = [asdict(channel) for channel in self.channels]
+        return settings
+
+    def to_profile(self):
+        profile = {name: getattr(self, name) for name in PROFILE_FIELDS}
+        profile['channels'] = [asdict(channel) for channel in self.channels]
+        return profile
+
+    def apply_profile(self, profile):
+        """Update these settings (in place) from a profile dictionary, after validating it."""
+        unknown = set(profile) - set(PROFILE_FIELDS) - {'channels'}
+        if unknown:
+            raise ValueError(f"unknown settings in profile: {', '.join(sorted(unknown))}")
+
+        types = {f.name: f.type for f in fields(self)}
+        values = {}
+        for name in PROFILE_FIELDS:
+            if name in profile:
+                value = profile[name]
+                values[name] = value if value is None else _coerce(types[name], value)
+        if 'channels' in profile:
+            values['channels'] = [ChannelSettings(**channel) for channel in profile['channels']]
+
+        # validate everything before changing anything
+        replace(self, **values)
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def save_profile(self, path):
+        _write_profile(path, self.to_profile())
+
+    def load_profile(self, path):
+        self.apply_profile(_read_profile(path))
+
+
+def _format_number(value):
+    # shortest text parsed back to the same float (the boxes are written back through the setters), without '.0'
+    text = repr(float(value))
+    return text[:-2] if text.endswith('.0') else text
+
+
+def _coerce(field_type, value):
+    if field_type in (bool, Optional[bool]):
+        return _parse_bool(value)
+    if field_type in (int, Optional[int]):
+        return _parse_int(value)
+    for python_type in (float, str):
+        if field_type in (python_type, Optional[python_type]):
+            return python_type(value)
+    return value
+
+
+def _parse_bool(value):
+    # bool("false") is True, only real booleans and "true"/"false" are accepted
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    raise ValueError(f"expected true or false, got {value!r}")
+
+
+def _parse_int(value):
+    # int(2.7) is 2, only whole numbers are accepted
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"expected a whole number, got {value!r}")
+    return int(value)
+
+
+def _is_yaml(path):
+    return os.path.splitext(str(path))[1].lower() in ('.yaml', '.yml')
+
+
+def _write_profile(path, profile):
+    with open(path, 'w') as file:
+        if _is_yaml(path):
+            import yaml
+            yaml.safe_dump(profile, file, sort_keys=False)
+        else:
+            json.dump(profile, file, indent=2)
+
+
+def _read_profile(path):
+    with open(path) as file:
+        if _is_yaml(path):
+            import yaml
+            try:
+                profile = yaml.safe_load(file)
+            except yaml.YAMLError as error:
+                # as json.JSONDecodeError, a ValueError
+                raise ValueError(f"{path} is not valid YAML: {error}") from error
+        else:
+            profile = json.load(file)
+    if not isinstance(profile, dict):
+        raise ValueError(f"{path} is not a settings profile")
+    return profile